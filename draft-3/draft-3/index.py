@@ -1,33 +1,113 @@
 #!/usr/bin/env python
 
 # Toy program to generate inverted index of word to line.
-# Takes input text file on stdin and prints output index on stdout.
+# Takes input text file and writes the index to <file>.idx1, one
+# "word: line, line, ..." entry per line, sorted by word.  Also writes the
+# byte offset of the start of each line to <file>.offsets as little-endian
+# 64 bit integers, so that search.py can seek straight to a line.
+#
+# Words are collected in batches of at most MAX_PAIRS (word, line) pairs.
+# If the input has more than one batch, each is written to a temporary file
+# in the same format as the index, and the batches are then merged, so
+# memory use does not grow with the size of the input.
 
 import sys
 import os
+import heapq
+import shutil
+import struct
+import tempfile
 
-words = {}
+MAX_PAIRS = 1000000
 
-mainfile = sys.argv[1]
-indexfile = sys.argv[1] + ".idx1"
-
-main = open(mainfile)
-index = open(indexfile, "w")
-
-linenum = 0
-for l in main:
-    linenum += 1
+def words(l):
     l = l.rstrip().lower().replace(".", "").replace(",", "").replace(";", "").replace("-", " ")
     for w in l.split(" "):
         if w:
-            if w not in words:
-                words[w] = set()
-            words[w].add(linenum)
+            yield w
+
+def write_batch(words, index):
+    for w in sorted(words.keys()):
+        index.write("%s: %s" % (w, ", ".join((str(i) for i in words[w]))) + "\n")
+
+def read_batch(path, n):
+    # Words never contain spaces, so the first ": " ends the word.
+    with open(path) as f:
+        for l in f:
+            w, lines = l.rstrip("\n").split(": ", 1)
+            yield (w, n, lines)
+
+def merge_batches(batches, index):
+    # A word's lines in an earlier batch all come before its lines in a
+    # later batch, so merging by (word, batch) keeps them in order.
+    word = None
+    for w, n, lines in heapq.merge(*[read_batch(b, n) for n, b in enumerate(batches)]):
+        if w != word:
+            if word is not None:
+                index.write("\n")
+            word = w
+            index.write("%s: %s" % (w, lines))
+        else:
+            index.write(", " + lines)
+    if word is not None:
+        index.write("\n")
+
+def main(mainfile, max_pairs=MAX_PAIRS):
+    indexfile = mainfile + ".idx1"
+    offsetsfile = mainfile + ".offsets"
+
+    tmpdir = None
+    batches = []
+    words_in_batch = {}
+    pairs = 0
+    offset = 0
+    offsets = []
+    try:
+        with open(mainfile, "rb") as main, open(offsetsfile, "wb") as out:
+            linenum = 0
+            for l in main:
+                linenum += 1
+                offsets.append(offset)
+                offset += len(l)
+                if len(offsets) == 65536:
+                    out.write(struct.pack("<%iQ" % len(offsets), *offsets))
+                    offsets = []
+                for w in words(l):
+                    lines = words_in_batch.get(w)
+                    if lines is None:
+                        words_in_batch[w] = [linenum]
+                    elif lines[-1] != linenum:
+                        lines.append(linenum)
+                    else:
+                        continue
+                    pairs += 1
+                if pairs >= max_pairs:
+                    if tmpdir is None:
+                        tmpdir = tempfile.mkdtemp()
+                    batches.append(os.path.join(tmpdir, "batch%i" % len(batches)))
+                    with open(batches[-1], "w") as f:
+                        write_batch(words_in_batch, f)
+                    words_in_batch = {}
+                    pairs = 0
+            out.write(struct.pack("<%iQ" % len(offsets), *offsets))
+
+        with open(indexfile, "w") as index:
+            if batches:
+                if words_in_batch:
+                    batches.append(os.path.join(tmpdir, "batch%i" % len(batches)))
+                    with open(batches[-1], "w") as f:
+                        write_batch(words_in_batch, f)
+                merge_batches(batches, index)
+            else:
+                write_batch(words_in_batch, index)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
 
-for w in sorted(words.keys()):
-    index.write("%s: %s" % (w, ", ".join((str(i) for i in words[w]))) + "\n")
+if __name__ == "__main__":
+    main(sys.argv[1], *[int(a) for a in sys.argv[2:3]])
 
-open(os.path.splitext(sys.argv[1])[0] + ".idx2", "w")
-open(sys.argv[1] + ".idx3", "w")
-open(sys.argv[1] + ".idx4", "w")
-open(sys.argv[1] + ".idx5", "w")
+    open(os.path.splitext(sys.argv[1])[0] + ".idx2", "w")
+    open(sys.argv[1] + ".idx3", "w")
+    open(sys.argv[1] + ".idx4", "w")
+    open(sys.argv[1] + ".idx5", "w")
@@ -2,24 +2,76 @@
 
 # Toy program to search inverted index and print out each line the term
 # appears.
+#
+# The index (see index.py) is sorted by word, so the entry for the term is
+# found by binary search, and each line is read directly from the offset
+# recorded for it in <file>.offsets.  Indexes without the offsets file are
+# searched by reading the main file from the start.
 
 import sys
+import os
+import mmap
+import struct
 
-mainfile = sys.argv[1]
-indexfile = sys.argv[1] + ".idx1"
-term = sys.argv[2]
+def open_mmap(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-main = open(mainfile)
-index = open(indexfile)
+def find_entry(index, term):
+    """Return the line numbers listed for `term` in `index`, or None."""
 
-st = term + ": "
+    # Words never contain spaces, so the first ": " ends the word.
+    lo, hi = 0, len(index)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = index.rfind("\n", 0, mid) + 1
+        end = index.find("\n", start)
+        if end == -1:
+            end = len(index)
+        if index[start:index.find(": ", start, end)] < term:
+            lo = end + 1
+        else:
+            hi = start
 
-for a in index:
-    if a.startswith(st):
-        n = [int(i) for i in a[len(st):].split(", ") if i]
+    st = term + ": "
+    end = index.find("\n", lo)
+    if end == -1:
+        end = len(index)
+    if index[lo:lo + len(st)] != st:
+        return None
+    return [int(i) for i in index[lo + len(st):end].split(", ") if i]
+
+def print_lines(mainfile, n):
+    n = sorted(set(n))
+    if not os.path.exists(mainfile + ".offsets"):
+        n = set(n)
         linenum = 0
-        for l in main:
+        for l in open(mainfile):
             linenum += 1
             if linenum in n:
                 print linenum, l.rstrip()
-        break
+        return
+
+    main = open_mmap(mainfile)
+    offsets = open_mmap(mainfile + ".offsets")
+    count = len(offsets) // 8
+    for linenum in n:
+        if linenum > count:
+            break
+        start, = struct.unpack_from("<Q", offsets, (linenum - 1) * 8)
+        if linenum < count:
+            end, = struct.unpack_from("<Q", offsets, linenum * 8)
+        else:
+            end = len(main)
+        print linenum, main[start:end].rstrip()
+
+if __name__ == "__main__":
+    mainfile = sys.argv[1]
+    indexfile = sys.argv[1] + ".idx1"
+    term = sys.argv[2]
+
+    n = find_entry(open_mmap(indexfile), term)
+    if n is not None:
+        print_lines(mainfile, n)
@@ -0,0 +1,247 @@
+"""Load and validate documents without blocking the calling thread.
+
+`AsyncLoader` wraps a Loader session.  Its methods return futures at once
+and do their work on two executors: documents reachable through `$import`
+and `$include` are fetched concurrently on the I/O executor, and parsing,
+resolution and validation run on the CPU executor.
+
+    al = AsyncLoader(document_loader)
+    f = al.load_and_validate(avsc_names, "file:///path/to/tool.cwl", True)
+    data, metadata = f.result()
+
+An executor is any object with a `submit(fn, *args, **kwargs)` method that
+returns a future with `result()`, such as `concurrent.futures.ThreadPoolExecutor`
+where that is available; asyncio code can then await the futures through
+`asyncio.wrap_future`.  By default two shared `PoolExecutor`s are used.
+
+The fetcher is a function that takes a URL and returns the text of the
+document; it runs on the I/O executor.  The default is the loader's own
+`fetch_text`.  Fetched text is stored in the loader's cache, and parsed
+documents in its `prefetched` table, so that resolution itself never waits
+on the network.  A document that cannot be fetched or parsed during the
+prefetch is fetched again by the resolver, which reports the error as usual.
+
+Prefetching runs on the CPU executor and waits for the fetches it submits
+to the I/O executor.  If both are the same executor the documents are
+fetched one at a time on the waiting thread instead, since the fetches could
+otherwise wait for a free thread forever.  Documents that were prefetched
+but not used, for example because resolution failed first, are dropped when
+the operation finishes.
+
+A Loader session is not safe for concurrent use, so operations on one
+AsyncLoader should not overlap; use one session per document.
+"""
+
+import os
+import sys
+import threading
+import urlparse
+from multiprocessing.pool import ThreadPool
+import schema
+from fetcher import text_hash
+
+IO_THREADS = 8
+CPU_THREADS = 2
+
+class Future(object):
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for result")
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+def _call(future, fn, args, kwargs):
+    try:
+        result = fn(*args, **kwargs)
+    except Exception:
+        future.set_exc_info(sys.exc_info())
+    else:
+        future.set_result(result)
+
+class PoolExecutor(object):
+    """A minimal executor on top of multiprocessing's ThreadPool."""
+
+    def __init__(self, threads):
+        self.pool = ThreadPool(threads)
+
+    def submit(self, fn, *args, **kwargs):
+        f = Future()
+        self.pool.apply_async(_call, (f, fn, args, kwargs))
+        return f
+
+    def shutdown(self):
+        self.pool.close()
+        self.pool.join()
+
+_default_lock = threading.Lock()
+_default_executors = {}
+
+def _default_executor(name, threads):
+    with _default_lock:
+        if name not in _default_executors:
+            _default_executors[name] = PoolExecutor(threads)
+        return _default_executors[name]
+
+def _completed(result):
+    f = Future()
+    f.set_result(result)
+    return f
+
+def _directives(loader, document, base_url):
+    """Yield (url, kind) for each `$import` and `$include` in `document`."""
+
+    stack = [document]
+    while stack:
+        d = stack.pop()
+        if isinstance(d, dict):
+            for kind in ("$import", "$include"):
+                if isinstance(d.get(kind), basestring):
+                    url = urlparse.urldefrag(loader.expand_url(d[kind], base_url))[0]
+                    yield url, kind[1:]
+            stack.extend(v for v in d.itervalues() if isinstance(v, (dict, list)))
+        elif isinstance(d, list):
+            stack.extend(v for v in d if isinstance(v, (dict, list)))
+
+class AsyncLoader(object):
+    def __init__(self, loader, executor=None, io_executor=None, fetcher=None):
+        self.loader = loader
+        self.executor = executor or _default_executor("cpu", CPU_THREADS)
+        self.io_executor = io_executor or _default_executor("io", IO_THREADS)
+        self.fetcher = fetcher or loader.fetch_text
+
+    def _fetch_and_cache(self, url):
+        text = self.fetcher(url)
+        self.loader.cache[url] = text
+        return text
+
+    def fetch_text(self, url):
+        text = self.loader.cache.get(url)
+        if text is not None:
+            return _completed(text)
+        return self.io_executor.submit(self._fetch_and_cache, url)
+
+    def _fetch_text_inline(self, url):
+        f = Future()
+        _call(f, self._fetch_and_cache, (url,), {})
+        return f
+
+    def prefetch(self, roots, document=None, base_url=None):
+        """Fetch the documents in `roots` (a dict of URL to "import" or
+        "include"), or referenced by `document`, and everything that they
+        import or include, fetching each round of references concurrently.
+        Blocks until done; run it on an executor.  Returns the URLs of the
+        documents added to the loader's `prefetched` table."""
+
+        loader = self.loader
+        if self.executor is self.io_executor:
+            fetch_text = self._fetch_text_inline
+        else:
+            fetch_text = self.fetch_text
+        added = []
+        pending = dict(roots)
+        if document is not None:
+            for url, kind in _directives(loader, document, base_url):
+                if pending.get(url) != "import":
+                    pending[url] = kind
+        seen = set()
+        while pending:
+            batch = [(url, kind) for url, kind in pending.iteritems()
+                     if url not in seen and url not in loader.idx and url not in loader.prefetched]
+            seen.update(pending)
+            pending = {}
+            for url, kind, f in [(url, kind, fetch_text(url)) for url, kind in batch]:
+                try:
+                    text = f.result()
+                    if kind == "import":
+                        doc = loader.parse_text(url, text)
+                except Exception:
+                    continue
+                if kind == "import":
+                    loader.prefetched[url] = (doc, len(text), text_hash(text))
+                    added.append(url)
+                    for u, k in _directives(loader, doc, url):
+                        if u not in seen and pending.get(u) != "import":
+                            pending[u] = k
+        return added
+
+    def _discard(self, urls):
+        for url in urls:
+            self.loader.prefetched.pop(url, None)
+
+    def _roots(self, ref, base_url):
+        base_url = base_url or 'file://%s/' % os.path.abspath('.')
+        kind = "import"
+        if isinstance(ref, dict):
+            if "$import" in ref:
+                ref = ref["$import"]
+            elif "$include" in ref:
+                ref, kind = ref["$include"], "include"
+            else:
+                return {}, ref, base_url
+        if not isinstance(ref, basestring):
+            return {}, None, base_url
+        return {urlparse.urldefrag(self.loader.expand_url(ref, base_url))[0]: kind}, None, base_url
+
+    def fetch(self, url):
+        def work():
+            added = self.prefetch({url: "import"})
+            try:
+                return self.loader.fetch(url)
+            finally:
+                self._discard(added)
+        return self.executor.submit(work)
+
+    def resolve_ref(self, ref, base_url=None):
+        def work():
+            roots, document, base = self._roots(ref, base_url)
+            added = self.prefetch(roots, document, base)
+            try:
+                return self.loader.resolve_ref(ref, base_url)
+            finally:
+                self._discard(added)
+        return self.executor.submit(work)
+
+    def load_and_validate(self, avsc_names, document, strict):
+        def work():
+            if isinstance(document, dict):
+                added = self.prefetch({}, document, document["id"])
+            else:
+                added = self.prefetch(*self._roots(document, None))
+            try:
+                return schema.load_and_validate(self.loader, avsc_names, document, strict)
+            finally:
+                self._discard(added)
+        return self.executor.submit(work)
@@ -0,0 +1,182 @@
+"""Generate code for loading documents of a schema into typed objects.
+
+    schema-salad-tool --codegen python schema.yml > schema_classes.py
+
+The input is the Avro schema made by `schema.make_avro_schema`.  The
+generated Python module has a class with `__slots__` for each record type, a
+class holding the symbols of each enum type, and a `load_document` function
+that checks a resolved document against the schema and builds the objects in
+one pass, instead of validating the document and then reading it as nested
+dicts:
+
+    import schema_classes
+    document, metadata = document_loader.resolve_ref(uri)
+    tool = schema_classes.load_document(document, strict=True,
+                                        identifiers=document_loader.identifiers,
+                                        foreign_properties=document_loader.foreign_properties)
+    for inp in tool.inputs:
+        print inp.id, inp.type
+
+Field names that are Python keywords get a trailing underscore, so the
+`class` field is the `class_` attribute.  See `typed.py` for the classes the
+generated code uses.
+"""
+
+import json
+import keyword
+import re
+
+PRIMITIVES = ("null", "boolean", "int", "long", "float", "double", "bytes", "string")
+
+def _identifier(name):
+    name = re.sub(r"\W", "_", name)
+    if not name or name[0].isdigit():
+        name = "_" + name
+    if keyword.iskeyword(name) or name in ("extension_fields", "None", "True", "False"):
+        name += "_"
+    return name
+
+class PythonCodeGen(object):
+    def __init__(self, avsc_obj):
+        self.types = []
+        self.named = {}
+        self.classes = {}
+        self.loaders = {}
+        self.loader_lines = []
+        for t in avsc_obj:
+            self.collect(t)
+        used = set()
+        for t in self.types:
+            name = _identifier(t["name"])
+            while name in used:
+                name += "_"
+            used.add(name)
+            self.classes[t["name"]] = name
+
+    def collect(self, t):
+        # Named types are defined where they first appear and referred to by
+        # name after that.
+        if isinstance(t, list):
+            for i in t:
+                self.collect(i)
+        elif isinstance(t, dict):
+            if t.get("type") in ("record", "enum") and "name" in t:
+                if t["name"] in self.named:
+                    return
+                self.named[t["name"]] = t
+                self.types.append(t)
+            if t.get("type") == "record":
+                for f in t.get("fields", []):
+                    self.collect(f["type"])
+            elif t.get("type") == "array":
+                self.collect(t["items"])
+            elif t.get("type") == "map":
+                self.collect(t["values"])
+
+    def lookup(self, name):
+        if name in self.named:
+            return self.named[name]
+        return self.named[name.rsplit(".", 1)[-1]]
+
+    def loader(self, t):
+        """Return the name of the loader variable for type `t`, defining it
+        (and the loaders it uses) first if needed."""
+
+        if isinstance(t, basestring) and t not in PRIMITIVES:
+            t = self.lookup(t)
+        if isinstance(t, dict) and t.get("type") in PRIMITIVES:
+            t = t["type"]
+        if isinstance(t, dict) and t.get("type") in ("record", "enum"):
+            key = t["name"]
+        else:
+            key = json.dumps(t, sort_keys=True)
+        if key in self.loaders:
+            return self.loaders[key]
+
+        if isinstance(t, basestring):
+            expr = "typed.PrimitiveLoader(%r)" % str(t)
+        elif isinstance(t, list):
+            expr = "typed.UnionLoader((%s,))" % ", ".join(self.loader(i) for i in t)
+        elif t["type"] == "record":
+            expr = "typed.RecordLoader(%s)" % self.classes[t["name"]]
+        elif t["type"] == "enum" and t["name"] == "Any":
+            expr = "typed.AnyLoader()"
+        elif t["type"] == "enum":
+            expr = "typed.EnumLoader(%s)" % self.classes[t["name"]]
+        elif t["type"] == "array":
+            expr = "typed.ArrayLoader(%s)" % self.loader(t["items"])
+        elif t["type"] == "map":
+            expr = "typed.MapLoader(%s)" % self.loader(t["values"])
+        else:
+            raise Exception("Unsupported type %s" % json.dumps(t))
+
+        var = "_loader%i" % len(self.loader_lines)
+        self.loader_lines.append("%s = %s" % (var, expr))
+        self.loaders[key] = var
+        return var
+
+    def write_enum(self, t, out):
+        out.write("class %s(typed.Enum):\n" % self.classes[t["name"]])
+        out.write("    name = %r\n" % str(t["name"]))
+        out.write("    symbols = (%s)\n" % "".join("%r, " % str(s) for s in t["symbols"]))
+        out.write("    symbol_set = frozenset(symbols)\n\n")
+
+    def write_record(self, t, out):
+        fields = [(str(f["name"]), _identifier(f["name"])) for f in t.get("fields", [])]
+        out.write("class %s(typed.Record):\n" % self.classes[t["name"]])
+        doc = t.get("doc", "").strip().split("\n\n")[0].strip()
+        if doc:
+            out.write("    %r\n\n" % " ".join(doc.split()))
+        out.write("    __slots__ = (%s)\n" % "".join("%r, " % a for _, a in fields))
+        out.write("    _fields = (%s)\n" % "".join("(%r, %r), " % f for f in fields))
+        out.write("    _field_names = frozenset(n for n, _ in _fields)\n\n")
+        out.write("    def __init__(self%s, extension_fields=None):\n" % "".join(", %s=None" % a for _, a in fields))
+        for _, a in fields:
+            out.write("        self.%s = %s\n" % (a, a))
+        out.write("        self.extension_fields = extension_fields\n\n")
+
+    def generate(self, out):
+        out.write('"""Classes generated by schema-salad-tool --codegen python.  Do not edit."""\n\n')
+        out.write("from schema_salad import typed\n")
+        out.write("from schema_salad.validate import ValidationException\n\n")
+
+        for t in self.types:
+            if t["type"] == "enum":
+                if t["name"] != "Any":
+                    self.write_enum(t, out)
+            else:
+                self.write_record(t, out)
+
+        # Loaders come after all the classes, since records may refer to
+        # types defined after them, or to themselves.
+        records = []
+        for t in self.types:
+            if t["type"] == "record":
+                records.append((t, [(f, self.loader(f["type"])) for f in t.get("fields", [])]))
+        roots = [self.loader(t) for t in self.types if t["type"] == "record" and t.get("documentRoot")]
+
+        for l in self.loader_lines:
+            out.write(l + "\n")
+        out.write("\n")
+        for t, fields in records:
+            out.write("%s._loaders = (%s)\n" % (self.classes[t["name"]], "".join(
+                "(%r, %r, %s, %r), " % (str(f["name"]), _identifier(f["name"]), l, f.get("default"))
+                for f, l in fields)))
+        out.write("\n_roots = (%s)\n\n" % "".join("%s, " % r for r in roots))
+
+        out.write('''def load_document(doc, strict=True, identifiers=(), foreign_properties=()):
+    """Load a resolved document (or list of documents), returning the
+    object(s) built from it.  Raises ValidationException if it does not
+    match the schema."""
+
+    return typed.load_document(_roots, doc, typed.LoadingOptions(strict, identifiers, foreign_properties))
+''')
+
+def codegen(lang, avsc_obj, out):
+    """Write code for loading documents of the schema `avsc_obj` in `lang`
+    (only "python" is supported) to `out`."""
+
+    if lang == "python":
+        PythonCodeGen(avsc_obj).generate(out)
+    else:
+        raise Exception("Unsupported code generation language '%s'" % lang)
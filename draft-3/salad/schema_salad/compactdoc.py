@@ -0,0 +1,283 @@
+"""Compact binary serialization of resolved documents.
+
+After resolution nearly every key and link in a document is an absolute URI,
+so the JSON form repeats the same long prefixes over and over.  This format
+stores each distinct string once in a string table, and each string as a
+reference to a shared prefix (everything up to the last '/' or '#') plus its
+own suffix.  Containers that appear more than once in the document, such as
+objects brought in by `$import` or entries of the id index, are stored once
+and referenced afterwards, so identity is preserved on load.
+
+Layout (all integers are unsigned LEB128 varints):
+
+    magic "SALADCD1"
+    prefix count, then for each prefix: byte length, utf-8 bytes
+    string count, then for each string: (prefix number + 1 (0 for none)) * 2
+        + 1 if it is a unicode string, byte length of suffix, utf-8 bytes of
+        suffix
+    the document, as a value
+    index entry count, then for each entry: string number of the id, value
+
+A value is a one byte tag followed by its payload:
+
+    n, t, f     None, True, False
+    i           zigzag-encoded integer
+    d           IEEE 754 double, little endian
+    s           string number
+    l           item count, then the items
+    m           entry count, then alternating keys and values
+    r           back-reference to the n'th list or dict, counted in order of
+                first appearance
+"""
+
+import mmap
+import struct
+
+MAGIC = "SALADCD1"
+
+_double = struct.Struct("<d")
+
+_NOKEY = object()
+
+def _split(s):
+    # Byte strings are stored as-is, unicode strings as utf-8; '/' and '#'
+    # never occur inside a multibyte utf-8 sequence, so splitting is safe.
+    b = s.encode("utf-8") if isinstance(s, unicode) else s
+    p = max(b.rfind("/"), b.rfind("#"))
+    if p > 0:
+        return b[:p+1], b[p+1:]
+    return None, b
+
+class _Encoder(object):
+    def __init__(self):
+        self.out = bytearray()
+        self.strings = {}
+        self.prefixes = {}
+        self.containers = {}
+
+    def varint(self, n, out=None):
+        out = self.out if out is None else out
+        while True:
+            b = n & 0x7f
+            n >>= 7
+            if n:
+                out.append(b | 0x80)
+            else:
+                out.append(b)
+                return
+
+    def string(self, s):
+        if s not in self.strings:
+            self.strings[s] = len(self.strings)
+        return self.strings[s]
+
+    def value(self, v):
+        # Walk with an explicit stack of values still to be written, so that
+        # the nesting depth is not limited by the recursion limit.  Values
+        # are written in the same order as a recursive walk would.
+        out = self.out
+        stack = [v]
+        while stack:
+            v = stack.pop()
+            if v is None:
+                out.append("n")
+            elif v is True:
+                out.append("t")
+            elif v is False:
+                out.append("f")
+            elif isinstance(v, (int, long)):
+                out.append("i")
+                self.varint((v << 1) if v >= 0 else ((-v << 1) - 1))
+            elif isinstance(v, float):
+                out.append("d")
+                out.extend(_double.pack(v))
+            elif isinstance(v, basestring):
+                out.append("s")
+                self.varint(self.string(v))
+            elif isinstance(v, (list, dict)):
+                if id(v) in self.containers:
+                    out.append("r")
+                    self.varint(self.containers[id(v)][0])
+                    continue
+                # Keep a reference to the container so that its id() stays unique.
+                self.containers[id(v)] = (len(self.containers), v)
+                if isinstance(v, list):
+                    out.append("l")
+                    self.varint(len(v))
+                    stack.extend(reversed(v))
+                else:
+                    out.append("m")
+                    self.varint(len(v))
+                    for k, i in reversed(v.items()):
+                        stack.append(i)
+                        stack.append(k)
+            else:
+                raise ValueError("Cannot encode value of type %s: %s" % (type(v).__name__, v))
+
+    def header(self):
+        strings = sorted(self.strings, key=self.strings.get)
+        split = [_split(s) for s in strings]
+        for p, _ in split:
+            if p is not None and p not in self.prefixes:
+                self.prefixes[p] = len(self.prefixes)
+
+        out = bytearray(MAGIC)
+        self.varint(len(self.prefixes), out)
+        for p in sorted(self.prefixes, key=self.prefixes.get):
+            self.varint(len(p), out)
+            out.extend(p)
+        self.varint(len(split), out)
+        for s, (p, suffix) in zip(strings, split):
+            self.varint(((0 if p is None else self.prefixes[p] + 1) << 1) | isinstance(s, unicode), out)
+            self.varint(len(suffix), out)
+            out.extend(suffix)
+        return out
+
+class _Decoder(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.containers = []
+
+    def varint(self):
+        data = self.data
+        n = 0
+        shift = 0
+        while True:
+            b = ord(data[self.pos])
+            self.pos += 1
+            n |= (b & 0x7f) << shift
+            if not b & 0x80:
+                return n
+            shift += 7
+
+    def raw(self):
+        n = self.varint()
+        raw = self.data[self.pos:self.pos+n]
+        self.pos += n
+        return raw
+
+    def header(self):
+        if self.data[0:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a compact document (bad magic number)")
+        self.pos = len(MAGIC)
+        prefixes = [self.raw() for _ in xrange(self.varint())]
+        self.strings = []
+        for _ in xrange(self.varint()):
+            p = self.varint()
+            s = self.raw()
+            if p >> 1:
+                s = prefixes[(p >> 1) - 1] + s
+            if p & 1:
+                # ASCII text is kept as str, which compares equal to unicode.
+                try:
+                    s.decode("ascii")
+                except UnicodeDecodeError:
+                    s = s.decode("utf-8")
+            self.strings.append(s)
+
+    def _scalar(self, tag):
+        if tag == "r":
+            return self.containers[self.varint()]
+        elif tag == "i":
+            n = self.varint()
+            return (n >> 1) if not n & 1 else -((n + 1) >> 1)
+        elif tag == "d":
+            v = _double.unpack_from(self.data, self.pos)[0]
+            self.pos += 8
+            return v
+        elif tag == "n":
+            return None
+        elif tag == "t":
+            return True
+        elif tag == "f":
+            return False
+        raise ValueError("Corrupt compact document, unknown tag %r at offset %i" % (tag, self.pos - 1))
+
+    def value(self):
+        # Containers being filled, as [container, items left, key]; a key of
+        # _NOKEY means the next value read is a key of the dict, and lists
+        # have a key of None.
+        data = self.data
+        strings = self.strings
+        varint = self.varint
+        stack = []
+        while True:
+            tag = data[self.pos]
+            self.pos += 1
+            if tag == "s":
+                v = strings[varint()]
+            elif tag == "m" or tag == "l":
+                v = {} if tag == "m" else []
+                self.containers.append(v)
+                n = varint()
+                if n:
+                    stack.append([v, n, _NOKEY if tag == "m" else None])
+                    continue
+            else:
+                v = self._scalar(tag)
+
+            # Add v to the innermost container, and every container that
+            # this completes to its own parent.
+            while stack:
+                top = stack[-1]
+                key = top[2]
+                if key is None:
+                    top[0].append(v)
+                elif key is _NOKEY:
+                    top[2] = v
+                    break
+                else:
+                    top[0][key] = v
+                    top[2] = _NOKEY
+                top[1] -= 1
+                if top[1]:
+                    break
+                stack.pop()
+                v = top[0]
+            else:
+                return v
+
+def dumps(document, idx=None):
+    """Encode a resolved document, and optionally the id index (a mapping of
+    id to object, such as `Loader.idx`), as a byte string."""
+
+    enc = _Encoder()
+    enc.value(document)
+    idx = idx or {}
+    enc.varint(len(idx))
+    for k, v in idx.iteritems():
+        enc.varint(enc.string(k))
+        enc.value(v)
+    return str(enc.header() + enc.out)
+
+def loads(data):
+    """Decode a compact document from a byte string or buffer.  Returns a
+    tuple of (document, idx) where `idx` maps ids to objects within
+    `document`."""
+
+    dec = _Decoder(data)
+    dec.header()
+    document = dec.value()
+    idx = {}
+    for _ in xrange(dec.varint()):
+        k = dec.strings[dec.varint()]
+        idx[k] = dec.value()
+    return document, idx
+
+def dump(document, fp, idx=None):
+    fp.write(dumps(document, idx))
+
+def load(fp):
+    """Decode a compact document from a file object.  Regular files are
+    mapped into memory and decoded from the mapping, rather than read into a
+    string first; the strings in the document are still copied out of it."""
+
+    try:
+        m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, IOError, ValueError, EnvironmentError):
+        return loads(fp.read())
+    try:
+        return loads(m)
+    finally:
+        m.close()
@@ -0,0 +1,97 @@
+"""Document-level dependency graph built while loading.
+
+Each node is the URL of a document (without fragment).  An edge from A to B
+records that A depends on B, and carries one or more kinds:
+
+    import      A contains `$import` of (part of) B
+    include     A contains `$include` of B
+    schema      A lists B in `$schemas`
+    <field>     A has a link field (such as `run`) that refers to B
+
+Links to data, such as the `path` of a File, are not recorded for a Loader
+whose context names its document link fields (see LoaderContext).
+
+The Loader keeps the stack of documents that are being resolved in
+`loading`, so that an `$import` of a document that is still being loaded is
+reported as a cycle instead of being followed.
+"""
+
+import collections
+import validate
+
+LOAD_KINDS = frozenset(("import", "include", "schema"))
+
+class DependencyGraph(object):
+    def __init__(self):
+        self.edges = collections.OrderedDict()
+        self.loading = []
+
+    def add_node(self, url):
+        if url not in self.edges:
+            self.edges[url] = collections.OrderedDict()
+
+    def add_edge(self, src, dst, kind):
+        if src == dst:
+            return
+        self.add_node(src)
+        self.add_node(dst)
+        self.edges[src].setdefault(dst, set()).add(kind)
+
+    def dependencies(self, url, kinds=None):
+        return [dst for dst, k in self.edges.get(url, {}).iteritems()
+                if kinds is None or k & kinds]
+
+    def dependents(self, url, kinds=None):
+        return [src for src, deps in self.edges.iteritems()
+                if url in deps and (kinds is None or deps[url] & kinds)]
+
+    def cycle_path(self, url):
+        """If `url` is being loaded, return the chain of documents from it to
+        the document currently being loaded, else None."""
+
+        if url in self.loading:
+            return self.loading[self.loading.index(url):]
+        return None
+
+    def order(self, kinds=None):
+        """Return the documents in an order where each comes after all of the
+        documents it depends on.  Only edges with one of `kinds` are
+        considered (all edges if None).  Raises ValidationException if the
+        graph has a cycle."""
+
+        result = []
+        done = set()
+        onpath = set()
+        for root in self.edges:
+            if root in done:
+                continue
+            path = [root]
+            stack = [iter(self.dependencies(root, kinds))]
+            onpath.add(root)
+            while stack:
+                for dst in stack[-1]:
+                    if dst in onpath:
+                        cycle = path[path.index(dst):] + [dst]
+                        raise validate.ValidationException(
+                            "Dependency cycle: %s" % " -> ".join(cycle))
+                    if dst not in done:
+                        path.append(dst)
+                        onpath.add(dst)
+                        stack.append(iter(self.dependencies(dst, kinds)))
+                        break
+                else:
+                    stack.pop()
+                    url = path.pop()
+                    onpath.discard(url)
+                    done.add(url)
+                    result.append(url)
+        return result
+
+    def to_dict(self, kinds=None):
+        return {
+            "order": self.order(kinds),
+            "edges": [{"from": src, "to": dst, "types": sorted(k)}
+                      for src, deps in self.edges.iteritems()
+                      for dst, k in deps.iteritems()
+                      if kinds is None or k & kinds]
+        }
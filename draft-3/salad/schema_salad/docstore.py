@@ -0,0 +1,331 @@
+"""Memory limits for a Loader's index and text cache.
+
+By default `Loader.idx` and `Loader.cache` keep every document for the life
+of the Loader.  A Loader created with `Limits` keeps at most `max_documents`
+fetched documents (and `max_bytes` of their source text) in `idx`, and at
+most `max_cache_bytes` of raw text in `cache`, dropping the least recently
+used first:
+
+    ldr = Loader(ctx, limits=Limits(max_documents=500, spill=SpillStore()))
+
+The index entries of a document are the ids with its URL, so they are
+evicted together with it.  Documents that are being resolved and the
+documents they depend on are never evicted.  An evicted document is fetched
+and resolved again if it is needed later, or, with a `SpillStore`, reloaded
+from disk the first time one of its ids is looked up.
+
+Entries added to `idx` for documents that were not fetched (such as a dict
+passed to `resolve_all`, or the terms of `$schemas`) are not evicted.
+Counts of hits, misses, evictions, spills and reloads are kept in
+`Limits.stats`.
+
+A Loader given `limits` makes its own `idx`; passing another `idx` as well
+is an error.  `max_cache_bytes` bounds only the text that is put in `cache`,
+which the Loader itself does not do when it fetches a document: it holds
+text stored there by `AsyncLoader`, by `schema.get_metaschema` or by the
+caller.
+
+The limits do not cover the Loader's other structures, which keep growing
+with the number of documents loaded: the nodes and edges of `depgraph`, the
+`interned` URI table, the `secondary` index (which keeps the ids of spilled
+documents) and the `expressions` inventory.  The derived contexts cached on the
+LoaderContext are bounded separately (MAX_DERIVED_CONTEXTS).
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import urlparse
+import cPickle
+from ref_resolver import NormDict
+
+class Stats(object):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+        self.reloads = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return float(self.hits) / n if n else 0.0
+
+    def cache_hit_rate(self):
+        n = self.cache_hits + self.cache_misses
+        return float(self.cache_hits) / n if n else 0.0
+
+    def to_dict(self):
+        d = dict(self.__dict__)
+        d["hit_rate"] = self.hit_rate()
+        d["cache_hit_rate"] = self.cache_hit_rate()
+        return d
+
+class Limits(object):
+    def __init__(self, max_documents=None, max_bytes=None, max_cache_bytes=None, spill=None):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.max_cache_bytes = max_cache_bytes
+        self.spill = spill
+        self.stats = Stats()
+
+    def index(self, normalize):
+        return LRUIndex(normalize, self)
+
+    def cache(self):
+        if self.max_cache_bytes is None:
+            return {}
+        return LRUCache(self)
+
+class SpillStore(object):
+    """Evicted documents, pickled to files in `directory` (a new temporary
+    directory, removed by `close`, if not given)."""
+
+    def __init__(self, directory=None):
+        self.owned = directory is None
+        self.directory = directory if directory is not None else tempfile.mkdtemp(prefix="salad-spill")
+        self.keys = {}
+        self.bytes = 0
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+    def save(self, url, entries):
+        data = cPickle.dumps(entries, cPickle.HIGHEST_PROTOCOL)
+        with open(self._path(url), "wb") as f:
+            f.write(data)
+        self.keys[url] = (frozenset(entries), len(data))
+        self.bytes += len(data)
+
+    def __contains__(self, url):
+        return url in self.keys
+
+    def has_key(self, url, key):
+        return url in self.keys and key in self.keys[url][0]
+
+    def load(self, url):
+        """Return the entries saved for `url` and remove them from the
+        store."""
+        path = self._path(url)
+        with open(path, "rb") as f:
+            entries = cPickle.load(f)
+        os.remove(path)
+        self.bytes -= self.keys.pop(url)[1]
+        return entries
+
+    def close(self):
+        if self.owned:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.keys = {}
+        self.bytes = 0
+
+def document_url(key):
+    return urlparse.urldefrag(key)[0]
+
+class LRUIndex(NormDict):
+    def __init__(self, normalize, limits):
+        super(LRUIndex, self).__init__(normalize)
+        self.limits = limits
+        self.stats = limits.stats
+        # Fetched documents: URL -> [keys], size, last use.
+        self.documents = {}
+        self.sizes = {}
+        self.used = {}
+        self.clock = 0
+        # Key -> URL of the fetched document it belongs to.
+        self.owner = {}
+        self.bytes = 0
+
+    def _touch(self, key):
+        url = self.owner.get(key)
+        if url is not None:
+            self.clock += 1
+            self.used[url] = self.clock
+
+    def _reload(self, key):
+        spill = self.limits.spill
+        if spill is None:
+            return False
+        url = document_url(key)
+        if not spill.has_key(url, key):
+            return False
+        entries = spill.load(url)
+        size = entries.pop(None)
+        for k, v in entries.iteritems():
+            super(LRUIndex, self).__setitem__(k, v)
+        self._add(url, size, list(entries))
+        self.stats.reloads += 1
+        return True
+
+    def __getitem__(self, key):
+        key = self.normalize(key)
+        try:
+            v = dict.__getitem__(self, key)
+        except KeyError:
+            if not self._reload(key):
+                raise
+            v = dict.__getitem__(self, key)
+        self._touch(key)
+        return v
+
+    def contains(self, key):
+        """Like `key in self`, but without reloading a spilled document or
+        changing any state, so that processes forked from this one (see
+        parallel.py) can use it without touching the spill files."""
+        key = self.normalize(key)
+        if dict.__contains__(self, key):
+            return True
+        spill = self.limits.spill
+        return spill is not None and spill.has_key(document_url(key), key)
+
+    def __contains__(self, key):
+        key = self.normalize(key)
+        if dict.__contains__(self, key) or self._reload(key):
+            self.stats.hits += 1
+            self._touch(key)
+            return True
+        self.stats.misses += 1
+        return False
+
+    def __setitem__(self, key, value):
+        key = self.normalize(key)
+        dict.__setitem__(self, key, value)
+        url = document_url(key)
+        if url in self.documents and key not in self.owner:
+            self.owner[key] = url
+            self.documents[url].append(key)
+
+    def __delitem__(self, key):
+        key = self.normalize(key)
+        dict.__delitem__(self, key)
+        url = self.owner.pop(key, None)
+        if url is not None:
+            self.documents[url].remove(key)
+
+    def _add(self, url, size, keys):
+        self.documents[url] = keys
+        self.sizes[url] = size
+        self.bytes += size
+        for k in keys:
+            self.owner[k] = url
+        self.clock += 1
+        self.used[url] = self.clock
+
+    def add_document(self, url, size):
+        """Start tracking the fetched document `url`, with `size` bytes of
+        source text.  Ids with its URL that are added afterwards belong to
+        it."""
+        url = self.normalize(url)
+        if url in self.documents:
+            return
+        keys = [url] if dict.__contains__(self, url) else []
+        self._add(url, size, keys)
+
+    def _over(self):
+        l = self.limits
+        return ((l.max_documents is not None and len(self.documents) > l.max_documents) or
+                (l.max_bytes is not None and self.bytes > l.max_bytes))
+
+    def trim(self, pinned):
+        """Evict the least recently used documents that are not in `pinned`
+        until the index is within its limits.  Returns the URLs evicted."""
+
+        evicted = []
+        if not self._over():
+            return evicted
+        for url in sorted(self.documents, key=self.used.get):
+            if not self._over():
+                break
+            if url in pinned:
+                continue
+            self.evict(url)
+            evicted.append(url)
+        return evicted
+
+    def evict(self, url):
+        keys = self.documents.pop(url)
+        size = self.sizes.pop(url)
+        self.bytes -= size
+        del self.used[url]
+        entries = {}
+        for k in keys:
+            del self.owner[k]
+            entries[k] = dict.pop(self, k)
+        self.stats.evictions += 1
+        if self.limits.spill is not None:
+            entries[None] = size
+            self.limits.spill.save(url, entries)
+            self.stats.spills += 1
+
+class LRUCache(dict):
+    """Text cache holding at most `limits.max_cache_bytes` of text.  Safe to
+    use from several threads, as AsyncLoader does."""
+
+    def __init__(self, limits):
+        super(LRUCache, self).__init__()
+        self.limits = limits
+        self.stats = limits.stats
+        self.used = {}
+        self.clock = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, url):
+        with self.lock:
+            if dict.__contains__(self, url):
+                self.stats.cache_hits += 1
+                return True
+            self.stats.cache_misses += 1
+            return False
+
+    def __getitem__(self, url):
+        with self.lock:
+            v = dict.__getitem__(self, url)
+            self.clock += 1
+            self.used[url] = self.clock
+            return v
+
+    def get(self, url, default=None):
+        with self.lock:
+            if not dict.__contains__(self, url):
+                self.stats.cache_misses += 1
+                return default
+            self.stats.cache_hits += 1
+            self.clock += 1
+            self.used[url] = self.clock
+            return dict.__getitem__(self, url)
+
+    def __setitem__(self, url, text):
+        with self.lock:
+            if dict.__contains__(self, url):
+                self.bytes -= len(dict.__getitem__(self, url))
+            dict.__setitem__(self, url, text)
+            self.bytes += len(text)
+            self.clock += 1
+            self.used[url] = self.clock
+            limit = self.limits.max_cache_bytes
+            if limit is not None and self.bytes > limit:
+                for u in sorted(self.used, key=self.used.get):
+                    if self.bytes <= limit or u == url:
+                        break
+                    self._discard(u)
+                    self.stats.cache_evictions += 1
+
+    def _discard(self, url):
+        self.bytes -= len(dict.pop(self, url))
+        del self.used[url]
+
+    def pop(self, url, *default):
+        with self.lock:
+            if dict.__contains__(self, url):
+                v = dict.__getitem__(self, url)
+                self._discard(url)
+                return v
+            if default:
+                return default[0]
+            raise KeyError(url)
@@ -0,0 +1,171 @@
+"""Inventory of the expressions in resolved documents.
+
+An expression is a string value containing a parameter reference `$(...)`
+or a code block `${...}` (`\\$(` is an escaped, literal `$(`).  A Loader
+created with an `ExpressionInventory` records, for each document it fetches
+at the top level (documents it `$import`s are part of it), every such
+string with
+
+    id              the id of the nearest object around it that has one
+    process         the id of the nearest object around it with an id and
+                    a `class` (the tool or workflow it belongs to)
+    path            the fields and list positions leading to it from the
+                    root of the document
+    field           the field it is the value of
+    segments        the `$(...)` and `${...}` parts of the string
+    expression_lib  the `expressionLib` of the InlineJavascriptRequirement
+                    in the `requirements` (or else `hints`) of the nearest
+                    object around it that has one, or None if there is none
+    references      the `inputs.<name>`, `self` and `runtime.<name>` names
+                    the segments appear to use, found by pattern matching
+                    rather than parsing, so `inputs[name]` with a variable
+                    is reported as `inputs`
+
+so that all the expressions of a process can be compiled together:
+
+    ldr = Loader(ctx, expressions=ExpressionInventory())
+    ldr.resolve_ref("tool.cwl")
+    for process, exprs in ldr.expressions.by_process().iteritems():
+        ...
+"""
+
+import re
+import collections
+import urlparse
+
+class Expression(object):
+    __slots__ = ("id", "process", "path", "field", "expression", "segments",
+                 "expression_lib", "references")
+
+    def __init__(self, **kwargs):
+        for k in self.__slots__:
+            setattr(self, k, kwargs.get(k))
+
+    def to_dict(self):
+        return collections.OrderedDict((k, getattr(self, k)) for k in self.__slots__)
+
+_CLOSE = {"(": ")", "{": "}", "[": "]"}
+
+def segments(s):
+    """Return the `$(...)` and `${...}` parts of `s`."""
+
+    result = []
+    i = 0
+    n = len(s)
+    while True:
+        i = _find_start(s, i)
+        if i < 0:
+            return result
+        stack = [_CLOSE[s[i + 1]]]
+        j = i + 2
+        while stack and j < n:
+            c = s[j]
+            if c in "'\"":
+                j += 1
+                while j < n and s[j] != c:
+                    if s[j] == "\\":
+                        j += 1
+                    j += 1
+            elif c in _CLOSE:
+                stack.append(_CLOSE[c])
+            elif c == stack[-1]:
+                stack.pop()
+            j += 1
+        result.append(s[i:j])
+        i = j
+
+def _find_start(s, i):
+    while True:
+        p = s.find("$", i)
+        if p < 0 or p + 1 >= len(s):
+            return -1
+        if s[p + 1] in "({" and (p == 0 or s[p - 1] != "\\"):
+            return p
+        i = p + 1
+
+_REFERENCES = [
+    (re.compile(r"(?<![\w$.])inputs\s*\.\s*([A-Za-z_$][\w$]*)"), "inputs.%s"),
+    (re.compile(r"""(?<![\w$.])inputs\s*\[\s*(?:'([^']*)'|"([^"]*)")\s*\]"""), "inputs.%s"),
+    (re.compile(r"(?<![\w$.])inputs(?!\s*[.\[\w$])"), "inputs"),
+    (re.compile(r"(?<![\w$.])inputs\s*\[\s*(?!['\"])"), "inputs"),
+    (re.compile(r"(?<![\w$.])self(?![\w$])"), "self"),
+    (re.compile(r"(?<![\w$.])runtime\s*\.\s*([A-Za-z_$][\w$]*)"), "runtime.%s"),
+    (re.compile(r"(?<![\w$.])runtime(?!\s*\.|[\w$])"), "runtime"),
+]
+
+def references(segment):
+    """Guess the names of `inputs`, `self` and `runtime` used by
+    `segment`."""
+
+    found = set()
+    for pattern, fmt in _REFERENCES:
+        for m in pattern.finditer(segment):
+            if "%s" in fmt:
+                found.add(fmt % next(g for g in m.groups() if g is not None))
+            else:
+                found.add(fmt)
+    return found
+
+def _class_name(cls):
+    frg = urlparse.urldefrag(cls)[1]
+    return frg.rsplit("/", 1)[-1] if frg else cls
+
+def _expression_lib(d, lib):
+    for field in ("requirements", "hints"):
+        for r in d.get(field) or ():
+            if isinstance(r, dict) and isinstance(r.get("class"), basestring) and \
+                    _class_name(r["class"]) == "InlineJavascriptRequirement":
+                return [l for l in r.get("expressionLib") or () if isinstance(l, basestring)]
+    return lib
+
+class ExpressionInventory(object):
+    def __init__(self):
+        self.expressions = []
+        self.documents = set()
+
+    def collect(self, document, doc_url, identifiers=("id",)):
+        """Add the expressions in `document`, which was loaded from
+        `doc_url`, unless that document has been collected already."""
+
+        if doc_url in self.documents:
+            return
+        self.documents.add(doc_url)
+
+        # (node, path, field, id, process, expressionLib)
+        stack = [(document, (), None, doc_url, None, None)]
+        while stack:
+            node, path, field, ident, process, lib = stack.pop()
+            if isinstance(node, dict):
+                for i in identifiers:
+                    if isinstance(node.get(i), basestring):
+                        ident = node[i]
+                        if "class" in node:
+                            process = ident
+                        break
+                lib = _expression_lib(node, lib)
+                for k in sorted(node, reverse=True):
+                    if k != "expressionLib" and k not in identifiers:
+                        stack.append((node[k], path + (k,), k, ident, process, lib))
+            elif isinstance(node, list):
+                for n in xrange(len(node) - 1, -1, -1):
+                    stack.append((node[n], path + (n,), field, ident, process, lib))
+            elif isinstance(node, basestring):
+                segs = segments(node)
+                if segs:
+                    refs = set()
+                    for s in segs:
+                        refs |= references(s)
+                    self.expressions.append(Expression(
+                        id=ident, process=process, path=list(path), field=field,
+                        expression=node, segments=segs, expression_lib=lib,
+                        references=sorted(refs)))
+
+    def by_process(self):
+        """The expressions grouped by the id of their process."""
+        result = collections.OrderedDict()
+        for e in self.expressions:
+            result.setdefault(e.process, []).append(e)
+        return result
+
+    def to_list(self):
+        return [e.to_dict() for e in self.expressions]
@@ -0,0 +1,202 @@
+"""Backends for reading documents, selected by URL scheme.
+
+A fetcher is an object with a `fetch_text(url)` method that returns the
+text of the document as unicode and raises RuntimeError if it cannot be
+read.  It may also have an `exists(url)` method, which link checking uses
+for links that are not in the index.  Fetchers with `hierarchical = True`
+accept relative references (`$import: other.yml`) against their URLs.
+Since relative references are joined with `urlparse.urljoin`, registering
+such a fetcher adds its scheme to `urlparse.uses_relative` and
+`urlparse.uses_netloc`, which changes how urlparse treats that scheme
+everywhere in the process, until `unregister` removes it again.
+
+`registry` maps schemes to the fetchers used by every Loader that is not
+given its own mapping:
+
+    fetcher.register("sha256", fetcher.ContentStore("/var/lib/blobs"))
+    fetcher.register("bundle", fetcher.Bundle("tools.zip"))
+
+Text returned by a fetcher goes through the same `Loader.cache` as the
+built-in schemes.
+"""
+
+import os
+import hashlib
+import tarfile
+import zipfile
+import threading
+import urlparse
+
+def _decode(data, url):
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise RuntimeError('Error reading %s %s' % (url, e))
+
+def text_hash(text):
+    """Hash of document text, as recorded in result cache manifests."""
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    return hashlib.sha1(text).hexdigest()
+
+class HttpFetcher(object):
+    hierarchical = True
+
+    def fetch_text(self, url):
+        try:
+            import requests
+        except ImportError:
+            raise RuntimeError(url, "the requests package is not installed")
+        try:
+            resp = requests.get(url)
+            resp.raise_for_status()
+        except Exception as e:
+            raise RuntimeError(url, e)
+        return resp.text
+
+class FileFetcher(object):
+    hierarchical = True
+
+    def fetch_text(self, url):
+        path = urlparse.urlsplit(url).path
+        try:
+            with open(path) as fp:
+                return fp.read().decode("utf-8")
+        except (OSError, IOError) as e:
+            raise RuntimeError('Error reading %s %s' % (url, e))
+
+    def exists(self, url):
+        return os.path.exists(urlparse.urlsplit(url).path)
+
+class ContentStore(object):
+    """Blobs named by the hex digest of their content, such as
+    `sha256:9f86d0...`, stored as files named by the digest under `root`.
+    Files are checked against their digest when `verify` is set."""
+
+    hierarchical = False
+
+    def __init__(self, root, scheme="sha256", verify=True):
+        self.root = root
+        self.scheme = scheme
+        self.verify = verify
+
+    def _path(self, url):
+        split = urlparse.urlsplit(url)
+        digest = (split.netloc + split.path).strip("/")
+        if not digest or "/" in digest or digest.startswith("."):
+            raise RuntimeError("Invalid content address %s" % url)
+        return digest, os.path.join(self.root, digest)
+
+    def add(self, data):
+        """Store `data` (a byte string) and return its URL."""
+        digest = hashlib.new(self.scheme, data).hexdigest()
+        path = os.path.join(self.root, digest)
+        if not os.path.exists(path):
+            tmp = "%s.tmp%i" % (path, os.getpid())
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.rename(tmp, path)
+        return "%s:%s" % (self.scheme, digest)
+
+    def fetch_text(self, url):
+        digest, path = self._path(url)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except (OSError, IOError) as e:
+            raise RuntimeError('Error reading %s %s' % (url, e))
+        if self.verify and hashlib.new(self.scheme, data).hexdigest() != digest:
+            raise RuntimeError("Content of %s does not match its digest" % url)
+        return _decode(data, url)
+
+    def exists(self, url):
+        try:
+            return os.path.exists(self._path(url)[1])
+        except RuntimeError:
+            return False
+
+class Bundle(object):
+    """Documents packed in a zip file or a (possibly compressed) tarball.
+    `bundle:///dir/tool.cwl` refers to the member `dir/tool.cwl`."""
+
+    hierarchical = True
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if zipfile.is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+            self._tar = None
+            self.members = set(self._zip.namelist())
+        else:
+            self._zip = None
+            self._tar = tarfile.open(path)
+            self.members = set(m.name for m in self._tar.getmembers() if m.isfile())
+
+    def _member(self, url):
+        split = urlparse.urlsplit(url)
+        return os.path.normpath(split.netloc + split.path).lstrip("/")
+
+    def fetch_text(self, url):
+        name = self._member(url)
+        if name not in self.members:
+            raise RuntimeError('Error reading %s: no member %s in %s' % (url, name, self.path))
+        with self._lock:
+            if self._zip is not None:
+                data = self._zip.read(name)
+            else:
+                data = self._tar.extractfile(name).read()
+        return _decode(data, url)
+
+    def exists(self, url):
+        return self._member(url) in self.members
+
+class MemoryFetcher(object):
+    """Documents held in a dict of URL to text, mainly for tests."""
+
+    hierarchical = True
+
+    def __init__(self, documents=None):
+        self.documents = dict(documents or {})
+
+    def fetch_text(self, url):
+        if url not in self.documents:
+            raise RuntimeError('Error reading %s: no such document' % url)
+        return self.documents[url]
+
+    def exists(self, url):
+        return url in self.documents
+
+# Schemes that make_hierarchical added to urlparse's lists.
+_added_schemes = set()
+
+def make_hierarchical(scheme):
+    """Allow relative references against URLs with `scheme`, for every user
+    of urlparse in this process."""
+    for l in (urlparse.uses_relative, urlparse.uses_netloc):
+        if scheme not in l:
+            l.append(scheme)
+            _added_schemes.add(scheme)
+
+registry = {
+    "http": HttpFetcher(),
+    "https": HttpFetcher(),
+    "file": FileFetcher(),
+}
+
+def register(scheme, fetcher, registry=registry):
+    """Use `fetcher` for URLs with `scheme`.  If it is hierarchical, this
+    also calls make_hierarchical(scheme)."""
+    registry[scheme] = fetcher
+    if getattr(fetcher, "hierarchical", False):
+        make_hierarchical(scheme)
+
+def unregister(scheme, registry=registry):
+    """Stop using a fetcher for `scheme`, and take the scheme out of
+    urlparse's lists if make_hierarchical put it there."""
+    registry.pop(scheme, None)
+    if scheme in _added_schemes:
+        _added_schemes.discard(scheme)
+        for l in (urlparse.uses_relative, urlparse.uses_netloc):
+            if scheme in l:
+                l.remove(scheme)
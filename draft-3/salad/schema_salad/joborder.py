@@ -0,0 +1,98 @@
+"""Validate job orders against the inputs of a loaded process.
+
+A job order is a mapping from input names to values.  `InputSchemas` turns
+the `inputs` of a resolved tool or workflow into an Avro record schema,
+caches it by the process id and a hash of the parts of the process that
+the schema is built from (keeping the `max_schemas` most recently used),
+and validates job orders against it:
+
+    schemas = InputSchemas(avsc_names)
+    schemas.validate(tool, job_order)
+    errors = schemas.validate_many(tool, job_orders)
+
+`avsc_names` are the Avro names of the schema the process was validated
+against, as returned by `schema.load_schema`; they provide record types such
+as `File`.  Named types from a SchemaDefRequirement are also available.
+"""
+
+import json
+import hashlib
+import collections
+import avro.schema
+import validate
+from aslist import aslist
+from schema import avro_name, make_valid_avro
+
+def content_hash(obj):
+    """Hash of a JSON-compatible object, independent of key order."""
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, separators=(',', ':'))).hexdigest()
+
+def _schema_defs(process):
+    types = []
+    for r in aslist(process.get("requirements", [])) + aslist(process.get("hints", [])):
+        if isinstance(r, dict) and avro_name(r.get("class", "")) == "SchemaDefRequirement":
+            types.extend(r.get("types", []))
+    return types
+
+def make_input_schema(process, avsc_names):
+    """Build an Avro record schema with one field per input of `process`.
+    Inputs with a default value are optional."""
+
+    alltypes = {t["name"]: t for t in _schema_defs(process) if isinstance(t, dict) and "name" in t}
+    found = set()
+    fields = []
+    for inp in process.get("inputs", []):
+        t = make_valid_avro(inp["type"], alltypes, found, union=True)
+        if "default" in inp and "null" not in aslist(t):
+            t = ["null"] + aslist(t)
+        fields.append({"name": avro_name(inp["id"]), "type": t})
+
+    # Copy the names so that the types defined here do not leak into the
+    # shared schema.
+    names = avro.schema.Names(avsc_names.default_namespace)
+    names.names = dict(avsc_names.names)
+    try:
+        return avro.schema.make_avsc_object({
+            "name": "input_record_schema",
+            "type": "record",
+            "fields": fields}, names)
+    except avro.schema.SchemaParseException as e:
+        raise validate.ValidationException("Cannot build input schema for `%s`: %s" % (process.get("id"), e))
+
+class InputSchemas(object):
+    def __init__(self, avsc_names, max_schemas=128):
+        self.avsc_names = avsc_names
+        self.max_schemas = max_schemas
+        self.schemas = collections.OrderedDict()
+
+    def input_schema(self, process):
+        key = (process.get("id"), content_hash([process.get("inputs", []), _schema_defs(process)]))
+        sch = self.schemas.pop(key, None)
+        if sch is None:
+            sch = make_input_schema(process, self.avsc_names)
+        # Most recently used last.
+        self.schemas[key] = sch
+        if self.max_schemas is not None and len(self.schemas) > self.max_schemas:
+            self.schemas.popitem(last=False)
+        return sch
+
+    def validate(self, process, job_order, strict=False):
+        """Raise ValidationException if `job_order` is not valid input for
+        `process`."""
+
+        return validate.validate_ex(self.input_schema(process), job_order, strict=strict)
+
+    def validate_many(self, process, job_orders, strict=False):
+        """Validate each of `job_orders` against the inputs of `process`.
+        Returns a list with None for each valid job order and the
+        ValidationException for each invalid one."""
+
+        sch = self.input_schema(process)
+        results = []
+        for job_order in job_orders:
+            try:
+                validate.validate_ex(sch, job_order, strict=strict)
+                results.append(None)
+            except validate.ValidationException as e:
+                results.append(e)
+        return results
@@ -7,16 +7,49 @@ import copy
 import pprint
 import re
 import sys
-import rdflib
-from rdflib import Graph, URIRef
-import rdflib.namespace
-from rdflib.namespace import RDF, RDFS
 import urlparse
 import logging
+import unicodedata
 from aslist import aslist
 
 _logger = logging.getLogger("salad")
 
+# The RDFS graph is only built for --print-rdfs, so the triples are collected
+# as plain strings and rdflib is only imported by salad_to_jsonld_context.
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+RDF_PROPERTY = "http://www.w3.org/1999/02/22-rdf-syntax-ns#Property"
+RDFS_CLASS = "http://www.w3.org/2000/01/rdf-schema#Class"
+RDFS_DOMAIN = "http://www.w3.org/2000/01/rdf-schema#domain"
+RDFS_SUBCLASSOF = "http://www.w3.org/2000/01/rdf-schema#subClassOf"
+
+_NAME_START_CATEGORIES = frozenset(["Ll", "Lu", "Lo", "Lt", "Nl"])
+_NAME_CATEGORIES = _NAME_START_CATEGORIES | frozenset(["Mc", "Me", "Mn", "Lm", "Nd"])
+_ALLOWED_NAME_CHARS = frozenset([u"\u00B7", u"\u0387", u"-", u".", u"_"])
+_XMLNS = "http://www.w3.org/XML/1998/namespace"
+
+def split_uri(uri):
+    """Split `uri` into namespace and local name, as
+    rdflib.namespace.split_uri does."""
+
+    category = unicodedata.category
+    if uri.startswith(_XMLNS):
+        return (_XMLNS, uri.split(_XMLNS)[1])
+    length = len(uri)
+    for i in xrange(0, length):
+        c = uri[-i - 1]
+        if category(c) not in _NAME_CATEGORIES:
+            if c in _ALLOWED_NAME_CHARS:
+                continue
+            for j in xrange(-1 - i, length):
+                if category(uri[j]) in _NAME_START_CATEGORIES or uri[j] == "_":
+                    ns = uri[:j]
+                    if not ns:
+                        break
+                    ln = uri[j:]
+                    return (ns, ln)
+            break
+    raise Exception("Can't split '%s'" % uri)
+
 def pred(datatype, field, name, context, defaultBase, namespaces):
     split = urlparse.urlsplit(name)
 
@@ -24,10 +57,10 @@ def pred(datatype, field, name, context, defaultBase, namespaces):
 
     if split.scheme:
         v = name
-        (ns, ln) = rdflib.namespace.split_uri(unicode(v))
+        (ns, ln) = split_uri(unicode(v))
         name = ln
         if ns[0:-1] in namespaces:
-            v = unicode(namespaces[ns[0:-1]][ln])
+            v = unicode(namespaces[ns[0:-1]] + ln)
         _logger.debug("name, v %s %s", name, v)
 
     if field and "jsonldPredicate" in field:
@@ -58,20 +91,20 @@ def pred(datatype, field, name, context, defaultBase, namespaces):
 
     return v
 
-def process_type(t, g, context, defaultBase, namespaces, defaultPrefix):
+def process_type(t, triples, context, defaultBase, namespaces, defaultPrefix):
     if t["type"] == "record":
         recordname = t["name"]
 
         _logger.debug("Processing record %s\n", t)
 
-        classnode = URIRef(recordname)
-        g.add((classnode, RDF.type, RDFS.Class))
+        classnode = recordname
+        triples.append((classnode, RDF_TYPE, RDFS_CLASS))
 
         split = urlparse.urlsplit(recordname)
         if "jsonldPrefix" in t:
             predicate = "%s:%s" % (t["jsonldPrefix"], recordname)
         elif split.scheme:
-            (ns, ln) = rdflib.namespace.split_uri(unicode(recordname))
+            (ns, ln) = split_uri(unicode(recordname))
             predicate = recordname
             recordname = ln
         else:
@@ -99,23 +132,23 @@ def process_type(t, g, context, defaultBase, namespaces, defaultPrefix):
                 v = v["_@id"] if v.get("_@id", "@")[0] != "@" else None
 
             if v:
-                (ns, ln) = rdflib.namespace.split_uri(unicode(v))
+                (ns, ln) = split_uri(unicode(v))
                 if ns[0:-1] in namespaces:
-                    propnode = namespaces[ns[0:-1]][ln]
+                    propnode = unicode(namespaces[ns[0:-1]] + ln)
                 else:
-                    propnode = URIRef(v)
+                    propnode = v
 
-                g.add((propnode, RDF.type, RDF.Property))
-                g.add((propnode, RDFS.domain, classnode))
+                triples.append((propnode, RDF_TYPE, RDF_PROPERTY))
+                triples.append((propnode, RDFS_DOMAIN, classnode))
 
                 # TODO generate range from datatype.
 
             if isinstance(i["type"], dict) and "name" in i["type"]:
-                process_type(i["type"], g, context, defaultBase, namespaces, defaultPrefix)
+                process_type(i["type"], triples, context, defaultBase, namespaces, defaultPrefix)
 
         if "extends" in t:
             for e in aslist(t["extends"]):
-                g.add((classnode, RDFS.subClassOf, URIRef(e)))
+                triples.append((classnode, RDFS_SUBCLASSOF, e))
     elif t["type"] == "enum":
         _logger.debug("Processing enum %s", t["name"])
 
@@ -123,15 +156,15 @@ def process_type(t, g, context, defaultBase, namespaces, defaultPrefix):
             pred(t, None, i, context, defaultBase, namespaces)
 
 
-def salad_to_jsonld_context(j, schema_ctx):
+def _process_types(j, schema_ctx):
     context = {}
     namespaces = {}
-    g = Graph()
+    triples = []
     defaultPrefix = ""
 
     for k,v in schema_ctx.items():
         context[k] = v
-        namespaces[k] = rdflib.namespace.Namespace(v)
+        namespaces[k] = v
 
     if "@base" in context:
         defaultBase = context["@base"]
@@ -139,11 +172,27 @@ def salad_to_jsonld_context(j, schema_ctx):
     else:
         defaultBase = ""
 
-    for k,v in namespaces.items():
-        g.bind(k, v)
-
     for t in j:
-        process_type(t, g, context, defaultBase, namespaces, defaultPrefix)
+        process_type(t, triples, context, defaultBase, namespaces, defaultPrefix)
+
+    return (context, namespaces, triples)
+
+def make_jsonld_context(j, schema_ctx):
+    """Return the JSON-LD context for the schema `j`."""
+    return _process_types(j, schema_ctx)[0]
+
+def salad_to_jsonld_context(j, schema_ctx):
+    """Return the JSON-LD context and the RDFS graph for the schema `j`."""
+
+    from rdflib import Graph, URIRef
+    from rdflib.namespace import Namespace
+
+    (context, namespaces, triples) = _process_types(j, schema_ctx)
+    g = Graph()
+    for k,v in namespaces.items():
+        g.bind(k, Namespace(v))
+    for t in triples:
+        g.add(tuple(URIRef(n) for n in t))
 
     return (context, g)
 
@@ -1,30 +1,40 @@
 import argparse
 import logging
 import sys
-import pkg_resources  # part of setuptools
 import schema
 import jsonld_context
-import makedoc
+import timings
+import pack
+import codegen
+import expressions
 import json
-from rdflib import Graph, plugin
-from rdflib.serializer import Serializer
-import yaml
 import os
 import urlparse
 
-from ref_resolver import Loader
+from ref_resolver import Loader, LoaderContext
 import validate
 
 _logger = logging.getLogger("salad")
 
-from rdflib.plugin import register, Parser
-import rdflib_jsonld.parser
-register('json-ld', Parser, 'rdflib_jsonld.parser', 'JsonLDParser')
+# rdflib, rdflib_jsonld, mistune (through makedoc) and pkg_resources take
+# longer to import than most documents take to validate, so they are only
+# imported by the options that use them.
 
 def printrdf(workflow, wf, ctx, sr):
+    from rdflib import Graph
+    from rdflib.plugin import register, Parser
+    register('json-ld', Parser, 'rdflib_jsonld.parser', 'JsonLDParser')
     g = Graph().parse(data=json.dumps(wf), format='json-ld', location=workflow, context=ctx)
     print(g.serialize(format=sr))
 
+def printdeps(depgraph, name):
+    try:
+        print json.dumps(depgraph.to_dict(), indent=4)
+    except validate.ValidationException as e:
+        _logger.error("Dependencies of `%s` have a cycle:\n%s", name, e)
+        return 1
+    return 0
+
 def main(args=None):
     if args is None:
         args = sys.argv[1:]
@@ -44,6 +54,10 @@ def main(args=None):
     exgroup.add_argument("--print-pre", action="store_true", help="Print document after preprocessing")
     exgroup.add_argument("--print-index", action="store_true", help="Print node index")
     exgroup.add_argument("--print-metadata", action="store_true", help="Print document metadata")
+    exgroup.add_argument("--print-expressions", action="store_true", help="Print the expressions in the document, with the expressionLib and inputs they use")
+    exgroup.add_argument("--print-deps", action="store_true", help="Print document dependency graph and load order")
+    exgroup.add_argument("--pack", action="store_true", help="Print document and the documents it references as a single $graph document")
+    exgroup.add_argument("--codegen", type=str, metavar="LANGUAGE", choices=["python"], help="Print code for loading documents of the schema into typed objects (python)")
     exgroup.add_argument("--version", action="store_true", help="Print version")
 
     exgroup = parser.add_mutually_exclusive_group()
@@ -57,6 +71,12 @@ def main(args=None):
     exgroup.add_argument("--quiet", action="store_true", help="Only print warnings and errors.")
     exgroup.add_argument("--debug", action="store_true", help="Print even more logging")
 
+    parser.add_argument("--processes", type=int, default=1, metavar="N", help="Validate the entries of a $graph document in N processes")
+    parser.add_argument("--cache-dir", type=str, metavar="DIR", help="Store validation results in DIR, and reuse them while the document and everything it loads are unchanged")
+    parser.add_argument("--timings", action="store_true", help="Print wall time, CPU time and growth of peak memory of each processing phase to stderr")
+    parser.add_argument("--profile", type=str, metavar="FILE", help="Write cProfile statistics to FILE")
+    parser.add_argument("--flamegraph", type=str, metavar="FILE", help="Write sampled stacks in collapsed (flamegraph.pl) format to FILE")
+
     parser.add_argument("schema", type=str)
     parser.add_argument("document", type=str, nargs="?", default=None)
 
@@ -67,13 +87,30 @@ def main(args=None):
     if args.debug:
         _logger.setLevel(logging.DEBUG)
 
-    pkg = pkg_resources.require("schema_salad")
-    if pkg:
-        if args.version:
+    if not (args.timings or args.profile or args.flamegraph):
+        return process(args)
+
+    timer = timings.Timings(profile=bool(args.profile),
+                            sample_interval=(0.001 if args.flamegraph else None))
+    timer.start()
+    try:
+        return process(args)
+    finally:
+        timer.stop()
+        if args.timings:
+            timer.report(sys.stderr)
+        if args.profile:
+            timer.dump_stats(args.profile)
+        if args.flamegraph:
+            timer.dump_collapsed(args.flamegraph)
+
+def process(args):
+    if args.version:
+        import pkg_resources  # part of setuptools
+        pkg = pkg_resources.require("schema_salad")
+        if pkg:
             print "%s %s" % (sys.argv[0], pkg[0].version)
-            return 0
-        else:
-            _logger.info("%s %s", sys.argv[0], pkg[0].version)
+        return 0
 
     # Get the metaschema to validate the schema
     metaschema_names, metaschema_doc, metaschema_loader = schema.get_metaschema()
@@ -83,8 +120,9 @@ def main(args=None):
     schema_uri = args.schema
     if not urlparse.urlparse(schema_uri)[0]:
         schema_uri = "file://" + os.path.abspath(schema_uri)
-    schema_raw_doc = metaschema_loader.fetch(schema_uri)
-    schema_doc, schema_metadata = metaschema_loader.resolve_all(schema_raw_doc, schema_uri)
+    with timings.phase("schema fetch/resolve"):
+        schema_raw_doc = metaschema_loader.fetch(schema_uri)
+        schema_doc, schema_metadata = metaschema_loader.resolve_all(schema_raw_doc, schema_uri)
 
     # Optionally print the schema after ref resolution
     if not args.document and args.print_pre:
@@ -95,9 +133,13 @@ def main(args=None):
         print json.dumps(metaschema_loader.idx.keys(), indent=4)
         return 0
 
+    if not args.document and args.print_deps:
+        return printdeps(metaschema_loader.depgraph, args.schema)
+
     # Validate links in the schema document
     try:
-        metaschema_loader.validate_links(schema_doc)
+        with timings.phase("schema link check"):
+            metaschema_loader.validate_links(schema_doc)
     except (validate.ValidationException) as e:
         _logger.error("Schema `%s` failed link checking:\n%s", args.schema, e, exc_info=(e if args.debug else False))
         _logger.debug("Index is %s", metaschema_loader.idx.keys())
@@ -106,7 +148,8 @@ def main(args=None):
 
     # Validate the schema document against the metaschema
     try:
-        schema.validate_doc(metaschema_names, schema_doc, metaschema_loader, args.strict)
+        with timings.phase("schema validation"):
+            schema.validate_doc(metaschema_names, schema_doc, metaschema_loader, args.strict)
     except validate.ValidationException as e:
         _logger.error("While validating schema `%s`:\n%s" % (args.schema, str(e)))
         return 1
@@ -117,13 +160,19 @@ def main(args=None):
         metactx = schema_raw_doc.get("$namespaces", {})
         if "$base" in schema_raw_doc:
             metactx["@base"] = schema_raw_doc["$base"]
-    (schema_ctx, rdfs) = jsonld_context.salad_to_jsonld_context(schema_doc, metactx)
+    with timings.phase("context generation"):
+        if args.print_rdfs:
+            (schema_ctx, rdfs) = jsonld_context.salad_to_jsonld_context(schema_doc, metactx)
+        else:
+            schema_ctx = jsonld_context.make_jsonld_context(schema_doc, metactx)
 
     # Create the loader that will be used to load the target document.
-    document_loader = Loader(schema_ctx)
+    document_loader = Loader(LoaderContext(schema_ctx, document_links=schema.document_link_fields(schema_doc)),
+                             expressions=(expressions.ExpressionInventory() if args.print_expressions else None))
 
     # Make the Avro validation that will be used to validate the target document
-    (avsc_names, avsc_obj) = schema.make_avro_schema(schema_doc, document_loader)
+    with timings.phase("avro compilation"):
+        (avsc_names, avsc_obj) = schema.make_avro_schema(schema_doc, document_loader)
 
     if isinstance(avsc_names, Exception):
         _logger.error("Schema `%s` error:\n%s", args.schema, avsc_names, exc_info=(avsc_names if args.debug else False))
@@ -136,6 +185,11 @@ def main(args=None):
         print json.dumps(avsc_obj, indent=4)
         return 0
 
+    # Optionally generate classes and loaders from the schema
+    if args.codegen:
+        codegen.codegen(args.codegen, avsc_obj, sys.stdout)
+        return 0
+
     # Optionally print the json-ld context from the schema
     if args.print_jsonld_context:
         j = {"@context": schema_ctx}
@@ -149,6 +203,7 @@ def main(args=None):
 
     # Optionally create documentation page from the schema
     if args.print_doc:
+        import makedoc
         makedoc.avrold_doc(schema_doc, sys.stdout)
         return 0
 
@@ -161,12 +216,35 @@ def main(args=None):
         print "Schema `%s` is valid" % args.schema
         return 0
 
+    # Use a stored result if nothing the document was made from has changed.
+    result_cache = None
+    if args.cache_dir and not (args.print_pre or args.print_index or args.print_deps or args.print_expressions or
+                               args.pack or args.print_rdf or args.print_metadata):
+        import resultcache
+        result_cache = resultcache.ResultCache(args.cache_dir)
+        doc_url = args.document
+        if not urlparse.urlparse(doc_url)[0]:
+            doc_url = "file://" + os.path.abspath(doc_url)
+        cache_key = result_cache.key(doc_url, avsc_names, args.strict)
+        entry = result_cache.get(cache_key, document_loader)
+        if entry is not None:
+            if entry["phase"] == "link check":
+                _logger.error("Document `%s` failed link checking:\n%s", args.document, entry["error"])
+                return 1
+            if entry["phase"] == "validation":
+                _logger.error("While validating document `%s`:\n%s" % (args.document, entry["error"]))
+                return 1
+            print "Document `%s` is valid" % args.document
+            return 0
+        document_loader.manifest = resultcache.Manifest()
+
     # Load target document and resolve refs
     try:
         uri = args.document
         if not urlparse.urlparse(uri)[0]:
             doc = "file://" + os.path.abspath(uri)
-        document, doc_metadata = document_loader.resolve_ref(uri)
+        with timings.phase("document resolve"):
+            document, doc_metadata = document_loader.resolve_ref(uri)
     except (validate.ValidationException, RuntimeError) as e:
         _logger.error("Document `%s` failed validation:\n%s", args.document, e, exc_info=(e if args.debug else False))
         return 1
@@ -180,21 +258,44 @@ def main(args=None):
         print json.dumps(document_loader.idx.keys(), indent=4)
         return 0
 
+    if args.print_deps:
+        return printdeps(document_loader.depgraph, args.document)
+
+    if args.print_expressions:
+        print json.dumps(document_loader.expressions.to_list(), indent=4)
+        return 0
+
     # Validate links in the target document
     try:
-        document_loader.validate_links(document)
+        with timings.phase("document link check"):
+            document_loader.validate_links(document, processes=args.processes)
     except (validate.ValidationException) as e:
         _logger.error("Document `%s` failed link checking:\n%s", args.document, e, exc_info=(e if args.debug else False))
         _logger.debug("Index is %s", json.dumps(document_loader.idx.keys(), indent=4))
+        if result_cache is not None:
+            result_cache.put(cache_key, document_loader.manifest, str(e), "link check")
         return 1
 
     # Validate the schema document against the metaschema
     try:
-        schema.validate_doc(avsc_names, document, document_loader, args.strict)
+        with timings.phase("document validation"):
+            schema.validate_doc(avsc_names, document, document_loader, args.strict, processes=args.processes)
     except validate.ValidationException as e:
         _logger.error("While validating document `%s`:\n%s" % (args.document, str(e)))
+        if result_cache is not None:
+            result_cache.put(cache_key, document_loader.manifest, str(e), "validation")
         return 1
 
+    if args.pack:
+        try:
+            with timings.phase("document pack"):
+                packed = pack.pack(document_loader, uri)
+        except (validate.ValidationException, RuntimeError) as e:
+            _logger.error("Document `%s` could not be packed:\n%s", args.document, e, exc_info=(e if args.debug else False))
+            return 1
+        print json.dumps(packed, indent=4)
+        return 0
+
     # Optionally convert the document to RDF
     if args.print_rdf:
         printrdf(args.document, document, schema_ctx, args.rdf_serializer)
@@ -204,6 +305,9 @@ def main(args=None):
         print json.dumps(doc_metadata, indent=4)
         return 0
 
+    if result_cache is not None:
+        result_cache.put(cache_key, document_loader.manifest)
+
     print "Document `%s` is valid" % args.document
 
     return 0
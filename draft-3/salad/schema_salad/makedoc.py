@@ -10,28 +10,12 @@ import StringIO
 import logging
 import urlparse
 from aslist import aslist
+import typegraph
 import re
 import argparse
 
 _logger = logging.getLogger("salad")
 
-def has_types(items):
-    r = []
-    if isinstance(items, dict):
-        if items["type"] == "https://w3id.org/cwl/salad#record":
-            return [items["name"]]
-        for n in ("type", "items", "values"):
-            if n in items:
-                r.extend(has_types(items[n]))
-        return r
-    if isinstance(items, list):
-        for i in items:
-            r.extend(has_types(i))
-        return r
-    if isinstance(items, basestring):
-        return [items]
-    return []
-
 def linkto(item):
     _, frg = urlparse.urldefrag(item)
     return "[%s](#%s)" % (frg, to_id(frg))
@@ -102,11 +86,6 @@ basicTypes = ("https://w3id.org/cwl/salad#null",
               "https://w3id.org/cwl/salad#enum",
               "https://w3id.org/cwl/salad#array")
 
-def add_dictlist(di, key, val):
-    if key not in di:
-        di[key] = []
-    di[key].append(val)
-
 def number_headings(toc, maindoc):
     mdlines = []
     skip = False
@@ -138,55 +117,15 @@ class RenderType(object):
     def __init__(self, toc, j, renderlist, redirects):
         self.typedoc = StringIO.StringIO()
         self.toc = toc
-        self.subs = {}
-        self.docParent = {}
-        self.docAfter = {}
         self.rendered = set()
         self.redirects = redirects
         self.title = None
 
-        for t in j:
-            if "extends" in t:
-                for e in aslist(t["extends"]):
-                    add_dictlist(self.subs, e, t["name"])
-                    #if "docParent" not in t and "docAfter" not in t:
-                    #    add_dictlist(self.docParent, e, t["name"])
-
-            if t.get("docParent"):
-                add_dictlist(self.docParent, t["docParent"], t["name"])
-
-            if t.get("docChild"):
-                for c in aslist(t["docChild"]):
-                    add_dictlist(self.docParent, t["name"], c)
-
-            if t.get("docAfter"):
-                add_dictlist(self.docAfter, t["docAfter"], t["name"])
-
         _, _, metaschema_loader = schema.get_metaschema()
         alltypes = schema.extend_and_specialize(j, metaschema_loader)
 
-        self.typemap = {}
-        self.uses = {}
-        self.record_refs = {}
-        for t in alltypes:
-            self.typemap[t["name"]] = t
-            try:
-                if t["type"] == "record":
-                    self.record_refs[t["name"]] = []
-                    for f in t.get("fields", []):
-                        p = has_types(f)
-                        for tp in p:
-                            if tp not in self.uses:
-                                self.uses[tp] = []
-                            if (t["name"], f["name"]) not in self.uses[tp]:
-                                _, frg1 = urlparse.urldefrag(t["name"])
-                                _, frg2 = urlparse.urldefrag(f["name"])
-                                self.uses[tp].append((frg1, frg2))
-                            if tp not in basicTypes and tp not in self.record_refs[t["name"]]:
-                                    self.record_refs[t["name"]].append(tp)
-            except KeyError as e:
-                _logger.error("Did not find 'type' in %s", t)
-                raise
+        self.graph = typegraph.TypeGraph(alltypes)
+        self.typemap = self.graph.types
 
         for f in alltypes:
             if (f["name"] in renderlist or
@@ -291,12 +230,12 @@ class RenderType(object):
         #if "extends" in f:
         #    doc += "\n\nExtends "
         #    doc += ", ".join([" %s" % linkto(ex) for ex in aslist(f["extends"])])
-        #if f["name"] in self.subs:
+        #if self.graph.subtypes(f["name"]):
         #    doc += "\n\nExtended by"
-        #    doc += ", ".join([" %s" % linkto(s) for s in self.subs[f["name"]]])
-        #if f["name"] in self.uses:
+        #    doc += ", ".join([" %s" % linkto(s) for s in self.graph.subtypes(f["name"])])
+        #if self.graph.used_by(f["name"]):
         #    doc += "\n\nReferenced by"
-        #    doc += ", ".join([" [%s.%s](#%s)" % (s[0], s[1], to_id(s[0])) for s in self.uses[f["name"]]])
+        #    doc += ", ".join([" [%s.%s](#%s)" % (schema.avro_name(s[0]), schema.avro_name(s[1]), to_id(schema.avro_name(s[0]))) for s in self.graph.used_by(f["name"])])
 
         doc = doc + "\n\n" + f["doc"]
 
@@ -333,10 +272,16 @@ class RenderType(object):
             doc += "<h3>Symbols</h3>"
             doc += """<table class="table table-striped">"""
             doc += "<tr><th>symbol</th><th>description</th></tr>"
+            # extend_and_specialize has already copied the symbols of the
+            # base types into f, so list each symbol once.
+            seen = set()
             for e in ex:
                 for i in e.get("symbols", []):
-                    doc += "<tr>"
                     frg = schema.avro_name(i)
+                    if frg in seen:
+                        continue
+                    seen.add(frg)
+                    doc += "<tr>"
                     doc += "<td><code>%s</code></td><td>%s</td>" % (frg, enumDesc.get(frg, ""))
                     doc += "</tr>"
             doc += """</table>"""
@@ -344,14 +289,14 @@ class RenderType(object):
 
         self.typedoc.write(f["doc"])
 
-        subs = self.docParent.get(f["name"], []) + self.record_refs.get(f["name"], [])
+        subs = self.graph.doc_children(f["name"]) + [tp for tp in self.graph.references(f["name"]) if tp not in basicTypes]
         if len(subs) == 1:
             self.render_type(self.typemap[subs[0]], depth)
         else:
             for s in subs:
                 self.render_type(self.typemap[s], depth+1)
 
-        for s in self.docAfter.get(f["name"], []):
+        for s in self.graph.doc_after(f["name"]):
             self.render_type(self.typemap[s], depth)
 
 def avrold_doc(j, outdoc, renderlist, redirects, brand, brandlink):
@@ -0,0 +1,201 @@
+"""Pack a document and everything it refers to into a single `$graph`.
+
+A workflow is normally loaded by fetching the workflow document, the
+documents it `$import`s and `$include`s, and the documents its link fields
+(such as `run`) refer to, each of which may refer to more.  `pack` does this
+once and returns one document that loads with a single fetch:
+
+    packed = pack(document_loader, "count-lines3-wf.cwl")
+
+Each document reached through a link field becomes an entry of `$graph`.
+`$import` and `$include` are inlined, as they are by `resolve_ref`.  URLs of
+the original documents are rewritten to fragments of the packed document:
+the document being packed becomes `#main` and the others are named after the
+last part of their path, so `wc2-tool.cwl#output` becomes
+`#wc2-tool.cwl/output`.  A document that is itself a `$graph` keeps the
+fragments of its entries under its name (or unchanged, for the document
+being packed).
+
+`$namespaces` and `$schemas` are moved to the top of the packed document,
+with `$schemas` made absolute.
+
+Link fields whose targets are not documents, such as paths of data files,
+are left as absolute URLs: only the links in the loader's dependency graph
+are followed, which for a loader made from a schema are its
+`document_links` (see LoaderContext).  `link_fields` restricts which fields
+are followed; by default all of them are.
+"""
+
+import os
+import posixpath
+import urlparse
+from aslist import aslist
+from trampoline import run, Return
+import depgraph
+import validate
+
+def _name(url, used):
+    base = posixpath.basename(urlparse.urlsplit(url).path.rstrip("/")) or "document"
+    name = base
+    n = 1
+    while name in used:
+        n += 1
+        name = "%s-%i" % (base, n)
+    used.add(name)
+    return name
+
+def _rewrite(document, fields, rewrite_url):
+    # Copy `document`, rewriting the URLs in `fields`.
+    if isinstance(document, dict):
+        result = {}
+        for k, v in document.iteritems():
+            if k in fields and isinstance(v, basestring):
+                result[k] = rewrite_url(v)
+            elif k in fields and isinstance(v, list):
+                r = []
+                for i in v:
+                    if isinstance(i, basestring):
+                        r.append(rewrite_url(i))
+                    else:
+                        r.append((yield _rewrite(i, fields, rewrite_url)))
+                result[k] = r
+            elif isinstance(v, (dict, list)):
+                result[k] = yield _rewrite(v, fields, rewrite_url)
+            else:
+                result[k] = v
+        yield Return(result)
+    elif isinstance(document, list):
+        result = []
+        for v in document:
+            if isinstance(v, (dict, list)):
+                result.append((yield _rewrite(v, fields, rewrite_url)))
+            else:
+                result.append(v)
+        yield Return(result)
+    else:
+        yield Return(document)
+
+class _Packer(object):
+    def __init__(self, loader, link_fields):
+        self.loader = loader
+        self.link_fields = link_fields
+        self.prefixes = {}
+        self.used = set()
+        self.namespaces = {}
+        self.schemas = []
+        self.entries = []
+
+    def load(self, url):
+        """Resolve the document at `url`.  Returns (document, metadata), or
+        None if it is not a mapping or list."""
+
+        document, metadata = self.loader.resolve_ref(url)
+        if not isinstance(document, (dict, list)):
+            return None
+        return document, metadata
+
+    def hoist(self, doc_url, document):
+        for k, v in document.pop("$namespaces", {}).iteritems():
+            if self.namespaces.setdefault(k, v) != v:
+                raise validate.ValidationException(
+                    "Cannot pack `%s`: namespace `%s` is both `%s` and `%s`" % (
+                        doc_url, k, self.namespaces[k], v))
+        for s in aslist(document.pop("$schemas", [])):
+            s = urlparse.urljoin(doc_url, s)
+            if s not in self.schemas:
+                self.schemas.append(s)
+        document.pop("$base", None)
+
+    def add(self, doc_url, document, metadata, root):
+        if isinstance(document, list):
+            # A $graph document.  Its other top level fields belong to the
+            # packed document if it is the root, else to each of its entries.
+            metadata = dict(metadata)
+            self.hoist(doc_url, metadata)
+            for ident in self.loader.identifiers:
+                metadata.pop(ident, None)
+            entries = document
+        else:
+            metadata = {}
+            entries = [document]
+        for e in entries:
+            e = dict(e)
+            self.hoist(doc_url, e)
+            if not root:
+                for k, v in metadata.iteritems():
+                    e.setdefault(k, v)
+            self.entries.append(e)
+        return metadata if root else {}
+
+    def rewrite_url(self, url):
+        doc_url, frg = urlparse.urldefrag(url)
+        if doc_url not in self.prefixes:
+            return url
+        prefix = self.prefixes[doc_url]
+        if frg and prefix:
+            return "#%s/%s" % (prefix, frg)
+        elif frg:
+            return "#" + frg
+        elif prefix:
+            return "#" + prefix
+        return url
+
+    def pack(self, uri):
+        loader = self.loader
+        graph = loader.depgraph
+        url = urlparse.urldefrag(loader.expand_url(uri, 'file://%s/' % os.path.abspath('.')))[0]
+
+        root = self.load(url)
+        if root is None:
+            raise validate.ValidationException("Cannot pack `%s`: not a document" % uri)
+        if isinstance(root[0], list):
+            # Keep the fragments of the root's own entries.
+            self.prefixes[url] = ""
+            for e in root[0]:
+                for ident in loader.identifiers:
+                    if isinstance(e, dict) and isinstance(e.get(ident), basestring):
+                        self.used.add(urlparse.urldefrag(e[ident])[1].split("/")[0])
+        else:
+            self.prefixes[url] = "main"
+            self.used.add("main")
+        top = self.add(url, root[0], root[1], True)
+
+        queue = [url]
+        seen = set(queue)
+        while queue:
+            src = queue.pop(0)
+            for dst, kinds in graph.edges.get(src, {}).items():
+                if dst in seen:
+                    continue
+                links = kinds - depgraph.LOAD_KINDS
+                if self.link_fields is not None:
+                    links &= self.link_fields
+                if "import" in kinds:
+                    # Inlined, but its ids still need rewriting.
+                    seen.add(dst)
+                    queue.append(dst)
+                    self.prefixes[dst] = _name(dst, self.used)
+                elif links:
+                    seen.add(dst)
+                    loaded = self.load(dst)
+                    if loaded is not None:
+                        queue.append(dst)
+                        self.prefixes[dst] = _name(dst, self.used)
+                        self.add(dst, loaded[0], loaded[1], False)
+
+        fields = loader.url_fields | loader.identifiers
+        packed = run(_rewrite(top, fields, self.rewrite_url))
+        packed["$graph"] = run(_rewrite(self.entries, fields, self.rewrite_url))
+        if self.namespaces:
+            packed["$namespaces"] = self.namespaces
+        if self.schemas:
+            packed["$schemas"] = self.schemas
+        return packed
+
+def pack(document_loader, uri, link_fields=None):
+    """Return a single `$graph` document containing the document at `uri`
+    and every document it depends on."""
+
+    if link_fields is not None:
+        link_fields = frozenset(link_fields)
+    return _Packer(document_loader, link_fields).pack(uri)
@@ -0,0 +1,88 @@
+"""Validate the entries of a `$graph` in a pool of processes.
+
+`schema.validate_doc` and `Loader.validate_links` use this when called with
+`processes` greater than one.  The compiled schema, the document and (for
+link checks) the Loader are handed to each worker once, when the pool
+starts; where processes are forked, as on Linux, this costs nothing, since
+they are inherited rather than pickled.  The entries are split into chunks,
+each worker reports the errors of its chunk by position, and the errors are
+merged in document order, so the result is the same as validating in one
+process.
+
+For link checks the workers only look each link up in the index and the
+vocabulary, which they share read-only; the links that are not found are
+sent back and checked against the filesystem by the calling process, as
+`validate_links` does.
+"""
+
+import multiprocessing
+import schema
+
+# Set in each worker by _init.
+_state = None
+
+def _init(state):
+    global _state
+    _state = state
+
+def _chunks(n, processes, chunk_size):
+    if chunk_size is None:
+        # A few chunks per process, so that a slow chunk does not hold up
+        # the others.
+        chunk_size = max(1, n // (processes * 4))
+    return [(i, min(i + chunk_size, n)) for i in xrange(0, n, chunk_size)]
+
+def _map(state, func, n, processes, chunk_size):
+    pool = multiprocessing.Pool(processes, initializer=_init, initargs=(state,))
+    try:
+        return pool.map(func, _chunks(n, processes, chunk_size))
+    finally:
+        pool.close()
+        pool.join()
+
+def _validate_chunk(chunk):
+    roots, document, identifiers, strict, foreign_properties = _state
+    errors = []
+    for pos in xrange(*chunk):
+        e = schema.validate_entry(roots, document[pos], pos, identifiers, strict, foreign_properties)
+        if e is not None:
+            errors.append(e)
+    return errors
+
+def validate_entries(roots, document, identifiers, strict, foreign_properties, processes, chunk_size=None):
+    """Return the error messages of the entries of the list `document` that
+    do not validate, in order."""
+
+    state = (roots, document, identifiers, strict, foreign_properties)
+    return [e for errors in _map(state, _validate_chunk, len(document), processes, chunk_size)
+            for e in errors]
+
+def _unresolved_chunk(chunk):
+    loader, document = _state
+    unresolved = []
+    for pos in xrange(*chunk):
+        links = []
+        loader._collect_links(document[pos], ((pos, document[pos]),), links)
+        # The index is shared with the parent, so it must not be changed
+        # here: reloading a spilled document would delete its spill file.
+        for field, link, path in loader._unresolved(links, readonly=True):
+            unresolved.append((field, link, [key for key, _ in path]))
+    return unresolved
+
+def unresolved_links(loader, document, processes, chunk_size=None):
+    """Return the (field, link, path) of the links in the list `document`
+    that are not in the index or vocabulary of `loader`, in document
+    order."""
+
+    result = []
+    for unresolved in _map((loader, document), _unresolved_chunk, len(document), processes, chunk_size):
+        for field, link, keys in unresolved:
+            # Rebuild the path with this process's objects, which
+            # _link_errors uses to group the errors.
+            val = document
+            path = []
+            for key in keys:
+                val = val[key]
+                path.append((key, val))
+            result.append((field, link, tuple(path)))
+    return result
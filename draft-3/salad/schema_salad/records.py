@@ -0,0 +1,218 @@
+"""Compact in-memory representation of resolved documents.
+
+A resolved document is a tree of dicts, and most of those dicts are records
+of a handful of schema types with the same set of keys.  `Compactor` turns
+each dict into a `CompactRecord`, which holds its values in a tuple and shares
+a `RecordLayout` (the key order) with every other record that has the same
+keys.  Keys are ordered by their position in the schema's record definitions
+when Avro names are given.
+
+Compact records are read-only mappings.  Compact a document after it has been
+validated, since validation expects plain dicts.
+
+`memory_use` measures what interning and compacting save on a set of
+documents, each loaded a number of times as a long-running service would:
+
+    python -m schema_salad.records ../CommonWorkflowLanguage.yml \
+        ../draft-3/count-lines1-wf.cwl ../draft-3/revsort.cwl --copies 20
+"""
+
+import sys
+import argparse
+import schema
+
+class RecordLayout(object):
+    __slots__ = ("fields", "index")
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.index = {f: n for n, f in enumerate(fields)}
+
+class CompactRecord(object):
+    __slots__ = ("_layout", "_values")
+
+    def __init__(self, layout, values):
+        self._layout = layout
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._layout.index[key]]
+
+    def get(self, key, default=None):
+        n = self._layout.index.get(key)
+        return default if n is None else self._values[n]
+
+    def __contains__(self, key):
+        return key in self._layout.index
+
+    def __iter__(self):
+        return iter(self._layout.fields)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return list(self._layout.fields)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._layout.fields, self._values)
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, CompactRecord)):
+            return len(self) == len(other) and all(k in other and other[k] == v for k, v in self.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    # Unhashable, like the dicts it compares equal to.
+    __hash__ = None
+
+    def __repr__(self):
+        return "CompactRecord(%r)" % dict(self.items())
+
+class Compactor(object):
+    """Convert resolved documents to compact records.
+
+    The same Compactor should be used for a document and for the entries of
+    its index, so that shared objects stay shared:
+
+        c = Compactor(avsc_names)
+        doc = c.compact(doc)
+        for k in loader.idx:
+            loader.idx[k] = c.compact(loader.idx[k])
+
+    The Compactor keeps the original objects alive until it is discarded.
+    """
+
+    def __init__(self, names=None):
+        self.layouts = {}
+        self.memo = {}
+        self.rank = {}
+        if names is not None:
+            for sch in names.names.values():
+                for n, f in enumerate(getattr(sch, "fields", [])):
+                    self.rank.setdefault(f.name, n)
+
+    def layout(self, keys):
+        k = frozenset(keys)
+        if k not in self.layouts:
+            unranked = len(self.rank)
+            self.layouts[k] = RecordLayout(tuple(sorted(k, key=lambda f: (self.rank.get(f, unranked), f))))
+        return self.layouts[k]
+
+    def _new(self, obj, stack):
+        # Return the compact counterpart of `obj`, creating it empty and
+        # pushing it on `stack` to be filled in if it is new.
+        if not isinstance(obj, (dict, list)):
+            return obj
+        m = self.memo.get(id(obj))
+        if m is not None:
+            return m[1]
+        if isinstance(obj, list):
+            new = []
+        else:
+            new = CompactRecord(self.layout(obj.keys()), None)
+        self.memo[id(obj)] = (obj, new)
+        stack.append((obj, new))
+        return new
+
+    def compact(self, obj):
+        # Iterative, so that deeply nested documents do not exhaust the
+        # Python stack.
+        stack = []
+        result = self._new(obj, stack)
+        while stack:
+            obj, new = stack.pop()
+            if isinstance(new, list):
+                new.extend([self._new(i, stack) for i in obj])
+            else:
+                new._values = tuple([self._new(obj[f], stack) for f in new._layout.fields])
+        return result
+
+def _expanded(obj, memo, stack):
+    if not isinstance(obj, (CompactRecord, list)):
+        return obj
+    new = memo.get(id(obj))
+    if new is None:
+        new = [] if isinstance(obj, list) else {}
+        memo[id(obj)] = new
+        stack.append((obj, new))
+    return new
+
+def expand(obj, memo=None):
+    """Convert compact records back to plain dicts."""
+
+    if memo is None:
+        memo = {}
+    stack = []
+    result = _expanded(obj, memo, stack)
+    while stack:
+        obj, new = stack.pop()
+        if isinstance(new, list):
+            new.extend([_expanded(i, memo, stack) for i in obj])
+        else:
+            for k, v in obj.items():
+                new[k] = _expanded(v, memo, stack)
+    return result
+
+def deep_size(obj):
+    """Return the size in bytes of `obj` and of every distinct object that it
+    refers to through dicts, lists, tuples and compact records."""
+
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.iterkeys())
+            stack.extend(o.itervalues())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+        elif isinstance(o, CompactRecord):
+            stack.append(o._layout)
+            stack.append(o._values)
+        elif isinstance(o, RecordLayout):
+            stack.append(o.fields)
+            stack.append(o.index)
+    return total
+
+def memory_use(schema_ref, documents, copies=1):
+    """Load each of `documents` `copies` times, each time in a new Loader
+    session, and return the deep size in bytes of all of the loaded
+    documents as plain dicts, with interned URIs, and with interned URIs
+    and compact records."""
+
+    document_loader, avsc_names, _ = schema.load_schema(schema_ref)
+    context = document_loader.context
+    interned = {}
+    plain = []
+    shared = []
+    for _ in xrange(copies):
+        for d in documents:
+            plain.append(context.session().resolve_ref(d)[0])
+            shared.append(context.session(interned=interned).resolve_ref(d)[0])
+    compact = Compactor(avsc_names).compact(shared)
+    return {"plain": deep_size(plain), "interned": deep_size(shared), "compact": deep_size(compact)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the memory used by loaded documents.")
+    parser.add_argument("schema")
+    parser.add_argument("documents", nargs="+")
+    parser.add_argument("--copies", type=int, default=1, help="Load each document this many times")
+    args = parser.parse_args()
+    sizes = memory_use(args.schema, args.documents, args.copies)
+    for k in ("plain", "interned", "compact"):
+        print "%-9s %10.1f KiB  %5.1f%%" % (k, sizes[k] / 1024.0, 100.0 * sizes[k] / sizes["plain"])
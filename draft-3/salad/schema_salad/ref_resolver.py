@@ -3,18 +3,53 @@ import json
 import hashlib
 import logging
 import collections
-import requests
 import urlparse
 import yaml
 import validate
 import pprint
 import StringIO
+import threading
+from multiprocessing.pool import ThreadPool
 from aslist import aslist
-import rdflib
-from rdflib.namespace import RDF, RDFS, OWL
+import fetcher
+from trampoline import run, Return
+from depgraph import DependencyGraph
 
 _logger = logging.getLogger("salad")
 
+# Maximum number of threads used to check for the existence of files
+# referenced by links that are not in the index.
+CHECK_FILE_THREADS = 8
+
+# Maximum number of derived contexts (for distinct `$namespaces` and
+# `$schemas`) cached on each LoaderContext.
+MAX_DERIVED_CONTEXTS = 64
+
+class _FilePool(object):
+    """The threads a Loader checks files with, started on first use and
+    stopped by `close` or when the Loader is garbage collected."""
+
+    def __init__(self):
+        self.pool = None
+        self.pid = None
+
+    def map(self, func, items):
+        if self.pool is None or self.pid != os.getpid():
+            self.pool = ThreadPool(CHECK_FILE_THREADS)
+            self.pid = os.getpid()
+        return self.pool.map(func, items)
+
+    def close(self):
+        # A forked process (see parallel.py) has a copy of the pool but not
+        # its threads, so only the process that started them stops them.
+        if self.pool is not None and self.pid == os.getpid():
+            self.pool.close()
+            self.pool.join()
+        self.pool = None
+
+    def __del__(self):
+        self.close()
+
 class NormDict(dict):
     def __init__(self, normalize=unicode):
         super(NormDict, self).__init__()
@@ -47,42 +82,93 @@ def merge_properties(a, b):
     return c
 
 def SubLoader(loader):
-    return Loader(loader.ctx, schemagraph=loader.graph, foreign_properties=loader.foreign_properties, idx=loader.idx, cache=loader.cache)
+    return Loader(loader.context, foreign_properties=loader.foreign_properties, idx=loader.idx, cache=loader.cache, interned=loader.interned, depgraph=loader.depgraph, prefetched=loader.prefetched, fetchers=loader.fetchers,
+                  secondary=loader.secondary, limits=loader.limits, expressions=loader.expressions,
+                  manifest=loader.manifest)
+
+class LoaderContext(object):
+    """The parts of a Loader that are derived from the schema: the JSON-LD
+    context, the vocabulary and the sets of special fields, and the RDF graph
+    of any `$schemas`.  A LoaderContext is not modified after it is built, so
+    one can be shared by any number of Loader sessions in any number of
+    threads.
+
+    `document_links` names the link fields whose values refer to documents
+    (such as `run`) rather than to data (such as `path`); only those are
+    recorded in the dependency graph.  If None, every link field is.
+
+    Documents that declare `$namespaces` or `$schemas` are resolved with a
+    derived context, which is built once and cached on its parent.  The
+    cache is locked, and holds the MAX_DERIVED_CONTEXTS most recently used
+    derived contexts."""
+
+    def __init__(self, ctx, schemagraph=None, foreign_properties=None, document_links=None):
+        self.ctx = {k: v for k,v in ctx.iteritems() if k != "@context"}
+        self._graph = schemagraph
+        self.foreign_properties = frozenset(foreign_properties or ())
+        self.document_links = frozenset(document_links) if document_links is not None else None
+        self.schema_ids = frozenset()
+        self._derived = collections.OrderedDict()
+        self._derived_lock = threading.Lock()
+
+        url_fields = set()
+        vocab_fields = set()
+        identifiers = set()
+        identity_links = set()
+        nolinkcheck = set()
+        self.vocab = {}
+        self.rvocab = {}
 
-class Loader(object):
-    def __init__(self, ctx, schemagraph=None, foreign_properties=None, idx=None, cache=None):
-        normalize = lambda url: urlparse.urlsplit(url).geturl()
-        if idx is not None:
-            self.idx = idx
-        else:
-            self.idx = NormDict(normalize)
+        _logger.debug("ctx is %s", self.ctx)
 
-        self.ctx = {}
-        if schemagraph is not None:
-            self.graph = schemagraph
-        else:
-            self.graph = rdflib.Graph()
+        for c in self.ctx:
+            if self.ctx[c] == "@id":
+                identifiers.add(c)
+                identity_links.add(c)
+            elif isinstance(self.ctx[c], dict) and self.ctx[c].get("@type") == "@id":
+                url_fields.add(c)
+                if self.ctx[c].get("identity", False):
+                    identity_links.add(c)
+            elif isinstance(self.ctx[c], dict) and self.ctx[c].get("@type") == "@vocab":
+                url_fields.add(c)
+                vocab_fields.add(c)
 
-        if foreign_properties is not None:
-            self.foreign_properties = foreign_properties
-        else:
-            self.foreign_properties = set()
+            if isinstance(self.ctx[c], dict) and self.ctx[c].get("noLinkCheck"):
+                nolinkcheck.add(c)
 
-        if cache is not None:
-            self.cache = cache
-        else:
-            self.cache = {}
+            if isinstance(self.ctx[c], dict) and "@id" in self.ctx[c]:
+                self.vocab[c] = self.ctx[c]["@id"]
+            elif isinstance(self.ctx[c], basestring):
+                self.vocab[c] = self.ctx[c]
 
-        self.url_fields = set()
-        self.vocab_fields = set()
-        self.identifiers = set()
-        self.identity_links = set()
-        self.standalone = set()
-        self.nolinkcheck = set()
-        self.vocab = {}
-        self.rvocab = {}
+        for k,v in self.vocab.items():
+            self.rvocab[self.expand_url(v, "", scoped=False)] = k
 
-        self.add_context(ctx)
+        self.url_fields = frozenset(url_fields)
+        self.vocab_fields = frozenset(vocab_fields)
+        self.identifiers = frozenset(identifiers)
+        self.identity_links = frozenset(identity_links)
+        self.standalone = frozenset()
+        self.nolinkcheck = frozenset(nolinkcheck)
+
+        _logger.debug("identifiers is %s", self.identifiers)
+        _logger.debug("identity_links is %s", self.identity_links)
+        _logger.debug("url_fields is %s", self.url_fields)
+        _logger.debug("vocab_fields is %s", self.vocab_fields)
+        _logger.debug("vocab is %s", self.vocab)
+
+    @property
+    def graph(self):
+        # rdflib is only needed for documents with $schemas, so the graph is
+        # created on first use.
+        if self._graph is None:
+            import rdflib
+            self._graph = rdflib.Graph()
+        return self._graph
+
+    def session(self, idx=None, cache=None, interned=None):
+        """Return a new Loader using this context, with its own index."""
+        return Loader(self, idx=idx, cache=cache, interned=interned)
 
     def expand_url(self, url, base_url, scoped=False, vocab_term=False):
         if url in ("@id", "@type"):
@@ -116,81 +202,205 @@ class Loader(object):
         else:
             return url
 
-    def _add_properties(self, s):
-        for _, _, rng in self.graph.triples( (s, RDFS.range, None) ):
-            literal = ((str(rng).startswith("http://www.w3.org/2001/XMLSchema#") and not str(rng) == "http://www.w3.org/2001/XMLSchema#anyURI") or
-                       str(rng) == "http://www.w3.org/2000/01/rdf-schema#Literal")
-            if not literal:
-                self.url_fields.add(str(s))
-        self.foreign_properties.add(str(s))
+    def _copy(self):
+        c = LoaderContext.__new__(LoaderContext)
+        c.__dict__.update(self.__dict__)
+        c._derived = collections.OrderedDict()
+        c._derived_lock = threading.Lock()
+        return c
+
+    def _derive(self, key, build):
+        with self._derived_lock:
+            c = self._derived.pop(key, None)
+            if c is not None:
+                self._derived[key] = c
+                return c
+        # Built without the lock, since loading $schemas may fetch them; if
+        # two threads build the same context, the first one stored is kept.
+        c = build()
+        with self._derived_lock:
+            c = self._derived.setdefault(key, c)
+            if len(self._derived) > MAX_DERIVED_CONTEXTS:
+                self._derived.popitem(last=False)
+        return c
+
+    def with_namespaces(self, ns):
+        """Return a derived context with the prefixes in `ns` added to the
+        vocabulary."""
+
+        def build():
+            c = self._copy()
+            c.vocab = dict(self.vocab)
+            c.vocab.update(ns)
+            return c
+        return self._derive(("namespaces", tuple(sorted(ns.iteritems()))), build)
+
+    def with_schemas(self, ns, base_url):
+        """Return a derived context with the RDF schemas listed in `ns` (a
+        `$schemas` field) loaded, and their properties added to the link and
+        foreign property fields."""
+
+        urls = tuple(urlparse.urljoin(base_url, sch) for sch in aslist(ns))
+        return self._derive(("schemas", urls), lambda: self._load_schemas(urls))
+
+    def _load_schemas(self, urls):
+        import rdflib
+        from rdflib.namespace import RDF, RDFS, OWL
+
+        c = self._copy()
+        c._graph = rdflib.Graph()
+        if self._graph is not None:
+            c._graph += self._graph
+        for url in urls:
+            c.graph.parse(url)
+
+        url_fields = set(self.url_fields)
+        foreign_properties = set(self.foreign_properties)
+        def add_properties(s):
+            for _, _, rng in c.graph.triples( (s, RDFS.range, None) ):
+                literal = ((str(rng).startswith("http://www.w3.org/2001/XMLSchema#") and not str(rng) == "http://www.w3.org/2001/XMLSchema#anyURI") or
+                           str(rng) == "http://www.w3.org/2000/01/rdf-schema#Literal")
+                if not literal:
+                    url_fields.add(str(s))
+            foreign_properties.add(str(s))
+
+        for s, _, _ in c.graph.triples( (None, RDF.type, RDF.Property) ):
+            add_properties(s)
+        for s, _, o in c.graph.triples( (None, RDFS.subPropertyOf, None) ):
+            add_properties(s)
+            add_properties(o)
+        for s, _, _ in c.graph.triples( (None, RDFS.range, None) ):
+            add_properties(s)
+        for s, _, _ in c.graph.triples( (None, RDF.type, OWL.ObjectProperty) ):
+            add_properties(s)
+
+        c.url_fields = frozenset(url_fields)
+        c.foreign_properties = frozenset(foreign_properties)
+        c.schema_ids = frozenset(str(s) for s, _, _ in c.graph.triples( (None, None, None) ))
+        return c
 
-    def add_namespaces(self, ns):
-        self.vocab.update(ns)
+class Loader(object):
+    """Resolves documents against a LoaderContext.  The Loader holds the
+    state of one resolution session: the index of loaded objects, the text
+    cache, the dependency graph and the foreign properties seen so far.
 
-    def add_schemas(self, ns, base_url):
-        for sch in aslist(ns):
-            self.graph.parse(urlparse.urljoin(base_url, sch))
+    `ctx` is either a LoaderContext, which is shared, or a JSON-LD context
+    dict, from which a new LoaderContext is compiled."""
 
-        for s, _, _ in self.graph.triples( (None, RDF.type, RDF.Property) ):
-            self._add_properties(s)
-        for s, _, o in self.graph.triples( (None, RDFS.subPropertyOf, None) ):
-            self._add_properties(s)
-            self._add_properties(o)
-        for s, _, _ in self.graph.triples( (None, RDFS.range, None) ):
-            self._add_properties(s)
-        for s, _, _ in self.graph.triples( (None, RDF.type, OWL.ObjectProperty) ):
-            self._add_properties(s)
+    def __init__(self, ctx, schemagraph=None, foreign_properties=None, idx=None, cache=None, interned=None, depgraph=None, prefetched=None, fetchers=None, secondary=None, limits=None, expressions=None, manifest=None):
+        if isinstance(ctx, LoaderContext):
+            self.context = ctx
+        else:
+            self.context = LoaderContext(ctx, schemagraph)
 
-        for s, _, _ in self.graph.triples( (None, None, None) ):
-            self.idx[str(s)] = True
+        # If `interned` is a dict, every URI produced by expand_url and every
+        # index key is looked up in it, so that each distinct URI is held by
+        # a single string object no matter how many documents refer to it.
+        self.interned = interned
 
+        # Optional bounds on the size of idx and cache, see docstore.py.
+        self.limits = limits
 
-    def add_context(self, newcontext, baseuri=""):
-        if self.vocab:
-            raise validate.ValidationException("Refreshing context that already has stuff in it")
+        normalize = lambda url: self.intern(urlparse.urlsplit(url).geturl())
+        if idx is not None and limits is not None and getattr(idx, "limits", None) is not limits:
+            # SubLoader passes on the LRUIndex made for `limits`; any other
+            # idx cannot track documents for eviction.
+            raise ValueError("idx must be made by limits.index() when limits are given")
+        if idx is not None:
+            self.idx = idx
+        elif limits is not None:
+            self.idx = limits.index(normalize)
+        else:
+            self.idx = NormDict(normalize)
 
-        self.url_fields = set()
-        self.vocab_fields = set()
-        self.identifiers = set()
-        self.identity_links = set()
-        self.standalone = set()
-        self.nolinkcheck = set()
-        self.vocab = {}
-        self.rvocab = {}
+        if foreign_properties is not None:
+            self.foreign_properties = foreign_properties
+        else:
+            self.foreign_properties = set(self.context.foreign_properties)
 
-        self.ctx.update({k: v for k,v in newcontext.iteritems() if k != "@context"})
+        if cache is not None:
+            self.cache = cache
+        elif limits is not None:
+            self.cache = limits.cache()
+        else:
+            self.cache = {}
 
-        _logger.debug("ctx is %s", self.ctx)
+        # Optional secondary indexes of idx, see secondary.py.
+        self.secondary = secondary
 
-        for c in self.ctx:
-            if self.ctx[c] == "@id":
-                self.identifiers.add(c)
-                self.identity_links.add(c)
-            elif isinstance(self.ctx[c], dict) and self.ctx[c].get("@type") == "@id":
-                self.url_fields.add(c)
-                if self.ctx[c].get("identity", False):
-                    self.identity_links.add(c)
-            elif isinstance(self.ctx[c], dict) and self.ctx[c].get("@type") == "@vocab":
-                self.url_fields.add(c)
-                self.vocab_fields.add(c)
+        # Optional inventory of the expressions in fetched documents, see
+        # expressions.py.
+        self.expressions = expressions
 
-            if isinstance(self.ctx[c], dict) and self.ctx[c].get("noLinkCheck"):
-                self.nolinkcheck.add(c)
+        # Optional record of the text read by fetch_text and the files
+        # checked by validate_links, see resultcache.py.
+        self.manifest = manifest
 
-            if isinstance(self.ctx[c], dict) and "@id" in self.ctx[c]:
-                self.vocab[c] = self.ctx[c]["@id"]
-            elif isinstance(self.ctx[c], basestring):
-                self.vocab[c] = self.ctx[c]
+        # Scheme to fetcher, see fetcher.py.
+        if fetchers is not None:
+            self.fetchers = fetchers
+        else:
+            self.fetchers = fetcher.registry
 
-        for k,v in self.vocab.items():
-            self.rvocab[self.expand_url(v, "", scoped=False)] = k
+        if depgraph is not None:
+            self.depgraph = depgraph
+        else:
+            self.depgraph = DependencyGraph()
 
-        _logger.debug("identifiers is %s", self.identifiers)
-        _logger.debug("identity_links is %s", self.identity_links)
-        _logger.debug("url_fields is %s", self.url_fields)
-        _logger.debug("vocab_fields is %s", self.vocab_fields)
-        _logger.debug("vocab is %s", self.vocab)
+        # Documents already parsed by a prefetch (see asyncload), by URL, as
+        # (document, text size, text hash).  fetch() takes a document from
+        # here instead of parsing it again.
+        if prefetched is not None:
+            self.prefetched = prefetched
+        else:
+            self.prefetched = {}
+
+        # When set, validate_links answers file existence checks by listing
+        # each referenced directory once instead of stat'ing every file.
+        self.prefetch_dirs = False
+        self._stat_cache = None
+        self._file_pool = _FilePool()
+
+    ctx = property(lambda self: self.context.ctx)
+    graph = property(lambda self: self.context.graph)
+    vocab = property(lambda self: self.context.vocab)
+    rvocab = property(lambda self: self.context.rvocab)
+    url_fields = property(lambda self: self.context.url_fields)
+    vocab_fields = property(lambda self: self.context.vocab_fields)
+    identifiers = property(lambda self: self.context.identifiers)
+    identity_links = property(lambda self: self.context.identity_links)
+    standalone = property(lambda self: self.context.standalone)
+    nolinkcheck = property(lambda self: self.context.nolinkcheck)
+    document_links = property(lambda self: self.context.document_links)
+
+    def intern(self, s):
+        if self.interned is None:
+            return s
+        # Equal str and unicode strings are the same key, so store them all
+        # as unicode (as NormDict does); otherwise the type of an interned
+        # URI would depend on which one was seen first.
+        if isinstance(s, str):
+            s = s.decode("utf-8")
+        return self.interned.setdefault(s, s)
 
+    def expand_url(self, url, base_url, scoped=False, vocab_term=False):
+        return self.intern(self.context.expand_url(url, base_url, scoped, vocab_term))
+
+    def add_namespaces(self, ns, base_url=None):
+        self.context = self.context.with_namespaces(ns)
+
+    def add_schemas(self, ns, base_url):
+        self.context = self.context.with_schemas(ns, base_url)
+        self.foreign_properties.update(self.context.foreign_properties)
+        for s in self.context.schema_ids:
+            self.idx[s] = True
+
+    def add_context(self, newcontext, baseuri=""):
+        if self.vocab:
+            raise validate.ValidationException("Refreshing context that already has stuff in it")
+        ctx = dict(self.ctx)
+        ctx.update(newcontext)
+        self.context = LoaderContext(ctx, self.context._graph, self.context.foreign_properties)
 
     def resolve_ref(self, ref, base_url=None):
         base_url = base_url or 'file://%s/' % os.path.abspath('.')
@@ -229,6 +439,9 @@ class Loader(object):
 
         url = self.expand_url(ref, base_url, scoped=(obj is not None))
 
+        if obj is None:
+            self._add_dependency(url, "include" if inc else "import", check_cycle=not inc)
+
         # Has this reference been loaded already?
         if url in self.idx:
             if merge:
@@ -240,6 +453,7 @@ class Loader(object):
         if inc:
             return self.fetch_text(url), {}
 
+        fetched = not obj
         if obj:
             for identifier in self.identifiers:
                 obj[identifier] = url
@@ -254,6 +468,10 @@ class Loader(object):
         # Recursively expand urls and resolve directives
         obj, metadata = self.resolve_all(obj, doc_url)
 
+        # Documents imported by another are collected as part of it.
+        if fetched and self.expressions is not None and not self.depgraph.loading:
+            self.expressions.collect(obj, doc_url, self.identifiers)
+
         # Requested reference should be in the index now, otherwise it's a bad reference
         if url is not None:
             if url in self.idx:
@@ -269,6 +487,45 @@ class Loader(object):
             return obj, metadata
 
     def resolve_all(self, document, base_url, file_base=None):
+        loading = self.depgraph.loading
+        doc_url = urlparse.urldefrag(file_base if file_base is not None else base_url)[0]
+        self.depgraph.add_node(doc_url)
+        if loading and loading[-1] == doc_url:
+            return run(self._resolve_all(document, base_url, file_base))
+        loading.append(doc_url)
+        try:
+            return run(self._resolve_all(document, base_url, file_base))
+        finally:
+            loading.pop()
+
+    def _is_document_link(self, field, url):
+        if self.document_links is not None and field not in self.document_links:
+            return False
+        # Terms in a declared namespace (such as `cwl:draft-3`) are
+        # vocabulary, not documents.
+        if urlparse.urlsplit(url).scheme not in ("file", "http", "https"):
+            return False
+        return not any(url.startswith(ns) for ns in self.vocab.itervalues()
+                       if isinstance(ns, basestring) and ns[-1:] in ("#", "/"))
+
+    def _add_dependency(self, url, kind, check_cycle=False):
+        """Record that the document being loaded depends on `url`.  With
+        `check_cycle`, raise ValidationException if `url` is a document that
+        is itself still being loaded."""
+
+        loading = self.depgraph.loading
+        if not loading:
+            return
+        doc_url, frg = urlparse.urldefrag(url)
+        if check_cycle and (doc_url != loading[-1] or not frg):
+            cycle = self.depgraph.cycle_path(doc_url)
+            if cycle is not None:
+                raise validate.ValidationException("Import cycle: %s" % " -> ".join(cycle + [url]))
+        self.depgraph.add_edge(loading[-1], doc_url, kind)
+
+    def _resolve_all(self, document, base_url, file_base=None):
+        # Generator run by trampoline.run; nested objects are resolved by
+        # yielding a walker for them, scalars are left in place.
         loader = self
         metadata = {}
         if file_base is None:
@@ -277,11 +534,13 @@ class Loader(object):
         if isinstance(document, dict):
             # Handle $import and $include
             if ('$import' in document or '$include' in document):
-                return self.resolve_ref(document, file_base)
+                yield Return(self.resolve_ref(document, file_base))
+                return
         elif isinstance(document, list):
             pass
         else:
-            return document, metadata
+            yield Return((document, metadata))
+            return
 
         newctx = None
         if isinstance(document, dict):
@@ -305,6 +564,8 @@ class Loader(object):
                 if not newctx:
                     newctx = SubLoader(self)
                 newctx.add_schemas(document["$schemas"], file_base)
+                for sch in aslist(document["$schemas"]):
+                    self._add_dependency(urlparse.urljoin(file_base, sch), "schema")
 
             if newctx:
                 loader = newctx
@@ -312,7 +573,7 @@ class Loader(object):
             if "$graph" in document:
                 metadata = {k: v for k,v in document.items() if k != "$graph"}
                 document = document["$graph"]
-                metadata, _ = loader.resolve_all(metadata, base_url, file_base)
+                metadata, _ = yield loader._resolve_all(metadata, base_url, file_base)
 
         if isinstance(document, dict):
             for identifer in loader.identity_links:
@@ -328,11 +589,10 @@ class Loader(object):
                             if document[identifer][n] not in loader.idx:
                                 loader.idx[document[identifer][n]] = document[identifer][n]
 
-            for d in document:
+            for d in document.keys():
                 d2 = loader.expand_url(d, "", scoped=False, vocab_term=True)
-                if d != d2:
-                    document[d2] = document[d]
-                    del document[d]
+                if d != d2 or (d is not d2 and loader.interned is not None):
+                    document[d2] = document.pop(d)
 
             for d in loader.url_fields:
                 if d in document:
@@ -340,10 +600,23 @@ class Loader(object):
                         document[d] = loader.expand_url(document[d], base_url, scoped=False, vocab_term=(d in loader.vocab_fields))
                     elif isinstance(document[d], list):
                         document[d] = [loader.expand_url(url, base_url, scoped=False, vocab_term=(d in loader.vocab_fields)) if isinstance(url, basestring) else url for url in document[d] ]
+                    if d not in loader.vocab_fields and d not in loader.identity_links and d not in loader.nolinkcheck:
+                        for url in aslist(document[d]):
+                            if isinstance(url, basestring) and loader._is_document_link(d, url):
+                                loader._add_dependency(url, d)
+
+            if loader.secondary is not None:
+                for identifier in loader.identifiers:
+                    i = document.get(identifier)
+                    # Through NormDict's lookup, not dict.get, so that the key
+                    # is normalized (and, with an LRUIndex, reloaded if spilled).
+                    if isinstance(i, basestring) and i in loader.idx and loader.idx[i] is document:
+                        loader.secondary.add(i, document, file_base)
 
             try:
                 for key, val in document.items():
-                    document[key], _ = loader.resolve_all(val, base_url, file_base)
+                    if isinstance(val, (dict, list)):
+                        document[key], _ = yield loader._resolve_all(val, base_url, file_base)
             except validate.ValidationException as v:
                 _logger.debug("loader is %s", id(loader))
                 raise validate.ValidationException("(%s) (%s) Validation error in field %s:\n%s" % (id(loader), file_base, key, validate.indent(str(v))))
@@ -364,7 +637,8 @@ class Loader(object):
                             document[i] = l
                             i += 1
                     else:
-                        document[i], _ = loader.resolve_all(val, base_url, file_base)
+                        if isinstance(val, (dict, list)):
+                            document[i], _ = yield loader._resolve_all(val, base_url, file_base)
                         i += 1
             except validate.ValidationException as v:
                 raise validate.ValidationException("(%s) (%s) Validation error in position %i:\n%s" % (id(loader), file_base, i, validate.indent(str(v))))
@@ -375,40 +649,34 @@ class Loader(object):
                         metadata[identifer] = loader.expand_url(metadata[identifer], base_url, scoped=True)
                         loader.idx[metadata[identifer]] = document
 
-        return document, metadata
+        yield Return((document, metadata))
 
     def fetch_text(self, url):
-        if url in self.cache:
-            return self.cache[url]
-
-        split = urlparse.urlsplit(url)
-        scheme, path = split.scheme, split.path
-
-        if scheme in ['http', 'https'] and requests:
-            try:
-                resp = requests.get(url)
-                resp.raise_for_status()
-            except Exception as e:
-                raise RuntimeError(url, e)
-            return resp.text
-        elif scheme == 'file':
-            try:
-                with open(path) as fp:
-                    return fp.read().decode("utf-8")
-            except (OSError, IOError) as e:
-                raise RuntimeError('Error reading %s %s' % (url, e))
-        else:
-            raise ValueError('Unsupported scheme in url: %s' % url)
+        text = self.cache.get(url)
+        if text is None:
+            f = self.fetchers.get(urlparse.urlsplit(url).scheme)
+            if f is None:
+                raise ValueError('Unsupported scheme in url: %s' % url)
+            text = f.fetch_text(url)
+        if self.manifest is not None:
+            self.manifest.add_text(url, text)
+        return text
 
     def fetch(self, url):
         if url in self.idx:
             return self.idx[url]
-        try:
-            text = StringIO.StringIO(self.fetch_text(url))
-            text.name = url
-            result = yaml.load(text)
-        except yaml.parser.ParserError as e:
-            raise validate.ValidationException("Syntax error %s" % (e))
+        if url in self.prefetched:
+            # The text may have left the cache since it was prefetched, so
+            # its size and hash were recorded then.
+            result, size, digest = self.prefetched.pop(url)
+            if self.manifest is not None:
+                self.manifest.add_hash(url, digest)
+        else:
+            text = self.fetch_text(url)
+            size = len(text)
+            result = self.parse_text(url, text)
+        if self.limits is not None:
+            self.idx.add_document(url, size)
         if isinstance(result, dict) and self.identifiers:
             for identifier in self.identifiers:
                 if identifier not in result:
@@ -416,38 +684,75 @@ class Loader(object):
                 self.idx[self.expand_url(result[identifier], url)] = result
         else:
             self.idx[url] = result
+        if self.limits is not None:
+            self._trim(url)
         return result
 
+    def _trim(self, url):
+        # Keep the documents being resolved and everything they depend on.
+        edges = self.depgraph.edges
+        pinned = set(self.depgraph.loading)
+        pinned.add(url)
+        stack = list(pinned)
+        while stack:
+            for dst in edges.get(stack.pop(), ()):
+                if dst not in pinned:
+                    pinned.add(dst)
+                    stack.append(dst)
+        for evicted in self.idx.trim(pinned):
+            self.cache.pop(evicted, None)
+            if self.secondary is not None and self.limits.spill is None:
+                self.secondary.discard_document(evicted)
+
+    def parse_text(self, url, text):
+        try:
+            text = StringIO.StringIO(text)
+            text.name = url
+            return yaml.load(text)
+        except yaml.YAMLError as e:
+            raise validate.ValidationException("Syntax error %s" % (e))
+
     def check_file(self, fn):
         if fn.startswith("file://"):
             u = urlparse.urlsplit(fn)
-            return os.path.exists(u.path)
-        else:
-            return False
+            return self._path_exists(u.path)
+        f = self.fetchers.get(urlparse.urlsplit(fn).scheme)
+        if f is not None and hasattr(f, "exists"):
+            return f.exists(fn)
+        return False
+
+    def _path_exists(self, path):
+        cache = self._stat_cache
+        if cache is None:
+            return os.path.exists(path)
+        if path not in cache:
+            cache[path] = os.path.exists(path)
+        return cache[path]
+
+    def _prefetch_dirs(self, links, pool):
+        """Fill the stat cache for the file:// links in `links` with one
+        directory listing per directory.  Unlike os.path.exists, a dangling
+        symlink counts as present."""
+
+        bydir = {}
+        for link in links:
+            if link.startswith("file://"):
+                path = urlparse.urlsplit(link).path
+                dirname, basename = os.path.split(path)
+                if basename not in ("", ".", ".."):
+                    bydir.setdefault(dirname, []).append((path, basename))
+
+        def listdir(dirname):
+            try:
+                return set(os.listdir(dirname))
+            except OSError:
+                return None
 
-    def validate_link(self, field, link):
-        if field in self.nolinkcheck:
-            return True
-        if isinstance(link, basestring):
-            if field in self.vocab_fields:
-                if link not in self.vocab and link not in self.idx and link not in self.rvocab:
-                    if not self.check_file(link):
-                        raise validate.ValidationException("Field `%s` contains undefined reference to `%s`" % (field, link))
-            elif link not in self.idx and link not in self.rvocab:
-                if not self.check_file(link):
-                    raise validate.ValidationException("Field `%s` contains undefined reference to `%s`" % (field, link))
-        elif isinstance(link, list):
-            errors = []
-            for i in link:
-                try:
-                    self.validate_link(field, i)
-                except validate.ValidationException as v:
-                    errors.append(v)
-            if errors:
-                raise validate.ValidationException("\n".join([str(e) for e in errors]))
-        elif isinstance(link, dict):
-            self.validate_links(link)
-        return True
+        dirnames = list(bydir)
+        for dirname, entries in zip(dirnames, pool.map(listdir, dirnames)):
+            if entries is not None:
+                for path, basename in bydir[dirname]:
+                    self._stat_cache[path] = basename in entries
 
     def getid(self, d):
         if isinstance(d, dict):
@@ -457,42 +762,126 @@ class Loader(object):
                         return d[i]
         return None
 
-    def validate_links(self, document):
-        docid = self.getid(document)
-        if docid is None:
-            docid = ""
+    def validate_links(self, document, processes=None):
+        """Check that every link in `document` refers to something in the
+        index, the vocabulary or (for file:// links) the filesystem.
 
-        errors = []
-        if isinstance(document, list):
-            iterator = enumerate(document)
-        elif isinstance(document, dict):
-            try:
+        Links are first collected in a single pass over the document, then
+        each distinct target is checked once, with filesystem checks for
+        unresolved targets spread over a thread pool.  With `processes`
+        greater than one, the entries of a list are collected and looked up
+        in that many processes (see parallel.py)."""
+
+        if processes is not None and processes > 1 and isinstance(document, list) and len(document) > 1:
+            import parallel
+            links = parallel.unresolved_links(self, document, processes)
+        else:
+            links = []
+            self._collect_links(document, (), links)
+        failed = self._check_links(links)
+        if failed:
+            raise validate.ValidationException(self._link_errors(failed))
+
+    def _collect_links(self, document, path, links):
+        # Depth first, in document order, using an explicit stack.
+        stack = [(document, path)]
+        while stack:
+            document, path = stack.pop()
+            if isinstance(document, list):
+                children = enumerate(document)
+            elif isinstance(document, dict):
                 for d in self.url_fields:
-                    if d not in self.identity_links and d in document:
-                        self.validate_link(d, document[d])
-            except validate.ValidationException as v:
-                errors.append(v)
-            iterator = document.iteritems()
+                    if d in document and d not in self.identity_links and d not in self.nolinkcheck:
+                        self._collect_field_links(d, document[d], path, links)
+                children = document.iteritems()
+            else:
+                continue
+
+            children = [(val, path + ((key, val),)) for key, val in children
+                        if isinstance(val, (dict, list)) and key not in self.nolinkcheck]
+            children.reverse()
+            stack.extend(children)
+
+    def _collect_field_links(self, field, link, path, links):
+        stack = [link]
+        while stack:
+            link = stack.pop()
+            if isinstance(link, basestring):
+                links.append((field, link, path))
+            elif isinstance(link, list):
+                stack.extend(reversed(link))
+
+    def _unresolved(self, links, readonly=False):
+        """Return the (field, link, path) tuples in `links` whose link is not
+        in the index or the vocabulary.  With `readonly`, an LRUIndex is
+        searched without reloading spilled documents (see docstore.py)."""
+
+        if readonly and hasattr(self.idx, "contains"):
+            in_idx = self.idx.contains
         else:
-            return
-
-        for key, val in iterator:
-            try:
-                self.validate_links(val)
-            except validate.ValidationException as v:
-                if key not in self.nolinkcheck:
-                    docid = self.getid(val)
-                    if docid:
-                        errors.append(validate.ValidationException("While checking object `%s`\n%s" % (docid, validate.indent(str(v)))))
-                    else:
-                        if isinstance(key, basestring):
-                            errors.append(validate.ValidationException("While checking field `%s`\n%s" % (key, validate.indent(str(v)))))
-                        else:
-                            errors.append(validate.ValidationException("While checking position %s\n%s" % (key, validate.indent(str(v)))))
+            in_idx = self.idx.__contains__
+        known = {}
+        unresolved = []
+        for field, link, path in links:
+            key = (field in self.vocab_fields, link)
+            if key not in known:
+                known[key] = ((key[0] and link in self.vocab) or
+                              in_idx(link) or link in self.rvocab)
+            if not known[key]:
+                unresolved.append((field, link, path))
+        return unresolved
+
+    def _check_links(self, links):
+        """Return the subset of (field, link, path) tuples in `links` whose
+        link does not resolve."""
+
+        unresolved = self._unresolved(links)
+        self._stat_cache = {}
+        try:
+            exists = self._check_files(set(link for _, link, _ in unresolved))
+        finally:
+            self._stat_cache = None
+        if self.manifest is not None:
+            self.manifest.add_files(exists)
+
+        return [(field, link, path) for field, link, path in unresolved if not exists[link]]
+
+    def _check_files(self, links):
+        links = list(links)
+        if len(links) > 1:
+            if self.prefetch_dirs:
+                self._prefetch_dirs(links, self._file_pool)
+            found = self._file_pool.map(self.check_file, links)
+        else:
+            found = [self.check_file(l) for l in links]
+        return dict(zip(links, found))
+
+    def _link_errors(self, failed):
+        """Format failed links as a nested error message following the
+        structure of the document."""
+
+        root = ([], collections.OrderedDict())
+        for field, link, path in failed:
+            node = root
+            for key, val in path:
+                step = (key, id(val))
+                if step not in node[1]:
+                    node[1][step] = ([], collections.OrderedDict(), key, val)
+                node = node[1][step]
+            node[0].append("Field `%s` contains undefined reference to `%s`" % (field, link))
+
+        def render(node):
+            errors = list(node[0])
+            for child in node[1].itervalues():
+                key, val = child[2], child[3]
+                docid = self.getid(val)
+                if docid:
+                    header = "While checking object `%s`" % docid
+                elif isinstance(key, basestring):
+                    header = "While checking field `%s`" % key
+                else:
+                    header = "While checking position %s" % key
+                errors.append("%s\n%s" % (header, validate.indent((yield render(child)))))
+            yield Return("\n".join(errors))
 
-        if errors:
-            if len(errors) > 1:
-                raise validate.ValidationException("\n".join([str(e) for e in errors]))
-            else:
-                raise errors[0]
-        return
+        return run(render(root))
@@ -0,0 +1,170 @@
+"""Persistent cache of document validation results.
+
+    cache = ResultCache("~/.cache/salad")
+    data, metadata = schema.load_and_validate(document_loader, avsc_names, uri, True,
+                                              result_cache=cache)
+
+A result is stored under the absolute URL of the document (or the hash of
+its content, for a document passed as a dict), the hash of the compiled
+schema and the strictness.  With it is stored a `Manifest` of everything the
+Loader read while resolving and checking it: the hash of the text of each
+URL it read (for a prefetched document, taken when it was fetched), and
+whether each file that a link was checked against existed.  A stored
+result is used only if reading those URLs again gives the same hashes and
+the files still exist or not as before, so a change to any document it
+imports or includes, directly or not, makes it miss.
+
+A hit returns the stored verdict without validating the document again.
+With `store_documents` the resolved document is stored too, and a hit also
+skips resolution.
+"""
+
+import os
+import json
+import errno
+import urlparse
+import tempfile
+import avro.schema
+import validate
+import schema
+import timings
+from joborder import content_hash
+from fetcher import text_hash
+
+# Part of every key, so that results stored by an incompatible version are
+# not used.
+FORMAT = 1
+
+class Manifest(object):
+    """What a Loader read: text hashes by URL, and file existence by URL."""
+
+    def __init__(self):
+        self.texts = {}
+        self.files = {}
+
+    def add_text(self, url, text):
+        self.texts[url] = text_hash(text)
+
+    def add_hash(self, url, digest):
+        self.texts[url] = digest
+
+    def add_files(self, exists):
+        self.files.update(exists)
+
+    def to_dict(self):
+        return {"texts": self.texts, "files": self.files}
+
+def schema_hash(avsc_names):
+    """Hash of the compiled schema `avsc_names`."""
+    names = avro.schema.Names()
+    return content_hash([avsc_names.names[k].to_json(names) for k in sorted(avsc_names.names)])
+
+def _read(loader, url):
+    f = loader.fetchers.get(urlparse.urlsplit(url).scheme)
+    if f is None:
+        raise ValueError('Unsupported scheme in url: %s' % url)
+    return f.fetch_text(url)
+
+class ResultCache(object):
+    def __init__(self, directory, store_documents=False):
+        self.directory = os.path.expanduser(directory)
+        self.store_documents = store_documents
+        self.hits = 0
+        self.misses = 0
+        self._schema_hashes = {}
+
+    def key(self, document, avsc_names, strict):
+        if id(avsc_names) not in self._schema_hashes:
+            # Keep avsc_names alive so that its id is not reused.
+            self._schema_hashes[id(avsc_names)] = (avsc_names, schema_hash(avsc_names))
+        doc = document if isinstance(document, basestring) else content_hash(document)
+        return content_hash([FORMAT, doc, self._schema_hashes[id(avsc_names)][1], bool(strict)])
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, loader):
+        """Return the entry stored under `key` if everything it was made from
+        is unchanged, else None.  Files are read with the fetchers of
+        `loader`, not from its cache, which may hold text read before they
+        changed."""
+
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            unchanged = (all(text_hash(_read(loader, url)) == h for url, h in entry["texts"].iteritems()) and
+                         all(loader.check_file(url) == e for url, e in entry["files"].iteritems()))
+        except Exception:
+            unchanged = False
+        if not unchanged:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, manifest, error=None, phase=None, document=None, metadata=None):
+        """Store a result: `error` is the message of the ValidationException
+        raised by `phase` ("link check" or "validation"), or None if the
+        document is valid."""
+
+        entry = manifest.to_dict()
+        entry["error"] = error
+        entry["phase"] = phase
+        if self.store_documents and error is None and document is not None:
+            entry["document"] = document
+            entry["metadata"] = metadata
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Write to a temporary file and rename it, so that concurrent runs
+        # never see a partial entry.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.rename(tmp, path)
+
+    def load_and_validate(self, document_loader, avsc_names, document, strict):
+        """Like `schema.load_and_validate`, but return a stored result if
+        there is one and store the result otherwise."""
+
+        if isinstance(document, basestring):
+            # The same relative path names different documents in different
+            # working directories.
+            document = document_loader.expand_url(document, "file://%s/" % os.getcwd())
+        key = self.key(document, avsc_names, strict)
+        entry = self.get(key, document_loader)
+        if entry is not None:
+            if entry["error"] is not None:
+                raise validate.ValidationException(entry["error"])
+            if "document" in entry:
+                return entry["document"], entry["metadata"]
+            return schema.resolve_document(document_loader, document)
+
+        # Documents the Loader fetched before it had a manifest are not in
+        # it, so a result that may depend on them is not stored.
+        store = document_loader.manifest is not None or not document_loader.depgraph.edges
+        # Set only now, so that the reads done by `get` are not recorded.
+        if document_loader.manifest is None:
+            document_loader.manifest = Manifest()
+        data, metadata = schema.resolve_document(document_loader, document)
+        try:
+            with timings.phase("document link check"):
+                phase = "link check"
+                document_loader.validate_links(data)
+            with timings.phase("document validation"):
+                phase = "validation"
+                schema.validate_doc(avsc_names, data, document_loader, strict)
+        except validate.ValidationException as e:
+            if store:
+                self.put(key, document_loader.manifest, str(e), phase)
+            raise
+        if store:
+            self.put(key, document_loader.manifest, document=data, metadata=metadata)
+        return data, metadata
@@ -1,9 +1,8 @@
 import avro
 import copy
-from  makedoc import add_dictlist
 import sys
 import pprint
-from pkg_resources import resource_stream
+import pkgutil
 import yaml
 import avro.schema
 import validate
@@ -13,7 +12,9 @@ import ref_resolver
 from flatten import flatten
 import logging
 from aslist import aslist
+from trampoline import run, Return
 import jsonld_context
+import timings
 import schema_salad.schema
 
 _logger = logging.getLogger("salad")
@@ -40,6 +41,10 @@ salad_files = ('metaschema.yml',
               'vocab_res_proc.yml')
 
 def get_metaschema():
+    with timings.phase("metaschema load"):
+        return _load_metaschema()
+
+def _load_metaschema():
     loader = ref_resolver.Loader({
         "Any": "https://w3id.org/cwl/salad#Any",
         "ArraySchema": "https://w3id.org/cwl/salad#ArraySchema",
@@ -127,13 +132,9 @@ def get_metaschema():
     })
 
     for f in salad_files:
-        rs = resource_stream(__name__, 'metaschema/' + f)
-        loader.cache["https://w3id.org/cwl/" + f] = rs.read()
-        rs.close()
+        loader.cache["https://w3id.org/cwl/" + f] = pkgutil.get_data("schema_salad", 'metaschema/' + f)
 
-    rs = resource_stream(__name__, 'metaschema/metaschema.yml')
-    loader.cache["https://w3id.org/cwl/salad"] = rs.read()
-    rs.close()
+    loader.cache["https://w3id.org/cwl/salad"] = pkgutil.get_data("schema_salad", 'metaschema/metaschema.yml')
 
     j = yaml.load(loader.cache["https://w3id.org/cwl/salad"])
     j, _ = loader.resolve_all(j, "https://w3id.org/cwl/salad#")
@@ -151,39 +152,85 @@ def load_schema(schema_ref, cache=None):
     metaschema_names, metaschema_doc, metaschema_loader = get_metaschema()
     if cache is not None:
         metaschema_loader.cache = cache
-    schema_doc, schema_metadata = metaschema_loader.resolve_ref(schema_ref, "")
+    with timings.phase("schema fetch/resolve"):
+        schema_doc, schema_metadata = metaschema_loader.resolve_ref(schema_ref, "")
 
-    validate_doc(metaschema_names, schema_doc, metaschema_loader, True)
+    with timings.phase("schema validation"):
+        validate_doc(metaschema_names, schema_doc, metaschema_loader, True)
     metactx = schema_metadata.get("@context", {})
     metactx.update(schema_metadata.get("$namespaces", {}))
-    (schema_ctx, rdfs) = jsonld_context.salad_to_jsonld_context(schema_doc, metactx)
+    with timings.phase("context generation"):
+        schema_ctx = jsonld_context.make_jsonld_context(schema_doc, metactx)
 
     # Create the loader that will be used to load the target document.
-    document_loader = ref_resolver.Loader(schema_ctx, cache=cache)
+    document_loader = ref_resolver.Loader(
+        ref_resolver.LoaderContext(schema_ctx, document_links=document_link_fields(schema_doc)), cache=cache)
 
     # Make the Avro validation that will be used to validate the target document
-    (avsc_names, avsc_obj) = schema_salad.schema.make_avro_schema(schema_doc, document_loader)
+    with timings.phase("avro compilation"):
+        (avsc_names, avsc_obj) = schema_salad.schema.make_avro_schema(schema_doc, document_loader)
 
     return document_loader, avsc_names, schema_metadata
 
-def load_and_validate(document_loader, avsc_names, document, strict):
-    if isinstance(document, dict):
-        data, metadata = document_loader.resolve_all(document, document["id"])
-    else:
-        data, metadata = document_loader.resolve_ref(document)
+def document_link_fields(j):
+    """Return the names of the link fields of the schema `j` whose type
+    admits a record, so that their values refer to documents (such as a
+    `run` of a Process) rather than to data (such as a `path` string)."""
+
+    records = set(t["name"] for t in j if isinstance(t, dict) and t.get("type") == "record")
+    fields = set()
+    for t in j:
+        if not isinstance(t, dict):
+            continue
+        for f in t.get("fields", []):
+            p = f.get("jsonldPredicate")
+            if not (isinstance(p, dict) and p.get("_type") == "@id"):
+                continue
+            types = [f["type"]]
+            while types:
+                ft = types.pop()
+                if isinstance(ft, list):
+                    types.extend(ft)
+                elif isinstance(ft, dict) and ft.get("type") == "array":
+                    types.append(ft["items"])
+                elif (isinstance(ft, dict) and ft.get("type") == "record") or ft in records:
+                    name = f["name"]
+                    if urlparse.urlsplit(name).scheme:
+                        name = jsonld_context.split_uri(unicode(name))[1]
+                    fields.add(name)
+                    break
+    return fields
+
+def resolve_document(document_loader, document):
+    with timings.phase("document resolve"):
+        if isinstance(document, dict):
+            return document_loader.resolve_all(document, document["id"])
+        else:
+            return document_loader.resolve_ref(document)
 
-    document_loader.validate_links(data)
-    validate_doc(avsc_names, data, document_loader, strict)
+def load_and_validate(document_loader, avsc_names, document, strict, result_cache=None):
+    """Resolve `document` (a URI or a dict), check its links and validate it.
+    With a `resultcache.ResultCache`, a stored result is used if nothing the
+    document was made from has changed."""
+
+    if result_cache is not None:
+        return result_cache.load_and_validate(document_loader, avsc_names, document, strict)
+
+    data, metadata = resolve_document(document_loader, document)
+
+    with timings.phase("document link check"):
+        document_loader.validate_links(data)
+    with timings.phase("document validation"):
+        validate_doc(avsc_names, data, document_loader, strict)
     return data, metadata
 
-def validate_doc(schema_names, validate_doc, loader, strict):
-    has_root = False
-    for r in schema_names.names.values():
-        if r.get_prop("documentRoot"):
-            has_root = True
-            break
+def validate_doc(schema_names, validate_doc, loader, strict, processes=None):
+    """Validate `validate_doc`, a resolved document or list of documents.
+    With `processes` greater than one, the entries of a list are validated
+    in that many processes (see parallel.py)."""
 
-    if not has_root:
+    roots = document_roots(schema_names)
+    if not roots:
         raise validate.ValidationException("No document roots defined in the schema")
 
     if isinstance(validate_doc, list):
@@ -193,52 +240,71 @@ def validate_doc(schema_names, validate_doc, loader, strict):
     else:
         raise validate.ValidationException("Document must be dict or list")
 
-    anyerrors = []
-    for pos, item in enumerate(validate_doc):
-        errors = []
-        success = False
-        for r in schema_names.names.values():
-            if r.get_prop("documentRoot"):
-                try:
-                    validate.validate_ex(r, item, loader.identifiers, strict, foreign_properties=loader.foreign_properties)
-                    success = True
-                    break
-                except validate.ValidationException as e:
-                    errors.append("Could not validate as `%s` because\n%s" % (r.get_prop("name"), validate.indent(str(e), nolead=False)))
-        if not success:
-            objerr = "Validation error at position %i" % pos
-            for ident in loader.identifiers:
-                if ident in item:
-                    objerr = "Validation error in object %s" % (item[ident])
-                    break
-            anyerrors.append("%s\n%s" % (objerr, validate.indent("\n".join(errors))))
+    if processes is not None and processes > 1 and len(validate_doc) > 1:
+        import parallel
+        anyerrors = parallel.validate_entries(roots, validate_doc, loader.identifiers, strict, loader.foreign_properties, processes)
+    else:
+        anyerrors = [e for e in (validate_entry(roots, item, pos, loader.identifiers, strict, loader.foreign_properties)
+                                 for pos, item in enumerate(validate_doc)) if e is not None]
     if anyerrors:
         raise validate.ValidationException("\n".join(anyerrors))
 
+def document_roots(schema_names):
+    return [r for r in schema_names.names.values() if r.get_prop("documentRoot")]
+
+def validate_entry(roots, item, pos, identifiers, strict, foreign_properties):
+    """Validate `item`, at position `pos` of the document, against the
+    document `roots`.  Returns the error message, or None if it is valid."""
+
+    errors = []
+    for r in roots:
+        try:
+            validate.validate_ex(r, item, identifiers, strict, foreign_properties=foreign_properties)
+            return None
+        except validate.ValidationException as e:
+            errors.append("Could not validate as `%s` because\n%s" % (r.get_prop("name"), validate.indent(str(e), nolead=False)))
+    objerr = "Validation error at position %i" % pos
+    for ident in identifiers:
+        if ident in item:
+            objerr = "Validation error in object %s" % (item[ident])
+            break
+    return "%s\n%s" % (objerr, validate.indent("\n".join(errors)))
+
 
 def replace_type(items, spec, loader, found):
     """ Go through and replace types in the 'spec' mapping"""
 
-    items = copy.deepcopy(items)
+    return run(_replace_type(items, spec, loader, found))
+
+def _replace_type(items, spec, loader, found):
+    # Generator run by trampoline.run.  Each dict and list is copied as it is
+    # visited; the fields that are not walked are deep copied.
     if isinstance(items, dict):
+        items = {k: (v if k in ("type", "items", "fields") else copy.deepcopy(v))
+                 for k, v in items.iteritems()}
+
         # recursively check these fields for types to replace
         if "type" in items and items["type"] in ("record", "enum"):
             if items.get("name"):
                 if items["name"] in found:
-                    return items["name"]
+                    yield Return(items["name"])
+                    return
                 else:
                     found.add(items["name"])
 
         for n in ("type", "items", "fields"):
             if n in items:
-                items[n] = replace_type(items[n], spec, loader, found)
+                items[n] = yield _replace_type(items[n], spec, loader, found)
                 if isinstance(items[n], list):
                     items[n] = flatten(items[n])
 
-        return items
+        yield Return(items)
     elif isinstance(items, list):
         # recursively transform list
-        return [replace_type(i, spec, loader, found) for i in items]
+        l = []
+        for i in items:
+            l.append((yield _replace_type(i, spec, loader, found)))
+        yield Return(l)
     elif isinstance(items, basestring):
         # found a string which is a symbol corresponding to a type.
         replace_with = None
@@ -251,8 +317,9 @@ def replace_type(items, spec, loader, found):
             replace_with = spec[items]
 
         if replace_with:
-            return replace_type(replace_with, spec, loader, found)
-    return items
+            yield Return((yield _replace_type(replace_with, spec, loader, found)))
+            return
+    yield Return(copy.deepcopy(items))
 
 def avro_name(url):
     doc_url, frg = urlparse.urldefrag(url)
@@ -296,6 +363,10 @@ def make_valid_avro(items, alltypes, found, union=False):
         items = avro_name(items)
     return items
 
+def add_dictlist(di, key, val):
+    if key not in di:
+        di[key] = []
+    di[key].append(val)
 
 def extend_and_specialize(items, loader):
     """Apply 'extend' and 'specialize' to fully materialize derived record
@@ -351,7 +422,8 @@ def extend_and_specialize(items, loader):
                     y["doc"] = "Must be `%s` to indicate this is a %s object." % (r["name"], r["name"])
             elif t["type"] == "enum":
                 exsym.extend(t.get("symbols", []))
-                t["symbol"] = exsym
+                seen = set()
+                t["symbols"] = [sym for sym in exsym if not (sym in seen or seen.add(sym))]
 
             types[t["name"]] = t
 
@@ -0,0 +1,81 @@
+"""Secondary indexes of the objects in a Loader's index.
+
+`Loader.idx` maps the id of each object to the object.  A Loader created
+with a `SecondaryIndex` also records, while resolving, each object with an
+id by
+
+    class       the value of its `class` field
+    document    the URL of the document it was loaded from
+    parent      the id it is nested under by its fragment path, so that
+                `wf.cwl#step1/input` is a child of `wf.cwl#step1`, which is
+                a child of `wf.cwl`
+
+Lookups return the ids in the order the objects were resolved; the objects
+themselves are in `Loader.idx`:
+
+    ldr = Loader(ctx, secondary=SecondaryIndex())
+    ldr.resolve_ref("wf.cwl")
+    steps = [ldr.idx[i] for i in ldr.secondary.children("file:///wf.cwl#main")]
+"""
+
+import urlparse
+
+def parent_id(url):
+    """The id that `url` is nested under, or None for a document URL."""
+    doc_url, frg = urlparse.urldefrag(url)
+    if not frg:
+        return None
+    if "/" in frg:
+        return "%s#%s" % (doc_url, frg.rsplit("/", 1)[0])
+    return doc_url
+
+class SecondaryIndex(object):
+    def __init__(self, class_field="class"):
+        self.class_field = class_field
+        self.ids = set()
+        self.classes = {}
+        self.documents = {}
+        self.parents = {}
+
+    def add(self, url, obj, doc_url):
+        if url in self.ids:
+            return
+        self.ids.add(url)
+        cls = obj.get(self.class_field)
+        if isinstance(cls, basestring):
+            self.classes.setdefault(cls, []).append(url)
+        self.documents.setdefault(urlparse.urldefrag(doc_url)[0], []).append(url)
+        parent = parent_id(url)
+        if parent is not None:
+            self.parents.setdefault(parent, []).append(url)
+
+    def discard_document(self, doc_url):
+        """Forget the ids of the document `doc_url`, when it is evicted from
+        the index (see docstore.py)."""
+        ids = set(self.documents.pop(doc_url, ()))
+        if not ids:
+            return
+        self.ids -= ids
+        for index in (self.classes, self.parents):
+            for k in index.keys():
+                index[k] = [i for i in index[k] if i not in ids]
+                if not index[k]:
+                    del index[k]
+
+    def by_class(self, cls):
+        return self.classes.get(cls, [])
+
+    def in_document(self, doc_url):
+        return self.documents.get(doc_url, [])
+
+    def children(self, url):
+        return self.parents.get(url, [])
+
+    def descendants(self, url):
+        """All ids nested under `url`, breadth first."""
+        result = list(self.children(url))
+        i = 0
+        while i < len(result):
+            result.extend(self.children(result[i]))
+            i += 1
+        return result
@@ -0,0 +1,237 @@
+import os
+import sys
+import time
+import __builtin__
+import signal
+import logging
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_logger = logging.getLogger("salad")
+
+_local = threading.local()
+
+def _collectors():
+    if not hasattr(_local, "collectors"):
+        _local.collectors = []
+    return _local.collectors
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None if the
+    platform does not report it."""
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss
+    return rss * 1024
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+class Phase(object):
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.wall = 0.0
+        self.cpu = 0.0
+        # Peak RSS of the whole process when the phase ended, and how much
+        # the phase raised it (0 if it stayed below an earlier peak).
+        self.peak_rss = None
+        self.rss_growth = None
+
+class StackSampler(object):
+    """Statistical profiler that periodically records the Python stack of the
+    main thread and counts identical stacks, for output in the "collapsed"
+    format understood by flamegraph.pl and speedscope."""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = {}
+        self._old_handler = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s (%s:%i)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        key = ";".join(reversed(stack))
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def start(self):
+        if not hasattr(signal, "setitimer"):
+            raise RuntimeError("Stack sampling requires signal.setitimer, which is not available on this platform")
+        self._old_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._old_handler or signal.SIG_DFL)
+
+    def write(self, out):
+        for stack in sorted(self.stacks):
+            out.write("%s %i\n" % (stack, self.stacks[stack]))
+
+class Timings(object):
+    """Collect wall time, CPU time and growth of the process's peak memory
+    for every `phase` entered on this thread while active.  Optionally also
+    run cProfile and/or a stack sampler over the same span.
+
+        with Timings() as t:
+            load_and_validate(...)
+        t.report(sys.stderr)
+    """
+
+    def __init__(self, profile=False, sample_interval=None):
+        self.phases = []
+        self.profiler = None
+        if profile:
+            # Imported only when used, to keep it out of the CLI's startup.
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self.sampler = StackSampler(sample_interval) if sample_interval else None
+        self._depth = 0
+
+    def start(self):
+        _collectors().append(self)
+        if self.sampler:
+            self.sampler.start()
+        if self.profiler:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler:
+            self.profiler.disable()
+        if self.sampler:
+            self.sampler.stop()
+        _collectors().remove(self)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    def _begin(self, name):
+        p = Phase(name, self._depth)
+        self.phases.append(p)
+        self._depth += 1
+        return p
+
+    def _end(self, p, wall, cpu, rss, growth):
+        self._depth -= 1
+        p.wall = wall
+        p.cpu = cpu
+        p.peak_rss = rss
+        p.rss_growth = growth
+
+    def report(self, out):
+        def mib(n):
+            return "%.1f" % (n / 1048576.0) if n is not None else "-"
+        out.write("%-40s %10s %10s %18s %18s\n" % ("phase", "wall (s)", "cpu (s)", "peak growth (MiB)", "process peak (MiB)"))
+        for p in self.phases:
+            out.write("%-40s %10.3f %10.3f %18s %18s\n" % (("  " * p.depth) + p.name, p.wall, p.cpu,
+                                                        mib(p.rss_growth), mib(p.peak_rss)))
+
+    def dump_stats(self, path):
+        """Write cProfile statistics, readable with the `pstats` module."""
+        if self.profiler is None:
+            raise ValueError("Profiling was not enabled")
+        self.profiler.dump_stats(path)
+
+    def dump_collapsed(self, path):
+        """Write sampled stacks in collapsed-stack (flamegraph) format."""
+        if self.sampler is None:
+            raise ValueError("Stack sampling was not enabled")
+        with open(path, "w") as out:
+            self.sampler.write(out)
+
+@contextlib.contextmanager
+def phase(name):
+    """Mark a named phase of work.  Costs almost nothing unless a `Timings`
+    collector is active on the current thread."""
+
+    collectors = _collectors()
+    if not collectors:
+        yield
+        return
+
+    started = [(t, t._begin(name)) for t in collectors]
+    wall = time.time()
+    cpu = cpu_time()
+    # ru_maxrss is the high-water mark of the whole process, so a phase is
+    # charged with how much it raised it.
+    start_rss = peak_rss()
+    try:
+        yield
+    finally:
+        wall = time.time() - wall
+        cpu = cpu_time() - cpu
+        rss = peak_rss()
+        growth = rss - start_rss if rss is not None else None
+        for t, p in started:
+            t._end(p, wall, cpu, rss, growth)
+
+class ImportTimer(object):
+    """Record how long each module takes to import, like `python3 -X
+    importtime`.  `records` holds (name, depth, self, cumulative) tuples in
+    the order that the imports finish, with times in seconds."""
+
+    def __init__(self):
+        self.records = []
+        self._children = []
+        self._import = None
+
+    def _timed_import(self, name, *args, **kwargs):
+        count = len(sys.modules)
+        self._children.append(0.0)
+        start = time.time()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children = self._children.pop()
+            if self._children:
+                self._children[-1] += elapsed
+            if len(sys.modules) != count:
+                self.records.append((name, len(self._children), elapsed - children, elapsed))
+
+    def start(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+
+    def stop(self):
+        __builtin__.__import__ = self._import
+
+    def report(self, out):
+        out.write("import time: self [us] | cumulative | imported package\n")
+        for name, depth, own, total in self.records:
+            out.write("import time: %9i | %10i | %s%s\n" % (own * 1e6, total * 1e6, "  " * depth, name))
+
+def import_times(module):
+    """Import `module` and return the ImportTimer records."""
+    timer = ImportTimer()
+    timer.start()
+    try:
+        __import__(module)
+    finally:
+        timer.stop()
+    return timer.records
+
+if __name__ == "__main__":
+    timer = ImportTimer()
+    timer.start()
+    try:
+        __import__(sys.argv[1] if len(sys.argv) > 1 else "schema_salad.main")
+    finally:
+        timer.stop()
+    timer.report(sys.stderr)
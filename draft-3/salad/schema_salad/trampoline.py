@@ -0,0 +1,50 @@
+"""Run recursive tree walks without nesting Python stack frames.
+
+A walker is written as a generator.  Where a recursive function would call
+itself, the generator instead yields a child generator; `run` drives the
+child and sends its result back into the parent at the yield.  If the child
+raises, the exception is thrown into the parent at the same point, so
+try/except blocks around a yield behave exactly as they would around a
+recursive call.  A generator produces its result by yielding `Return(value)`.
+
+Because only `run` ever resumes a generator, the depth of the walk is limited
+by memory rather than by the interpreter's recursion limit.
+"""
+
+import sys
+
+class Return(object):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+def run(gen):
+    stack = [gen]
+    send = None
+    exc = None
+    while True:
+        g = stack[-1]
+        try:
+            if exc is not None:
+                e, exc = exc, None
+                req = g.throw(*e)
+            else:
+                req = g.send(send)
+        except StopIteration:
+            req = Return(None)
+        except Exception:
+            stack.pop()
+            if not stack:
+                raise
+            exc = sys.exc_info()
+            continue
+
+        if isinstance(req, Return):
+            stack.pop()
+            if not stack:
+                return req.value
+            send = req.value
+        else:
+            stack.append(req)
+            send = None
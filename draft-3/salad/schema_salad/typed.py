@@ -0,0 +1,318 @@
+"""Runtime support for Python classes generated by `codegen.py`.
+
+Generated modules define one `Record` subclass per record type and one
+`Enum` subclass per enum type, and a tree of loaders that check a resolved
+document against the schema and build the objects in the same pass.  The
+checks and error messages follow `validate.py`.
+
+Enum values are kept as strings; the Enum classes only hold the symbols.
+"""
+
+from validate import (ValidationException, indent, multi, vpformat,
+                      INT_MIN_VALUE, INT_MAX_VALUE, LONG_MIN_VALUE, LONG_MAX_VALUE)
+import urlparse
+
+class LoadingOptions(object):
+    __slots__ = ("strict", "identifiers", "foreign_properties", "loaded")
+
+    def __init__(self, strict=True, identifiers=(), foreign_properties=()):
+        self.strict = strict
+        self.identifiers = frozenset(identifiers)
+        self.foreign_properties = frozenset(foreign_properties)
+        # (id(doc), class) -> (doc, object), so that a dict that appears in
+        # several places becomes a single object.
+        self.loaded = {}
+
+class Record(object):
+    """Base class of generated record classes.  `_fields` lists (field
+    name, attribute name) pairs; fields that are not in the schema are kept
+    in `extension_fields` when validation is not strict."""
+
+    __slots__ = ("extension_fields",)
+    _fields = ()
+    _field_names = frozenset()
+    _loaders = ()
+
+    def save(self):
+        """Return the object as a plain dict, leaving out unset fields."""
+        d = {}
+        for name, attr in self._fields:
+            v = getattr(self, attr)
+            if v is not None:
+                d[name] = _save(v)
+        if self.extension_fields:
+            d.update(self.extension_fields)
+        return d
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return all(getattr(self, a) == getattr(other, a) for a in self.__slots__) and \
+            self.extension_fields == other.extension_fields
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(
+            "%s=%r" % (a, getattr(self, a)) for _, a in self._fields if getattr(self, a) is not None))
+
+def _save(v):
+    if isinstance(v, Record):
+        return v.save()
+    if isinstance(v, list):
+        return [_save(i) for i in v]
+    if isinstance(v, dict):
+        return {k: _save(i) for k, i in v.iteritems()}
+    return v
+
+class Enum(object):
+    name = None
+    symbols = ()
+    symbol_set = frozenset()
+
+class _Loader(object):
+    # Loaders with `simple` set check a value without looking inside it,
+    # return it unchanged and have an `accepts` method that checks it
+    # without building an error message.
+    simple = True
+
+class PrimitiveLoader(_Loader):
+    def __init__(self, avro_type):
+        self.type = avro_type
+        self.check = _CHECKS[avro_type]
+
+    def accepts(self, doc):
+        return self.check(doc)
+
+    def load(self, doc, options):
+        if self.check(doc):
+            return doc
+        raise ValidationException(_MESSAGES[self.type] % vpformat(doc))
+
+    def describe(self):
+        return self.type
+
+_CHECKS = {
+    "null": lambda d: d is None,
+    "boolean": lambda d: isinstance(d, bool),
+    "string": lambda d: isinstance(d, basestring),
+    "bytes": lambda d: isinstance(d, str),
+    "int": lambda d: isinstance(d, (int, long)) and INT_MIN_VALUE <= d <= INT_MAX_VALUE,
+    "long": lambda d: isinstance(d, (int, long)) and LONG_MIN_VALUE <= d <= LONG_MAX_VALUE,
+    "float": lambda d: isinstance(d, (int, long, float)),
+    "double": lambda d: isinstance(d, (int, long, float)),
+}
+
+_MESSAGES = {
+    "null": "the value `%s` is not null",
+    "boolean": "the value `%s` is not boolean",
+    "string": "the value `%s` is not string",
+    "bytes": "the value `%s` is not bytes",
+    "int": "`%s` is not int",
+    "long": "the value `%s` is not long",
+    "float": "the value `%s` is not float or double",
+    "double": "the value `%s` is not float or double",
+}
+
+class AnyLoader(_Loader):
+    def accepts(self, doc):
+        return doc is not None
+
+    def load(self, doc, options):
+        if doc is None:
+            raise ValidationException("Any type must be non-null")
+        return doc
+
+    def describe(self):
+        return "Any"
+
+class EnumLoader(_Loader):
+    def __init__(self, enum):
+        self.enum = enum
+
+    def accepts(self, doc):
+        try:
+            return doc in self.enum.symbol_set
+        except TypeError:
+            return False
+
+    def load(self, doc, options):
+        if self.accepts(doc):
+            return doc
+        raise ValidationException("the value `%s`\n is not a valid symbol in enum %s, expected one of %s" % (
+            vpformat(doc), self.enum.name, "'" + "', '".join(self.enum.symbols) + "'"))
+
+    def describe(self):
+        return self.enum.name
+
+class ArrayLoader(_Loader):
+    simple = False
+
+    def __init__(self, items):
+        self.items = items
+
+    def load(self, doc, options):
+        if not isinstance(doc, list):
+            raise ValidationException("the value `%s` is not a list, expected list of %s" % (
+                vpformat(doc), self.items.describe()))
+        load = self.items.load
+        result = []
+        for i, d in enumerate(doc):
+            try:
+                result.append(load(d, options))
+            except ValidationException as v:
+                raise ValidationException("At position %i\n%s" % (i, indent(str(v))))
+        return result
+
+    def describe(self):
+        return "array of <%s>" % self.items.describe()
+
+class MapLoader(_Loader):
+    simple = False
+
+    def __init__(self, values):
+        self.values = values
+
+    def load(self, doc, options):
+        if isinstance(doc, dict) and all(isinstance(k, basestring) for k in doc):
+            try:
+                return {k: self.values.load(v, options) for k, v in doc.iteritems()}
+            except ValidationException:
+                pass
+        raise ValidationException("`%s` is not a valid map value, expected\n %s" % (
+            vpformat(doc), self.values.describe()))
+
+    def describe(self):
+        return "map of <%s>" % self.values.describe()
+
+class RecordLoader(_Loader):
+    simple = False
+
+    def __init__(self, cls):
+        self.cls = cls
+
+    def load(self, doc, options):
+        if not isinstance(doc, dict):
+            raise ValidationException("`%s`\n is not a dict" % vpformat(doc))
+        key = (id(doc), self.cls)
+        if key in options.loaded:
+            return options.loaded[key][1]
+        obj = load_record(self.cls, doc, options)
+        options.loaded[key] = (doc, obj)
+        return obj
+
+    def describe(self):
+        return self.cls.__name__
+
+class UnionLoader(_Loader):
+    simple = False
+
+    def __init__(self, alternatives):
+        self.alternatives = alternatives
+        # Records that a dict names in its `class` field are tried first.
+        self.by_class = {a.cls.__name__: a for a in alternatives if isinstance(a, RecordLoader)}
+
+    def load(self, doc, options):
+        for a in self.alternatives:
+            if a.simple and a.accepts(doc):
+                return doc
+        errors = {}
+        first = None
+        if isinstance(doc, dict) and isinstance(doc.get("class"), basestring):
+            first = self.by_class.get(_short(doc["class"]))
+            if first is not None:
+                try:
+                    return first.load(doc, options)
+                except ValidationException as e:
+                    errors[first] = str(e)
+        for a in self.alternatives:
+            if not a.simple and a is not first:
+                try:
+                    return a.load(doc, options)
+                except ValidationException as e:
+                    errors[a] = str(e)
+        for a in self.alternatives:
+            if a.simple:
+                try:
+                    a.load(doc, options)
+                except ValidationException as e:
+                    errors[a] = str(e)
+        raise ValidationException("the value %s is not a valid type in the union, expected one of:\n%s" % (
+            multi(vpformat(doc), '`'),
+            "\n".join("- %s, but\n %s" % (a.describe(), indent(multi(errors[a]))) for a in self.alternatives)))
+
+    def describe(self):
+        return " or ".join(a.describe() for a in self.alternatives)
+
+def _short(url):
+    frg = urlparse.urldefrag(url)[1]
+    if frg:
+        return frg.rsplit("/", 1)[-1]
+    return url
+
+def load_record(cls, doc, options):
+    obj = cls.__new__(cls)
+    errors = []
+    for name, attr, loader, default in cls._loaders:
+        if name in doc:
+            try:
+                setattr(obj, attr, loader.load(doc[name], options))
+            except ValidationException as v:
+                errors.append("could not validate field `%s` because\n%s" % (name, multi(indent(str(v)))))
+        else:
+            try:
+                setattr(obj, attr, loader.load(default, options))
+            except ValidationException:
+                errors.append("missing required field `%s`" % name)
+
+    extension_fields = None
+    for d in doc:
+        if d in cls._field_names:
+            continue
+        if options.strict and d not in options.identifiers and d not in options.foreign_properties and d[0] not in ("@", "$"):
+            if urlparse.urlsplit(d).scheme:
+                errors.append("could not validate extension field `%s` because it is not recognized and strict is True.  Did you include a $schemas section?" % (d))
+            else:
+                errors.append("could not validate field `%s` because it is not recognized and strict is True, valid fields are: %s" % (d, ", ".join(n for n, _ in cls._fields)))
+        else:
+            if extension_fields is None:
+                extension_fields = {}
+            extension_fields[d] = doc[d]
+    obj.extension_fields = extension_fields
+
+    if errors:
+        raise ValidationException("\n".join(errors))
+    return obj
+
+def load_document(roots, doc, options):
+    """Load `doc`, a resolved document or list of documents, as one of the
+    `roots` (RecordLoaders of the document root types)."""
+
+    if isinstance(doc, list):
+        docs = doc
+    elif isinstance(doc, dict):
+        docs = [doc]
+    else:
+        raise ValidationException("Document must be dict or list")
+    result = []
+    anyerrors = []
+    for pos, item in enumerate(docs):
+        errors = []
+        for r in roots:
+            try:
+                result.append(r.load(item, options))
+                break
+            except ValidationException as e:
+                errors.append("Could not validate as `%s` because\n%s" % (r.describe(), indent(str(e), nolead=False)))
+        else:
+            objerr = "Validation error at position %i" % pos
+            for ident in options.identifiers:
+                if isinstance(item, dict) and ident in item:
+                    objerr = "Validation error in object %s" % (item[ident])
+                    break
+            anyerrors.append("%s\n%s" % (objerr, indent("\n".join(errors))))
+    if anyerrors:
+        raise ValidationException("\n".join(anyerrors))
+    return result if isinstance(doc, list) else result[0]
@@ -0,0 +1,135 @@
+"""Graph of the relations between the types of a schema.
+
+Built from the output of `schema.extend_and_specialize`, so that the fields
+inherited by a record are counted as its own.  Each relation is kept in both
+directions, with the targets of each type in the order they were found:
+
+    references(t)    types named in the fields of record t
+    used_by(t)       (record, field) pairs whose type names t
+    extends(t)       base types of t
+    subtypes(t)      types that extend t
+    doc_children(t)  types documented under t (`docParent`/`docChild`)
+    doc_parents(t)   types that t is documented under
+    doc_after(t)     types documented after t (`docAfter`)
+    doc_before(t)    types that t is documented after
+
+    graph = TypeGraph(schema.extend_and_specialize(j, loader))
+    for record, field in graph.used_by("https://w3id.org/cwl/cwl#File"):
+        ...
+"""
+
+import collections
+from aslist import aslist
+
+def field_types(field):
+    """The names of the types in the type of `field`: the names of inline
+    records, and every string reached through `type`, `items` and `values`
+    (including primitive types and the names of `enum` and `array`)."""
+
+    result = []
+    stack = [field]
+    while stack:
+        items = stack.pop()
+        if isinstance(items, dict):
+            if items["type"] == "https://w3id.org/cwl/salad#record":
+                result.append(items["name"])
+            else:
+                stack.extend(items[n] for n in ("values", "items", "type") if n in items)
+        elif isinstance(items, list):
+            stack.extend(reversed(items))
+        elif isinstance(items, basestring):
+            result.append(items)
+    return result
+
+def _add(index, key, value):
+    if key not in index:
+        index[key] = collections.OrderedDict()
+    index[key][value] = None
+
+class TypeGraph(object):
+    def __init__(self, types):
+        self.types = collections.OrderedDict()
+        self._references = {}
+        self._used_by = {}
+        self._extends = {}
+        self._subtypes = {}
+        self._doc_children = {}
+        self._doc_parents = {}
+        self._doc_after = {}
+        self._doc_before = {}
+        for t in types:
+            self.add(t)
+
+    def add(self, t):
+        name = t["name"]
+        self.types[name] = t
+        for e in aslist(t.get("extends", [])):
+            _add(self._extends, name, e)
+            _add(self._subtypes, e, name)
+        if t.get("docParent"):
+            _add(self._doc_children, t["docParent"], name)
+            _add(self._doc_parents, name, t["docParent"])
+        for c in aslist(t.get("docChild", [])):
+            _add(self._doc_children, name, c)
+            _add(self._doc_parents, c, name)
+        if t.get("docAfter"):
+            _add(self._doc_after, t["docAfter"], name)
+            _add(self._doc_before, name, t["docAfter"])
+        if t["type"] == "record":
+            self._references.setdefault(name, collections.OrderedDict())
+            for f in t.get("fields", []):
+                for tp in field_types(f):
+                    _add(self._references, name, tp)
+                    _add(self._used_by, tp, (name, f["name"]))
+
+    def __contains__(self, name):
+        return name in self.types
+
+    def __getitem__(self, name):
+        return self.types[name]
+
+    def references(self, name):
+        return list(self._references.get(name, ()))
+
+    def used_by(self, name):
+        return list(self._used_by.get(name, ()))
+
+    def extends(self, name):
+        return list(self._extends.get(name, ()))
+
+    def subtypes(self, name):
+        return list(self._subtypes.get(name, ()))
+
+    def doc_children(self, name):
+        return list(self._doc_children.get(name, ()))
+
+    def doc_parents(self, name):
+        return list(self._doc_parents.get(name, ()))
+
+    def doc_after(self, name):
+        return list(self._doc_after.get(name, ()))
+
+    def doc_before(self, name):
+        return list(self._doc_before.get(name, ()))
+
+    def ancestors(self, name):
+        """All types that `name` extends, directly or not, nearest first."""
+        result = collections.OrderedDict()
+        queue = collections.deque(self._extends.get(name, ()))
+        while queue:
+            e = queue.popleft()
+            if e not in result:
+                result[e] = None
+                queue.extend(self._extends.get(e, ()))
+        return list(result)
+
+    def descendants(self, name):
+        """All types that extend `name`, directly or not, nearest first."""
+        result = collections.OrderedDict()
+        queue = collections.deque(self._subtypes.get(name, ()))
+        while queue:
+            s = queue.popleft()
+            if s not in result:
+                result[s] = None
+                queue.extend(self._subtypes.get(s, ()))
+        return list(result)
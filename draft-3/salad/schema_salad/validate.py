@@ -1,11 +1,47 @@
 import pprint
+import repr as reprlib
 import avro.schema
 import yaml
 import urlparse
+import difflib
+from trampoline import run, Return
 
 class ValidationException(Exception):
     pass
 
+class EnumValidationException(ValidationException):
+    """Raised when a value is not a symbol of an enum.  The message, which
+    lists every symbol and suggests close matches, is only built when the
+    exception is converted to a string, since union and map validation
+    often discard it."""
+
+    def __init__(self, expected_schema, datum):
+        super(EnumValidationException, self).__init__()
+        self.expected_schema = expected_schema
+        self.datum = datum
+        self._message = None
+
+    def __str__(self):
+        if self._message is None:
+            symbols = self.expected_schema.symbols
+            self._message = "the value `%s`\n is not a valid symbol in enum %s, expected one of %s" % (
+                vpformat(self.datum), self.expected_schema.name, "'" + "', '".join(symbols) + "'")
+            if isinstance(self.datum, basestring):
+                close = difflib.get_close_matches(self.datum, symbols, n=3)
+                if close:
+                    self._message += "\n did you mean %s?" % " or ".join("'%s'" % c for c in close)
+        return self._message
+
+    def __reduce__(self):
+        # The schema is not sent to other processes (see parallel.py), only
+        # the message.
+        return (_enum_validation_exception, (str(self), self.datum))
+
+def _enum_validation_exception(message, datum):
+    e = EnumValidationException(None, datum)
+    e._message = message
+    return e
+
 def validate(expected_schema, datum, identifiers=[], strict=False, foreign_properties=set()):
     try:
         return validate_ex(expected_schema, datum, identifiers, strict=strict, foreign_properties=foreign_properties)
@@ -41,18 +77,133 @@ def multi(v, q=""):
     else:
         return "%s%s%s" % (q, v, q)
 
+_shortrepr = reprlib.Repr()
+_shortrepr.maxstring = _shortrepr.maxother = 160
+
 def vpformat(datum):
-    a = pprint.pformat(datum)
+    try:
+        a = pprint.pformat(datum)
+    except RuntimeError:
+        # Too deeply nested for pprint; only the start is shown anyway.
+        a = _shortrepr.repr(datum)
     if len(a) > 160:
         a = a[0:160] + "[...]"
     return a
 
+NESTED_TYPES = frozenset(('array', 'map', 'union', 'error_union', 'record', 'error', 'request'))
+
 def validate_ex(expected_schema, datum, identifiers=set(), strict=False, foreign_properties=set()):
     """Determine if a python datum is an instance of a schema."""
 
-    schema_type = expected_schema.type
+    r = _validate_ex(expected_schema, datum, identifiers, strict, foreign_properties)
+    if r is True:
+        return True
+    return run(r)
+
+def enum_symbols(expected_schema):
+    """Return the symbols of an enum schema as a frozenset, built once and
+    kept on the schema object."""
+
+    try:
+        return expected_schema._symbol_set
+    except AttributeError:
+        expected_schema._symbol_set = frozenset(expected_schema.symbols)
+        return expected_schema._symbol_set
+
+def _is_symbol(expected_schema, datum):
+    try:
+        return datum in enum_symbols(expected_schema)
+    except TypeError:
+        # Unhashable values, such as dicts, are never symbols.
+        return False
 
+def _is_valid_simple(expected_schema, datum):
+    """Check a value against a primitive or enum schema without building an
+    error message."""
+
+    schema_type = expected_schema.type
     if schema_type == 'null':
+        return datum is None
+    elif schema_type == 'boolean':
+        return isinstance(datum, bool)
+    elif schema_type == 'string':
+        return isinstance(datum, basestring)
+    elif schema_type == 'bytes':
+        return isinstance(datum, str)
+    elif schema_type == 'int':
+        return isinstance(datum, (int, long)) and INT_MIN_VALUE <= datum <= INT_MAX_VALUE
+    elif schema_type == 'long':
+        return isinstance(datum, (int, long)) and LONG_MIN_VALUE <= datum <= LONG_MAX_VALUE
+    elif schema_type in ['float', 'double']:
+        return isinstance(datum, (int, long, float))
+    elif schema_type == 'fixed':
+        return isinstance(datum, str) and len(datum) == expected_schema.size
+    elif schema_type == 'enum':
+        if expected_schema.name == "Any":
+            return datum is not None
+        return _is_symbol(expected_schema, datum)
+    return False
+
+# Exact types accepted for each primitive type.  A list whose set of element
+# types is a subset of these needs no per-element isinstance check.
+_ARRAY_ITEM_TYPES = {
+    'null': frozenset((type(None),)),
+    'boolean': frozenset((bool,)),
+    'string': frozenset((str, unicode)),
+    'bytes': frozenset((str,)),
+    'int': frozenset((int, long, bool)),
+    'long': frozenset((int, long, bool)),
+    'float': frozenset((int, long, float, bool)),
+    'double': frozenset((int, long, float, bool)),
+}
+
+_ARRAY_ITEM_RANGES = {
+    'int': (INT_MIN_VALUE, INT_MAX_VALUE),
+    'long': (LONG_MIN_VALUE, LONG_MAX_VALUE),
+}
+
+def _is_valid_array(items, datum):
+    """Check a whole list against a primitive or enum item schema at once,
+    using builtins that loop in C.  Returns False if the list has to be
+    checked element by element, either because it is invalid or because it
+    contains subclasses of the expected types."""
+
+    if not datum:
+        return True
+    t = items.type
+    if t in _ARRAY_ITEM_TYPES:
+        if not set(map(type, datum)) <= _ARRAY_ITEM_TYPES[t]:
+            return False
+        if t in _ARRAY_ITEM_RANGES:
+            lo, hi = _ARRAY_ITEM_RANGES[t]
+            return lo <= min(datum) and max(datum) <= hi
+        return True
+    elif t == 'enum':
+        if items.name == "Any":
+            return None not in datum
+        try:
+            return enum_symbols(items).issuperset(datum)
+        except TypeError:
+            return False
+    return False
+
+def _validate_ex(expected_schema, datum, identifiers, strict, foreign_properties):
+    """Validate primitive and enum values directly, returning True.  For
+    nested types, return a generator to be driven by trampoline.run."""
+
+    schema_type = expected_schema.type
+
+    if schema_type in NESTED_TYPES:
+        if schema_type == 'array' and isinstance(datum, list) and _is_valid_array(expected_schema.items, datum):
+            return True
+        if schema_type in ('union', 'error_union'):
+            # Fast path: a value that matches one of the simple types in
+            # the union needs no generator.
+            for s in expected_schema.schemas:
+                if s.type not in NESTED_TYPES and _is_valid_simple(s, datum):
+                    return True
+        return _validate_nested(expected_schema, datum, identifiers, strict, foreign_properties)
+    elif schema_type == 'null':
         if datum is None:
             return True
         else:
@@ -101,39 +252,71 @@ def validate_ex(expected_schema, datum, identifiers=set(), strict=False, foreign
                 return True
             else:
                 raise ValidationException("Any type must be non-null")
-        if datum in expected_schema.symbols:
+        if _is_symbol(expected_schema, datum):
             return True
         else:
-            raise ValidationException("the value `%s`\n is not a valid symbol in enum %s, expected one of %s" % (vpformat(datum), expected_schema.name, "'" + "', '".join(expected_schema.symbols) + "'"))
-    elif schema_type == 'array':
+            raise EnumValidationException(expected_schema, datum)
+    raise ValidationException("Unrecognized schema_type %s" % schema_type)
+
+def _validate_nested(expected_schema, datum, identifiers, strict, foreign_properties):
+    # Wherever a child value is a nested type, _validate_ex returns a
+    # generator, which is yielded to trampoline.run to be validated; any
+    # ValidationException it raises comes back out of the yield.
+    schema_type = expected_schema.type
+
+    if schema_type == 'array':
         if isinstance(datum, list):
             for i, d in enumerate(datum):
                 try:
-                    validate_ex(expected_schema.items, d, identifiers, strict=strict, foreign_properties=foreign_properties)
+                    r = _validate_ex(expected_schema.items, d, identifiers, strict, foreign_properties)
+                    if r is not True:
+                        yield r
                 except ValidationException as v:
                     raise ValidationException("At position %i\n%s" % (i, indent(str(v))))
-            return True
+            yield Return(True)
         else:
             raise ValidationException("the value `%s` is not a list, expected list of %s" % (vpformat(datum), friendly(expected_schema.items)))
     elif schema_type == 'map':
-        if (isinstance(datum, dict) and
-            False not in [isinstance(k, basestring) for k in datum.keys()] and
-            False not in [validate(expected_schema.values, v, strict=strict) for v in datum.values()]):
-            return True
+        valid = isinstance(datum, dict) and False not in [isinstance(k, basestring) for k in datum.keys()]
+        if valid:
+            for v in datum.values():
+                try:
+                    r = _validate_ex(expected_schema.values, v, [], strict, set())
+                    if r is not True:
+                        yield r
+                except ValidationException:
+                    valid = False
+                    break
+        if valid:
+            yield Return(True)
         else:
             raise ValidationException("`%s` is not a valid map value, expected\n %s" % (vpformat(datum), vpformat(expected_schema.values)))
     elif schema_type in ['union', 'error_union']:
-        if True in [validate(s, datum, identifiers, strict=strict) for s in expected_schema.schemas]:
-            return True
-        else:
-            errors = []
-            for s in expected_schema.schemas:
+        # The simple branches have already been tried by _validate_ex, so
+        # only the nested ones are left.  Their errors are kept, and the
+        # messages for the simple branches are only built if all fail.
+        nested_errors = {}
+        for i, s in enumerate(expected_schema.schemas):
+            if s.type in NESTED_TYPES:
                 try:
-                    validate_ex(s, datum, identifiers, strict=strict, foreign_properties=foreign_properties)
+                    r = _validate_ex(s, datum, identifiers, strict, foreign_properties)
+                    if r is not True:
+                        yield r
+                    yield Return(True)
+                    return
+                except ValidationException as e:
+                    nested_errors[i] = str(e)
+        errors = []
+        for i, s in enumerate(expected_schema.schemas):
+            if i in nested_errors:
+                errors.append(nested_errors[i])
+            else:
+                try:
+                    _validate_ex(s, datum, identifiers, strict, foreign_properties)
                 except ValidationException as e:
                     errors.append(str(e))
-            raise ValidationException("the value %s is not a valid type in the union, expected one of:\n%s" % (multi(vpformat(datum), '`'),
-                                                                                     "\n".join(["- %s, but\n %s" % (friendly(expected_schema.schemas[i]), indent(multi(errors[i]))) for i in range(0, len(expected_schema.schemas))])))
+        raise ValidationException("the value %s is not a valid type in the union, expected one of:\n%s" % (multi(vpformat(datum), '`'),
+                                                                                 "\n".join(["- %s, but\n %s" % (friendly(expected_schema.schemas[i]), indent(multi(errors[i]))) for i in range(0, len(expected_schema.schemas))])))
 
     elif schema_type in ['record', 'error', 'request']:
         if not isinstance(datum, dict):
@@ -147,7 +330,9 @@ def validate_ex(expected_schema, datum, identifiers=set(), strict=False, foreign
                 fieldval = f.default
 
             try:
-                validate_ex(f.type, fieldval, identifiers, strict=strict, foreign_properties=foreign_properties)
+                r = _validate_ex(f.type, fieldval, identifiers, strict, foreign_properties)
+                if r is not True:
+                    yield r
             except ValidationException as v:
                 if f.name not in datum:
                     errors.append("missing required field `%s`" % f.name)
@@ -170,5 +355,4 @@ def validate_ex(expected_schema, datum, identifiers=set(), strict=False, foreign
         if errors:
             raise ValidationException("\n".join(errors))
         else:
-            return True
-    raise ValidationException("Unrecognized schema_type %s" % schema_type)
+            yield Return(True)
@@ -1,7 +1,34 @@
+import os
+import json
+import pickle
+import sys
+import shutil
+import StringIO
+import subprocess
+import tempfile
+import threading
 import unittest
+import urlparse
+import zipfile
+import avro.schema
 import schema_salad.ref_resolver
+import schema_salad.asyncload
+import schema_salad.codegen
+import schema_salad.depgraph
+import schema_salad.docstore
+import schema_salad.expressions
+import schema_salad.fetcher
+import schema_salad.joborder
 import schema_salad.main
+import schema_salad.pack
+import schema_salad.resultcache
+import schema_salad.secondary
 import schema_salad.schema
+import schema_salad.timings
+import schema_salad.typegraph
+import schema_salad.compactdoc
+import schema_salad.records
+import schema_salad.validate
 import rdflib
 import yaml
 
@@ -74,6 +101,814 @@ class TestSchemas(unittest.TestCase):
             proc = yaml.load(open("schema_salad/metaschema/%s_proc.yml" % a))
             self.assertEquals(proc, src)
 
+    def test_validate_links(self):
+        ldr, _, _ = schema_salad.schema.load_schema("schema_salad/metaschema/link_res_schema.yml")
+        here = "file://" + os.path.abspath("tests/test_examples.py")
+        ldr.idx["http://example.com/known"] = True
+        pools = set()
+        for prefetch in (False, True):
+            ldr.prefetch_dirs = prefetch
+            ldr.validate_links({"id": "http://example.com/doc",
+                                "link": [here, here + "#frag", "http://example.com/known"]})
+
+            with self.assertRaises(schema_salad.validate.ValidationException) as e:
+                ldr.validate_links({"id": "http://example.com/doc",
+                                    "link": ["file:///nonexistent", here + ".missing", here],
+                                    "nested": [{"link": "http://example.com/missing"}]})
+            self.assertEqual(str(e.exception),
+                             "Field `link` contains undefined reference to `file:///nonexistent`\n"
+                             "Field `link` contains undefined reference to `%s.missing`\n"
+                             "While checking field `nested`\n"
+                             "  While checking position 0\n"
+                             "    Field `link` contains undefined reference to `http://example.com/missing`" % here)
+            pools.add(ldr._file_pool.pool)
+        # The threads checking files are started once per Loader.
+        self.assertEqual(len(pools), 1)
+        self.assertFalse(hasattr(ldr, "validate_link"))
+
+    def test_compactdoc(self):
+        _, doc, ldr = schema_salad.schema.get_metaschema()
+        doc.append({"n": None, "b": [True, False], "i": [0, -1, 1 << 70], "f": 1.5, "u": u"\u00e9"})
+        data = schema_salad.compactdoc.dumps(doc, ldr.idx)
+        doc2, idx2 = schema_salad.compactdoc.loads(data)
+        self.assertEqual(doc, doc2)
+        self.assertEqual(sorted(ldr.idx.keys()), sorted(idx2.keys()))
+        rid = "https://w3id.org/cwl/salad#RecordSchema"
+        self.assertEqual(ldr.idx[rid], idx2[rid])
+        self.assertTrue(any(idx2[rid] is d for d in doc2))
+        self.assertLess(len(data), len(json.dumps(doc)))
+
+        deep = leaf = {}
+        for _ in xrange(5000):
+            leaf["x"] = [{}, 1]
+            leaf = leaf["x"][0]
+        deep2, _ = schema_salad.compactdoc.loads(schema_salad.compactdoc.dumps(deep))
+        for _ in xrange(5000):
+            self.assertEqual(deep2.keys(), ["x"])
+            self.assertEqual(deep2["x"][1], 1)
+            deep2 = deep2["x"][0]
+        self.assertEqual(deep2, {})
+
+    def test_interned_records(self):
+        ldr, names, _ = schema_salad.schema.load_schema("schema_salad/metaschema/link_res_schema.yml")
+        ldr.interned = {}
+        docs = [ldr.resolve_all({"id": "http://example.com/doc%i" % i,
+                                 "link": "http://example.com/target",
+                                 "rest": {"link": "http://example.com/target"}}, "")[0]
+                for i in range(2)]
+        self.assertIs(docs[0]["link"], docs[1]["rest"]["link"])
+        self.assertIs(list(docs[0])[0], [k for k in docs[1] if k == list(docs[0])[0]][0])
+        self.assertIs(ldr.intern("http://example.com/target"), ldr.intern(u"http://example.com/target"))
+        self.assertIsInstance(docs[0]["link"], unicode)
+
+        c = schema_salad.records.Compactor(names)
+        compact = c.compact(docs)
+        self.assertEqual(compact, docs)
+        self.assertIs(compact[0]._layout, compact[1]._layout)
+        self.assertEqual(compact[0]["rest"]["link"], "http://example.com/target")
+        self.assertFalse(compact[0] != docs[0])
+        self.assertTrue(compact[0] != compact[1])
+        self.assertRaises(TypeError, hash, compact[0])
+        self.assertEqual(schema_salad.records.expand(compact), docs)
+
+        sizes = schema_salad.records.memory_use("../CommonWorkflowLanguage.yml",
+                                                ["../draft-3/count-lines1-wf.cwl", "../draft-3/revsort.cwl"], 3)
+        self.assertLess(sizes["interned"], sizes["plain"])
+        self.assertLess(sizes["compact"], sizes["interned"])
+
+    def test_deep_nesting(self):
+        depth = sys.getrecursionlimit() * 2
+        ldr, names, _ = schema_salad.schema.load_schema("schema_salad/metaschema/link_res_schema.yml")
+        doc = {"id": "http://example.com/doc", "link": "http://example.com/doc"}
+        ldr.idx["http://example.com/doc"] = doc
+        for i in range(depth):
+            doc = {"rest": [doc]}
+        ldr.resolve_all(doc, "")
+        ldr.validate_links(doc)
+
+        node = avro.schema.make_avsc_object({
+            "name": "Node", "type": "record", "fields": [
+                {"name": "rest", "type": ["null", {"type": "array", "items": "Node"}]},
+                {"name": "value", "type": ["null", "string"]}]},
+            avro.schema.Names())
+        datum = leaf = {"rest": None, "value": "x"}
+        for i in range(depth):
+            datum = {"rest": [datum], "value": None}
+        self.assertTrue(schema_salad.validate.validate_ex(node, datum))
+        # Error messages grow with the square of the depth, so check the
+        # failure path on a shallower document.
+        datum = leaf = {"rest": None, "value": 1}
+        for i in range(20):
+            datum = {"rest": [datum], "value": None}
+        with self.assertRaises(schema_salad.validate.ValidationException) as e:
+            schema_salad.validate.validate_ex(node, datum)
+        self.assertEqual(str(e.exception).count("At position 0"), 20)
+
+        t = "string"
+        for i in range(depth):
+            t = {"type": "array", "items": t}
+        r = schema_salad.schema.replace_type(t, {}, ldr, set())
+        for i in range(depth):
+            self.assertIsNot(r, t)
+            self.assertEqual(r["type"], "array")
+            r, t = r["items"], t["items"]
+        self.assertEqual(r, "string")
+
+        compact = schema_salad.records.Compactor().compact(doc)
+        expanded = schema_salad.records.expand(compact)
+        for i in range(depth):
+            self.assertEqual(len(compact), 1)
+            self.assertEqual(expanded.keys(), ["rest"])
+            compact, expanded = compact["rest"][0], expanded["rest"][0]
+        self.assertEqual(compact, {"id": "http://example.com/doc", "link": "http://example.com/doc"})
+        self.assertEqual(expanded, {"id": "http://example.com/doc", "link": "http://example.com/doc"})
+
+    def test_dependency_graph(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            def write(name, doc):
+                with open(os.path.join(tmp, name), "w") as f:
+                    json.dump(doc, f)
+                return "file://" + os.path.join(tmp, name)
+            t = write("t.yml", {"doc": "t"})
+            s = write("s.yml", [{"$import": "t.yml"}])
+            w = write("w.yml", {"steps": [{"$import": "s.yml"}], "run": "r.yml#main",
+                                "doc": {"$include": "s.yml"}})
+
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id", "run": {"@type": "@id"}})
+            r = "file://" + os.path.join(tmp, "r.yml")
+            ldr.resolve_ref(w)
+            g = ldr.depgraph
+            self.assertEqual(set(g.dependencies(w)), set([s, r]))
+            self.assertEqual(g.dependencies(w, schema_salad.depgraph.LOAD_KINDS), [s])
+            self.assertEqual(g.edges[w][s], set(["import", "include"]))
+            self.assertEqual(g.edges[w][r], set(["run"]))
+            self.assertEqual(g.dependents(t), [s])
+            order = g.order()
+            self.assertEqual(sorted(order), sorted([t, s, r, w]))
+            self.assertTrue(order.index(t) < order.index(s) < order.index(w))
+            self.assertLess(order.index(r), order.index(w))
+
+            # With document_links, links to data are not dependencies.
+            ctx = schema_salad.ref_resolver.LoaderContext({"id": "@id", "run": {"@type": "@id"}, "path": {"@type": "@id"}},
+                                                          document_links=["run"])
+            d = write("d.yml", {"run": "r.yml", "path": "data.txt"})
+            ldr = schema_salad.ref_resolver.Loader(ctx)
+            ldr.resolve_ref(d)
+            self.assertEqual(ldr.depgraph.dependencies(d), [r])
+            self.assertEqual(ldr.depgraph.order(), [r, d])
+
+            # A loader made from a schema only follows fields that can hold a
+            # record, so the scripts that search.cwl refers to are not listed.
+            document_loader = schema_salad.schema.load_schema("../CommonWorkflowLanguage.yml")[0]
+            self.assertEqual(document_loader.document_links, frozenset(["run"]))
+            search = "file://" + os.path.abspath("../draft-3/search.cwl")
+            document_loader.resolve_ref(search)
+            self.assertEqual(document_loader.depgraph.order(), [search])
+
+            a = write("a.yml", [{"$import": "b.yml"}])
+            write("b.yml", [{"$import": "a.yml"}])
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"})
+            with self.assertRaises(schema_salad.validate.ValidationException) as e:
+                ldr.resolve_ref(a)
+            self.assertIn("Import cycle: %s -> " % a, str(e.exception))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_enum_validation(self):
+        names = avro.schema.Names()
+        enum = avro.schema.make_avsc_object({
+            "name": "CWLType", "type": "enum",
+            "symbols": ["null", "boolean", "int", "File", "Directory"]}, names)
+        self.assertTrue(schema_salad.validate.validate_ex(enum, "File"))
+        self.assertIsInstance(schema_salad.validate.enum_symbols(enum), frozenset)
+        self.assertFalse(schema_salad.validate.validate(enum, {"class": "File"}))
+        with self.assertRaises(schema_salad.validate.ValidationException) as e:
+            schema_salad.validate.validate_ex(enum, "Flie")
+        self.assertIn("expected one of 'null', 'boolean', 'int', 'File', 'Directory'", str(e.exception))
+        self.assertIn("did you mean 'File'?", str(e.exception))
+        e2 = pickle.loads(pickle.dumps(e.exception, pickle.HIGHEST_PROTOCOL))
+        self.assertIsInstance(e2, schema_salad.validate.EnumValidationException)
+        self.assertEqual((str(e2), e2.datum), (str(e.exception), "Flie"))
+
+        types = schema_salad.schema.extend_and_specialize([
+            {"name": "Base", "type": "enum", "symbols": ["a", "b"]},
+            {"name": "Ext", "type": "enum", "extends": "Base", "symbols": ["b", "c"]}], None)
+        self.assertEqual(types[1]["symbols"], ["a", "b", "c"])
+
+        # CWLType extends PrimitiveType, so it accepts the primitive type
+        # names as well as File (before the symbols were stored in `symbols`
+        # it accepted only File).
+        _, names, _ = schema_salad.schema.load_schema("../CommonWorkflowLanguage.yml")
+        cwltype = names.get_name("CWLType", None)
+        self.assertEqual(cwltype.symbols, ["null", "boolean", "int", "long", "float", "double", "string", "File"])
+        self.assertTrue(schema_salad.validate.validate_ex(cwltype, "int"))
+
+    def test_primitive_arrays(self):
+        names = avro.schema.Names()
+        ints = avro.schema.make_avsc_object({"type": "array", "items": "int"}, names)
+        self.assertTrue(schema_salad.validate.validate_ex(ints, range(1000) + [True]))
+        for bad, pos in (([1, 2, "3", 4], 2), ([0, 1 << 31, 5], 1), ([1, None], 1)):
+            with self.assertRaises(schema_salad.validate.ValidationException) as e:
+                schema_salad.validate.validate_ex(ints, bad)
+            self.assertTrue(str(e.exception).startswith("At position %i\n" % pos))
+
+        strings = avro.schema.make_avsc_object({"type": "array", "items": "string"}, names)
+        self.assertTrue(schema_salad.validate.validate_ex(strings, ["a", u"b"]))
+        self.assertFalse(schema_salad.validate.validate(strings, ["a", 1]))
+
+        enums = avro.schema.make_avsc_object({"type": "array", "items": {
+            "type": "enum", "name": "E", "symbols": ["a", "b"]}}, names)
+        self.assertTrue(schema_salad.validate.validate_ex(enums, ["a", "b", "a"]))
+        self.assertFalse(schema_salad.validate.validate(enums, ["a", {}]))
+
+    def test_job_order(self):
+        names = avro.schema.Names()
+        avro.schema.make_avsc_object({"name": "File", "type": "record", "fields": [
+            {"name": "class", "type": {"type": "enum", "name": "File_class", "symbols": ["File"]}},
+            {"name": "path", "type": "string"}]}, names)
+        tool = {
+            "id": "file:///tool.cwl",
+            "requirements": [{"class": "SchemaDefRequirement", "types": [
+                {"name": "file:///tool.cwl#Mode", "type": "enum",
+                 "symbols": ["file:///tool.cwl#Mode/fast", "file:///tool.cwl#Mode/slow"]}]}],
+            "inputs": [
+                {"id": "file:///tool.cwl#reads", "type": {"type": "array", "items": "File"}},
+                {"id": "file:///tool.cwl#mode", "type": "file:///tool.cwl#Mode"},
+                {"id": "file:///tool.cwl#threads", "type": "int", "default": 1}]}
+
+        schemas = schema_salad.joborder.InputSchemas(names)
+        job = {"reads": [{"class": "File", "path": "a.fq"}], "mode": "fast"}
+        self.assertTrue(schemas.validate(tool, job))
+        self.assertIs(schemas.input_schema(tool), schemas.input_schema(dict(tool)))
+        self.assertNotIn("input_record_schema", names.names)
+
+        errors = schemas.validate_many(tool, [job, dict(job, threads="4"), {"mode": "medium"}])
+        self.assertIsNone(errors[0])
+        self.assertIn("could not validate field `threads`", str(errors[1]))
+        self.assertIn("missing required field `reads`", str(errors[2]))
+        self.assertIn("not a valid symbol in enum Mode", str(errors[2]))
+
+        tool["inputs"][2]["type"] = "long"
+        self.assertIsNot(schemas.input_schema(tool), schemas.input_schema(dict(tool, id="file:///other.cwl")))
+
+        schemas = schema_salad.joborder.InputSchemas(names, max_schemas=2)
+        for i in range(3):
+            schemas.input_schema(dict(tool, id="file:///tool%i.cwl" % i))
+        self.assertEqual([k[0] for k in schemas.schemas], ["file:///tool1.cwl", "file:///tool2.cwl"])
+
+        # The job orders of the conformance tests are valid for their tools.
+        # formattest3 is left out, since its $schemas is not RDF/XML.
+        ldr, names, _ = schema_salad.schema.load_schema("../CommonWorkflowLanguage.yml")
+        schemas = schema_salad.joborder.InputSchemas(names)
+        checked = 0
+        for t in yaml.safe_load(open("../conformance_test_draft-3.yaml")):
+            if "job" not in t or t["tool"] == "draft-3/formattest3.cwl":
+                continue
+            process, _ = schema_salad.ref_resolver.Loader(ldr.context).resolve_ref(
+                "file://" + os.path.abspath(os.path.join("..", t["tool"])))
+            with open(os.path.join("..", t["job"])) as f:
+                self.assertTrue(schemas.validate(process, yaml.safe_load(f)), t["tool"])
+            checked += 1
+        self.assertGreater(checked, 50)
+
+    def test_loader_sessions(self):
+        ctx = schema_salad.ref_resolver.LoaderContext({"id": "@id", "link": {"@type": "@id"}})
+        a = ctx.session()
+        b = ctx.session()
+        a.resolve_all({"id": "http://example.com/a"}, "")
+        self.assertIn("http://example.com/a", a.idx)
+        self.assertNotIn("http://example.com/a", b.idx)
+        self.assertIs(a.context, b.context)
+        self.assertEqual(a.identifiers, frozenset(["id"]))
+
+        doc = {"$namespaces": {"edam": "http://edamontology.org/"},
+               "$schemas": ["tests/EDAM.owl"],
+               "edam:has_format": "edam:format_1915"}
+        for l in (a, b):
+            l.resolve_all(dict(doc), "")
+            self.assertIn("http://edamontology.org/has_format", l.foreign_properties)
+        self.assertNotIn("http://edamontology.org/has_format", ctx.foreign_properties)
+        self.assertEqual(len(ctx._derived), 1)
+
+        # Threads asking for the same derived context get the same one, and
+        # the cache keeps only the most recently used.
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(ctx.with_namespaces({"x": "http://x/"})))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(set(map(id, results))), 1)
+        for i in range(schema_salad.ref_resolver.MAX_DERIVED_CONTEXTS + 5):
+            ctx.with_namespaces({"p%i" % i: "http://p/"})
+        self.assertEqual(len(ctx._derived), schema_salad.ref_resolver.MAX_DERIVED_CONTEXTS)
+        self.assertIs(ctx.with_namespaces({"p70": "http://p/"}), ctx.with_namespaces({"p70": "http://p/"}))
+
+    def test_async_loader(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            def write(name, doc):
+                with open(os.path.join(tmp, name), "w") as f:
+                    json.dump(doc, f)
+                return "file://" + os.path.join(tmp, name)
+            write("c.yml", {"doc": "c"})
+            write("b.yml", {"doc": {"$include": "c.yml"}, "more": {"$import": "c.yml"}})
+            a = write("a.yml", {"parts": [{"$import": "b.yml"}, {"$import": "c.yml"}]})
+
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"})
+            fetched = []
+            def fetcher(url):
+                fetched.append(url)
+                return ldr.fetch_text(url)
+            al = schema_salad.asyncload.AsyncLoader(ldr, fetcher=fetcher)
+            doc, _ = al.resolve_ref(a).result()
+            self.assertEqual(sorted(fetched), sorted(["file://" + os.path.join(tmp, n) for n in ("a.yml", "b.yml", "c.yml")]))
+            self.assertEqual(ldr.prefetched, {})
+            self.assertEqual(doc, schema_salad.ref_resolver.Loader({"id": "@id"}).resolve_ref(a)[0])
+
+            with self.assertRaises(RuntimeError):
+                al.resolve_ref("file://" + os.path.join(tmp, "missing.yml")).result()
+
+            # Documents prefetched for a resolution that fails are dropped.
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"})
+            bad = write("bad.yml", {"parts": [{"$import": "missing.yml"}, {"$import": "c.yml"}]})
+            with self.assertRaises(RuntimeError):
+                schema_salad.asyncload.AsyncLoader(ldr).resolve_ref(bad).result()
+            self.assertEqual(ldr.prefetched, {})
+
+            # One single-threaded executor for both CPU and I/O work does not
+            # deadlock.
+            one = schema_salad.asyncload.PoolExecutor(1)
+            try:
+                ldr = schema_salad.ref_resolver.Loader({"id": "@id"})
+                al = schema_salad.asyncload.AsyncLoader(ldr, executor=one, io_executor=one)
+                self.assertEqual(al.resolve_ref(a).result(timeout=30)[0], doc)
+            finally:
+                one.shutdown()
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_fetchers(self):
+        mem = schema_salad.fetcher.MemoryFetcher({
+            "mem://docs/a.yml": '{"parts": [{"$import": "sub/b.yml"}], "run": "sub/b.yml"}',
+            "mem://docs/sub/b.yml": '{"doc": "b"}'})
+        registry = dict(schema_salad.fetcher.registry)
+        schema_salad.fetcher.register("mem", mem, registry)
+        ldr = schema_salad.ref_resolver.Loader({"id": "@id", "run": {"@type": "@id"}}, fetchers=registry)
+        doc, _ = ldr.resolve_ref("mem://docs/a.yml")
+        self.assertEqual(doc["parts"][0]["doc"], "b")
+        self.assertEqual(doc["run"], "mem://docs/sub/b.yml")
+        ldr.validate_links(doc)
+        self.assertNotIn("mem", schema_salad.fetcher.registry)
+        with self.assertRaises(ValueError):
+            schema_salad.ref_resolver.Loader({"id": "@id"}).fetch_text("mem://docs/a.yml")
+        schema_salad.fetcher.unregister("mem", registry)
+        self.assertNotIn("mem", registry)
+        self.assertNotIn("mem", urlparse.uses_relative)
+        self.assertEqual(urlparse.urljoin("mem://docs/a.yml", "b.yml"), "b.yml")
+
+        tmp = tempfile.mkdtemp()
+        try:
+            store = schema_salad.fetcher.ContentStore(tmp)
+            url = store.add('{"doc": "stored"}')
+            self.assertTrue(url.startswith("sha256:"))
+            self.assertTrue(store.exists(url))
+            self.assertFalse(store.exists("sha256:" + "0" * 64))
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"}, fetchers={"sha256": store})
+            self.assertEqual(ldr.fetch(url)["doc"], "stored")
+            with open(os.path.join(tmp, url[7:]), "w") as f:
+                f.write('{"doc": "changed"}')
+            with self.assertRaises(RuntimeError):
+                schema_salad.ref_resolver.Loader({"id": "@id"}, fetchers={"sha256": store}).fetch(url)
+
+            z = os.path.join(tmp, "tools.zip")
+            with zipfile.ZipFile(z, "w") as f:
+                f.writestr("tools/a.yml", '{"parts": {"$import": "b.yml"}}')
+                f.writestr("tools/b.yml", '{"doc": "b"}')
+            registry = dict(schema_salad.fetcher.registry)
+            schema_salad.fetcher.register("bundle", schema_salad.fetcher.Bundle(z), registry)
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"}, fetchers=registry)
+            doc, _ = ldr.resolve_ref("bundle:///tools/a.yml")
+            self.assertEqual(doc["parts"]["doc"], "b")
+            schema_salad.fetcher.unregister("bundle", registry)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_pack(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            def write(name, doc):
+                with open(os.path.join(tmp, name), "w") as f:
+                    f.write(doc if isinstance(doc, str) else json.dumps(doc))
+                return "file://" + os.path.join(tmp, name)
+            write("data.txt", "some data")
+            write("doc.txt", "tool documentation")
+            write("types.yml", {"fields": [{"id": "#types.yml/f"}]})
+            write("tool.yml", {"doc": {"$include": "doc.txt"}, "types": [{"$import": "types.yml"}],
+                               "inputs": [{"id": "#x", "type": "types.yml#types.yml/f", "default": "data.txt"}]})
+            wf = write("wf.yml", {"steps": [{"id": "#s1", "run": "tool.yml", "in": "#s1/x"},
+                                            {"id": "#s2", "run": "tool.yml#x"}],
+                                  "path": "data.txt"})
+
+            ctx = {"id": "@id", "run": {"@type": "@id"}, "in": {"@type": "@id"},
+                   "path": {"@type": "@id"}, "type": {"@type": "@vocab"}, "default": {"@type": "@id"}}
+            packed = schema_salad.pack.pack(schema_salad.ref_resolver.Loader(ctx), wf)
+            main, tool = packed["$graph"]
+            self.assertEqual(main["id"], "#main")
+            self.assertEqual(main["steps"][0]["run"], "#tool.yml")
+            self.assertEqual(main["steps"][1]["run"], "#tool.yml/x")
+            self.assertEqual(main["path"], "file://" + os.path.join(tmp, "data.txt"))
+            self.assertEqual(tool["doc"], "tool documentation")
+            self.assertEqual(tool["types"][0]["id"], "#types.yml")
+            self.assertEqual(tool["inputs"][0]["type"], "#types.yml/types.yml/f")
+
+            p = write("packed.yml", packed)
+            fetched = []
+            class Fetcher(schema_salad.fetcher.FileFetcher):
+                def fetch_text(self, url):
+                    fetched.append(url)
+                    return super(Fetcher, self).fetch_text(url)
+            ldr = schema_salad.ref_resolver.Loader(ctx, fetchers={"file": Fetcher()})
+            doc, _ = ldr.resolve_ref(p)
+            ldr.validate_links(doc)
+            self.assertEqual(fetched, [p])
+            self.assertIs(ldr.idx[doc[0]["steps"][0]["run"]], doc[1])
+
+            # Only document links are followed, so data files that are not
+            # YAML are left in place.
+            write("script.py", "print 'a: b: c'\nx: y: z\n")
+            s = write("s.yml", {"steps": [{"id": "#s1", "run": "tool.yml"}], "path": "script.py"})
+            ldr = schema_salad.ref_resolver.Loader(schema_salad.ref_resolver.LoaderContext(ctx, document_links=["run"]))
+            packed = schema_salad.pack.pack(ldr, s)
+            self.assertEqual(packed["$graph"][0]["path"], "file://" + os.path.join(tmp, "script.py"))
+            self.assertEqual(packed["$graph"][0]["steps"][0]["run"], "#tool.yml")
+
+            document_loader = schema_salad.schema.load_schema("../CommonWorkflowLanguage.yml")[0]
+            packed = schema_salad.pack.pack(document_loader, "../draft-3/search.cwl")
+            index = [e for e in packed["$graph"] if e["id"] == "#index"][0]
+            self.assertEqual(index["inputs"][1]["default"]["path"], "file://" + os.path.abspath("../draft-3/index.py"))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_import_time(self):
+        # Dependencies that are slow to import are only imported by the
+        # options that use them.
+        heavy = ("rdflib", "rdflib_jsonld", "mistune", "requests", "pkg_resources", "cProfile", "pstats")
+        out = subprocess.check_output([sys.executable, "-m", "schema_salad.timings", "schema_salad.main"],
+                                      stderr=subprocess.STDOUT)
+        imported = set(l.split("|")[-1].strip().split(".")[0] for l in out.splitlines()[1:])
+        self.assertIn("yaml", imported)
+        self.assertEqual(imported & set(heavy), set())
+
+        out = subprocess.check_output([sys.executable, "-c", """
+import sys, json, schema_salad.main
+schema_salad.main.main(["--quiet", "schema_salad/metaschema/metaschema.yml", "schema_salad/metaschema/metaschema.yml"])
+print json.dumps(sorted(sys.modules))
+"""])
+        modules = json.loads(out.splitlines()[-1])
+        self.assertEqual([m for m in modules if m.split(".")[0] in heavy], [])
+
+    def test_secondary_index(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            def write(name, doc):
+                with open(os.path.join(tmp, name), "w") as f:
+                    json.dump(doc, f)
+                return "file://" + os.path.join(tmp, name)
+            lib = write("lib.yml", {"class": "Tool", "inputs": [{"id": "#x"}]})
+            wf = write("wf.yml", {"class": "Workflow",
+                                  "steps": [{"id": "#s1", "class": "Step", "in": [{"id": "#s1/x"}]},
+                                            {"id": "#s2", "class": "Step"}],
+                                  "tool": {"$import": "lib.yml"}})
+
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"}, secondary=schema_salad.secondary.SecondaryIndex())
+            ldr.resolve_ref(wf)
+            sec = ldr.secondary
+            self.assertEqual(sec.by_class("Step"), [wf + "#s1", wf + "#s2"])
+            self.assertEqual(sec.by_class("Tool"), [lib])
+            self.assertEqual(sec.by_class("Other"), [])
+            self.assertEqual(sorted(sec.in_document(wf)), sorted([wf, wf + "#s1", wf + "#s2", wf + "#s1/x"]))
+            self.assertEqual(sorted(sec.in_document(lib)), [lib, lib + "#x"])
+            self.assertEqual(sorted(sec.children(wf)), [wf + "#s1", wf + "#s2"])
+            self.assertEqual(sec.children(wf + "#s1"), [wf + "#s1/x"])
+            self.assertEqual(sorted(sec.descendants(wf)), [wf + "#s1", wf + "#s1/x", wf + "#s2"])
+            for i in sec.ids:
+                self.assertIn(i, ldr.idx)
+
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"})
+            ldr.resolve_ref(wf)
+            self.assertIsNone(ldr.secondary)
+
+            # Ids are looked up in idx with its own normalization.
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"}, secondary=schema_salad.secondary.SecondaryIndex(),
+                                                   idx=schema_salad.ref_resolver.NormDict(lambda k: unicode(k).lower()))
+            ldr.resolve_all({"id": "http://example.com/Doc", "class": "Tool"}, "")
+            self.assertEqual(ldr.secondary.by_class("Tool"), ["http://example.com/Doc"])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_codegen(self):
+        names, j, ldr = schema_salad.schema.get_metaschema()
+        _, avsc_obj = schema_salad.schema.make_avro_schema(j, ldr)
+        out = StringIO.StringIO()
+        schema_salad.codegen.codegen("python", avsc_obj, out)
+        classes = {}
+        exec compile(out.getvalue(), "<codegen>", "exec") in classes
+
+        loaded = classes["load_document"](j, True, ldr.identifiers, ldr.foreign_properties)
+        self.assertEqual(len(loaded), len(j))
+        rec = loaded[[d["name"] for d in j].index("https://w3id.org/cwl/salad#RecordField")]
+        self.assertIsInstance(rec, classes["SaladRecordSchema"])
+        self.assertIsInstance(rec.fields[0], classes["SaladRecordField"])
+        self.assertEqual(rec.type, "record")
+        self.assertEqual(rec.save(), [d for d in j if d["name"] == rec.name][0])
+        self.assertEqual(classes["PrimitiveType"].symbols[0], "null")
+        with self.assertRaises(AttributeError):
+            rec.unknown = 1
+
+        bad = {"name": "X", "type": "record", "fields": [{"name": "a"}], "extra": 1}
+        with self.assertRaises(schema_salad.validate.ValidationException) as e:
+            classes["load_document"](bad, True, ldr.identifiers, ldr.foreign_properties)
+        self.assertIn("missing required field `type`", str(e.exception))
+        self.assertIn("could not validate field `extra`", str(e.exception))
+
+        bad["fields"][0]["type"] = "string"
+        rec = classes["load_document"](bad, False, ldr.identifiers, ldr.foreign_properties)
+        self.assertEqual(rec.extension_fields, {"extra": 1})
+        self.assertEqual(rec.fields[0].type, "string")
+
+    def test_document_limits(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            def write(name, doc):
+                with open(os.path.join(tmp, name), "w") as f:
+                    json.dump(doc, f)
+                return "file://" + os.path.join(tmp, name)
+            docs = [write("d%i.yml" % i, {"class": "Tool", "inputs": [{"id": "#x%i" % i}]}) for i in range(5)]
+            lib = write("lib.yml", {"class": "Lib", "value": 1})
+            main = write("main.yml", {"class": "Main", "lib": {"$import": "lib.yml"}})
+
+            limits = schema_salad.docstore.Limits(max_documents=2, max_cache_bytes=100)
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"}, limits=limits,
+                                                   secondary=schema_salad.secondary.SecondaryIndex())
+            for d in docs:
+                ldr.cache[d] = open(d[7:]).read()
+                self.assertEqual(ldr.resolve_ref(d)[0]["class"], "Tool")
+            self.assertEqual(sorted(ldr.idx.documents), docs[3:])
+            self.assertNotIn(docs[0] + "#x0", ldr.idx)
+            self.assertNotIn(docs[0], ldr.cache)
+            self.assertLessEqual(ldr.cache.bytes, 100)
+            self.assertEqual(ldr.secondary.in_document(docs[0]), [])
+            self.assertEqual(limits.stats.evictions, 3)
+
+            # Evicted documents are loaded again when needed.
+            self.assertEqual(ldr.resolve_ref(docs[0] + "#x0")[0]["id"], docs[0] + "#x0")
+            self.assertIn(docs[0], ldr.idx.documents)
+
+            # A document is not evicted while a document importing it is
+            # being resolved.
+            self.assertEqual(ldr.resolve_ref(main)[0]["lib"]["value"], 1)
+
+            spill = schema_salad.docstore.SpillStore()
+            limits = schema_salad.docstore.Limits(max_documents=1, spill=spill)
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"}, limits=limits)
+            first = ldr.resolve_ref(docs[0])[0]
+            ldr.resolve_ref(docs[1])
+            self.assertIn(docs[0], spill)
+            os.remove(docs[0][7:])
+            self.assertIn(docs[0] + "#x0", ldr.idx)
+            self.assertEqual(ldr.resolve_ref(docs[0])[0], first)
+            self.assertEqual(limits.stats.spills, 1)
+            self.assertEqual(limits.stats.reloads, 1)
+            self.assertGreater(limits.stats.hit_rate(), 0)
+            spill.close()
+            self.assertFalse(os.path.exists(spill.directory))
+
+            with self.assertRaises(ValueError):
+                schema_salad.ref_resolver.Loader({"id": "@id"}, idx={}, limits=limits)
+            sub = schema_salad.ref_resolver.SubLoader(ldr)
+            self.assertIs(sub.idx, ldr.idx)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_type_graph(self):
+        sld = "https://w3id.org/cwl/salad#"
+        types = [
+            {"name": "#Base", "type": "record", "abstract": True,
+             "fields": [{"name": "#Base/a", "type": [sld + "null", "#Item"]}]},
+            {"name": "#Item", "type": "record", "docParent": "#Base",
+             "fields": [{"name": "#Item/b", "type": {"type": sld + "array", "items": sld + "string"}}]},
+            {"name": "#Derived", "type": "record", "extends": "#Base", "docAfter": "#Item",
+             "fields": [{"name": "#Derived/c", "type": {"type": sld + "array", "items": "#Item"}}]},
+            {"name": "#More", "type": "record", "extends": "#Derived", "docChild": ["#Other"]},
+        ]
+        alltypes = schema_salad.schema.extend_and_specialize(types, schema_salad.ref_resolver.Loader({}))
+        g = schema_salad.typegraph.TypeGraph(alltypes)
+
+        self.assertEqual(g.references("#Derived"), [sld + "null", "#Item", sld + "array"])
+        self.assertEqual(g.references("#Item"), [sld + "array", sld + "string"])
+        self.assertEqual(g.used_by("#Item"), [("#Base", "#Base/a"), ("#Derived", "#Base/a"),
+                                              ("#Derived", "#Derived/c"), ("#More", "#Base/a"),
+                                              ("#More", "#Derived/c")])
+        self.assertEqual(g.extends("#More"), ["#Derived"])
+        self.assertEqual(g.subtypes("#Base"), ["#Derived"])
+        self.assertEqual(g.ancestors("#More"), ["#Derived", "#Base"])
+        self.assertEqual(g.descendants("#Base"), ["#Derived", "#More"])
+        self.assertEqual(g.doc_children("#Base"), ["#Item"])
+        self.assertEqual(g.doc_children("#More"), ["#Other"])
+        self.assertEqual(g.doc_parents("#Other"), ["#More"])
+        self.assertEqual(g.doc_after("#Item"), ["#Derived"])
+        self.assertEqual(g.doc_before("#Derived"), ["#Item"])
+        self.assertEqual(g.references("#Nothing"), [])
+        self.assertIn("#More", g)
+        self.assertEqual(g["#Item"]["name"], "#Item")
+
+    def test_expression_inventory(self):
+        ex = schema_salad.expressions
+        self.assertEqual(ex.segments("a $(inputs.x) b ${ return {'a': ')'}; } \\$(no)"),
+                         ["$(inputs.x)", "${ return {'a': ')'}; }"])
+        self.assertEqual(ex.segments("cost: $5"), [])
+        self.assertEqual(sorted(ex.references("$(inputs.a + inputs['b c'] + inputs[k] + self[0] + runtime.cores + x.inputs.d)")),
+                         ["inputs", "inputs.a", "inputs.b c", "runtime.cores", "self"])
+
+        tmp = tempfile.mkdtemp()
+        try:
+            def write(name, doc):
+                with open(os.path.join(tmp, name), "w") as f:
+                    json.dump(doc, f)
+                return "file://" + os.path.join(tmp, name)
+            write("req.yml", {"class": "InlineJavascriptRequirement", "expressionLib": ["function f() {}"]})
+            tool = write("tool.yml", {
+                "class": "Tool",
+                "requirements": [{"$import": "req.yml"}],
+                "inputs": [{"id": "#x", "default": "$(f(inputs.y))"}],
+                "steps": [{"id": "#s", "class": "Tool", "hints": [{"class": "InlineJavascriptRequirement"}],
+                           "value": ["plain", "${return runtime.outdir;}"]}],
+                "stdout": "$(self)"})
+
+            ldr = schema_salad.ref_resolver.Loader({"id": "@id"}, expressions=ex.ExpressionInventory())
+            ldr.resolve_ref(tool)
+            ldr.resolve_ref(tool)
+            exprs = ldr.expressions.expressions
+            self.assertEqual([e.expression for e in exprs], ["$(f(inputs.y))", "$(self)", "${return runtime.outdir;}"])
+            e = exprs[0]
+            self.assertEqual((e.id, e.process, e.path, e.field), (tool + "#x", tool, ["inputs", 0, "default"], "default"))
+            self.assertEqual(e.expression_lib, ["function f() {}"])
+            self.assertEqual(e.references, ["inputs.y"])
+            self.assertEqual(exprs[1].references, ["self"])
+            self.assertEqual((exprs[2].process, exprs[2].path, exprs[2].expression_lib),
+                             (tool + "#s", ["steps", 0, "value", 1], []))
+            self.assertEqual(list(ldr.expressions.by_process()), [tool, tool + "#s"])
+            self.assertEqual(ldr.expressions.to_list()[1]["segments"], ["$(self)"])
+
+            self.assertIsNone(schema_salad.ref_resolver.Loader({"id": "@id"}).expressions)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_parallel_validation(self):
+        names, j, ldr = schema_salad.schema.get_metaschema()
+        graph = [dict(e) for e in j]
+        graph[3]["bogus"] = 1
+        graph[7] = {"name": "x", "type": "bogus"}
+        errors = {}
+        for processes in (1, 3):
+            with self.assertRaises(schema_salad.validate.ValidationException) as e:
+                schema_salad.schema.validate_doc(names, graph, ldr, True, processes=processes)
+            errors[processes] = str(e.exception)
+        self.assertEqual(errors[1], errors[3])
+        self.assertLess(errors[3].index("could not validate field `bogus`"), errors[3].index("Validation error in object x"))
+        schema_salad.schema.validate_doc(names, j, ldr, True, processes=3)
+
+        l = schema_salad.ref_resolver.Loader({"id": "@id", "link": {"@type": "@id"}})
+        doc, _ = l.resolve_all([{"id": "http://x/#a%i" % i, "link": ["#a%i" % ((i + 1) % 20)]} for i in range(20)],
+                               "http://x/")
+        l.validate_links(doc, processes=3)
+        doc[4]["link"].append("http://x/#missing")
+        doc[15]["sub"] = {"link": "http://x/#gone"}
+        errors = {}
+        for processes in (1, 3):
+            with self.assertRaises(schema_salad.validate.ValidationException) as e:
+                l.validate_links(doc, processes=processes)
+            errors[processes] = str(e.exception)
+        self.assertEqual(errors[1], errors[3])
+        self.assertLess(errors[3].index("#missing"), errors[3].index("#gone"))
+
+        # Workers check links against spilled documents without reloading
+        # them, which would delete the spill files the parent still uses.
+        tmp = tempfile.mkdtemp()
+        try:
+            urls = []
+            for i in range(4):
+                with open(os.path.join(tmp, "d%i.yml" % i), "w") as f:
+                    json.dump({"inputs": [{"id": "#x%i" % i}]}, f)
+                urls.append("file://" + os.path.join(tmp, "d%i.yml" % i))
+            spill = schema_salad.docstore.SpillStore(os.path.join(tmp, "spill"))
+            os.mkdir(spill.directory)
+            l = schema_salad.ref_resolver.Loader({"id": "@id", "link": {"@type": "@id"}},
+                                                 limits=schema_salad.docstore.Limits(max_documents=1, spill=spill))
+            for u in urls:
+                l.resolve_ref(u)
+            self.assertIn(urls[0], spill)
+            doc, _ = l.resolve_all([{"id": "http://x/#a%i" % i, "link": u + "#x%i" % i} for i, u in enumerate(urls)],
+                                   "http://x/")
+            l.validate_links(doc, processes=2)
+            self.assertIn(urls[0], spill)
+            self.assertTrue(os.listdir(spill.directory))
+            l.validate_links(doc)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_result_cache(self):
+        names, _, ldr = schema_salad.schema.get_metaschema()
+        tmp = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmp, "doc.txt"), "w") as f:
+                f.write("A record.")
+            with open(os.path.join(tmp, "a.yml"), "w") as f:
+                f.write("- name: A\n  type: record\n  documentRoot: true\n  doc: {$include: doc.txt}\n")
+            uri = "file://" + os.path.join(tmp, "a.yml")
+            cache = schema_salad.resultcache.ResultCache(os.path.join(tmp, "cache"))
+
+            def load(strict=True, cache=cache, loader=None):
+                return schema_salad.schema.load_and_validate(
+                    loader or schema_salad.ref_resolver.Loader(ldr.context), names, uri, strict, result_cache=cache)
+
+            doc, _ = load()
+            self.assertEqual(doc, load()[0])
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            load(strict=False)
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+            # Changing an included file invalidates the result.
+            with open(os.path.join(tmp, "doc.txt"), "w") as f:
+                f.write("Another record.")
+            self.assertEqual(load()[0][0]["doc"], "Another record.")
+            self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+            # Files are read again even if the Loader has cached their text.
+            reused = schema_salad.ref_resolver.Loader(ldr.context)
+            schema_salad.asyncload.AsyncLoader(reused).resolve_ref(uri).result()
+            with open(os.path.join(tmp, "doc.txt"), "w") as f:
+                f.write("A record.")
+            load(loader=reused)
+            self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+            # A prefetched document is recorded with the hash of the text it
+            # was parsed from, even if that text has left the cache.
+            l = schema_salad.ref_resolver.Loader({"id": "@id"}, manifest=schema_salad.resultcache.Manifest())
+            schema_salad.asyncload.AsyncLoader(l).prefetch({uri: "import"})
+            l.cache.clear()
+            l.fetch(uri)
+            with open(os.path.join(tmp, "a.yml")) as f:
+                self.assertEqual(l.manifest.texts[uri], schema_salad.resultcache.text_hash(f.read()))
+
+            # Errors are stored too.
+            with open(os.path.join(tmp, "a.yml"), "a") as f:
+                f.write("  bogus: 1\n")
+            for hits in (1, 2):
+                with self.assertRaises(schema_salad.validate.ValidationException) as e:
+                    load()
+                self.assertIn("could not validate field `bogus`", str(e.exception))
+                self.assertEqual(cache.hits, hits)
+
+            # A relative path is keyed by the document it names.
+            cwd = os.getcwd()
+            try:
+                for d, record in (("a", "- name: A\n  type: record\n"), ("b", "- name: A\n  type: record\n  bogus: 1\n")):
+                    os.mkdir(os.path.join(tmp, d))
+                    with open(os.path.join(tmp, d, "doc.yml"), "w") as f:
+                        f.write(record)
+                os.chdir(os.path.join(tmp, "a"))
+                schema_salad.schema.load_and_validate(schema_salad.ref_resolver.Loader(ldr.context), names, "doc.yml",
+                                                      True, result_cache=cache)
+                os.chdir(os.path.join(tmp, "b"))
+                with self.assertRaises(schema_salad.validate.ValidationException):
+                    schema_salad.schema.load_and_validate(schema_salad.ref_resolver.Loader(ldr.context), names, "doc.yml",
+                                                          True, result_cache=cache)
+            finally:
+                os.chdir(cwd)
+
+            # With store_documents, a hit returns the resolved document.
+            stored = schema_salad.resultcache.ResultCache(os.path.join(tmp, "stored"), store_documents=True)
+            doc, metadata = load(strict=False, cache=stored)
+            self.assertEqual(load(strict=False, cache=stored), (doc, metadata))
+            self.assertEqual(stored.hits, 1)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_timings(self):
+        with schema_salad.timings.Timings() as t:
+            schema_salad.schema.load_schema("schema_salad/metaschema/link_res_schema.yml")
+        names = [p.name for p in t.phases]
+        for n in ("metaschema load", "schema fetch/resolve", "schema validation",
+                  "context generation", "avro compilation"):
+            self.assertIn(n, names)
+        self.assertTrue(all(p.wall >= 0 and p.cpu >= 0 for p in t.phases))
+        if schema_salad.timings.peak_rss() is not None:
+            self.assertTrue(all(0 <= p.rss_growth <= p.peak_rss for p in t.phases))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -9,12 +9,34 @@ Syntax:
 Options:
   -nT   Run a specific test.
   -l    List tests
+  -jN   Run N tests in parallel, each with its own temporary directory.
+  --shard=I/N         Only run every N'th test, starting with test I (1 <= I <= N).
+  --junit-xml=FILE    Write per-test results in JUnit XML format to FILE.
+  --json=FILE         Write per-test results as JSON to FILE.
+  --baseline=FILE     Flag tests whose time or peak RSS regressed against an
+                      earlier --json result file.
+  --tolerance=F       Allowed slowdown/growth factor against the baseline
+                      (default 1.5).
 EOF
 
 DRAFT=draft-3
 TEST_N=""
 RUNNER=cwl-runner
 PLATFORM=`uname -s`
+JOBS=1
+JOBS_SET=""
+SHARD=""
+JUNIT_XML=""
+JSON_OUT=""
+BASELINE=""
+TOLERANCE=1.5
+
+abspath() {
+    case "$1" in
+        /*) echo "$1" ;;
+        *) echo "$PWD/$1" ;;
+    esac
+}
 
 while [[ -n "$1" ]]
 do
@@ -34,6 +56,32 @@ do
         --only-tools)
             ONLY_TOOLS=--only-tools
             ;;
+        -j)
+            JOBS="$1"; shift
+            JOBS_SET=1
+            ;;
+        -j*)
+            JOBS=${arg#-j}
+            JOBS_SET=1
+            ;;
+        --shard)
+            SHARD="$1"; shift
+            ;;
+        --shard=*)
+            SHARD=${arg#--shard=}
+            ;;
+        --junit-xml=*)
+            JUNIT_XML=$(abspath "${arg#--junit-xml=}")
+            ;;
+        --json=*)
+            JSON_OUT=$(abspath "${arg#--json=}")
+            ;;
+        --baseline=*)
+            BASELINE=$(abspath "${arg#--baseline=}")
+            ;;
+        --tolerance=*)
+            TOLERANCE=${arg#--tolerance=}
+            ;;
         *=*)
             eval $(echo $arg | cut -d= -f1)=\"$(echo $arg | cut -d= -f2-)\"
             ;;
@@ -68,10 +116,182 @@ runtest() {
     checkexit
 }
 
+# Run a command, recording its exit code, wall time and peak RSS in bytes in
+# the file given as the first argument.  The peak RSS is that of the largest
+# process in the tree started by the command, which is normally the runner.
+timedrun() {
+    python - "$@" <<'PYEOF'
+import resource, subprocess, sys, time
+result = sys.argv[1]
+start = time.time()
+rc = subprocess.call(sys.argv[2:])
+elapsed = time.time() - start
+rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+if sys.platform != "darwin":
+    rss *= 1024
+with open(result, "w") as f:
+    f.write("%d %.3f %d\n" % (rc, elapsed, rss))
+sys.exit(rc)
+PYEOF
+}
+
+# Run a single conformance test with its own TMPDIR, so that the output
+# directories created by cwltest do not collide between parallel tests.
+runone() {
+    n=$1
+    workdir="$RESULTS/$n"
+    mkdir -p "$workdir/tmp"
+    (cd $DRAFT
+     TMPDIR="$workdir/tmp" timedrun "$workdir/result" python -mcwltool.cwltest --tool "$TOOL" --test=conformance_test_$DRAFT.yaml -n$n $ONLY_TOOLS --basedir $DRAFT
+    ) > "$workdir/log" 2>&1
+    status=$?
+    rm -rf "$workdir/tmp"
+    if [[ $status == 0 ]]; then
+        echo "Test [$n] passed"
+    else
+        echo "Test [$n] failed"
+    fi
+}
+
+# Print the logs of failed tests, check time and memory budgets and the
+# baseline, and write JUnit XML and/or JSON results.  Writes the number of
+# failed tests to $RESULTS/failed, since exit statuses wrap at 256.
+report() {
+    python - "$DRAFT/conformance_test_$DRAFT.yaml" "$RESULTS" "$JUNIT_XML" "$JSON_OUT" "$BASELINE" "$TOLERANCE" "$@" <<'PYEOF'
+import json, os, sys, yaml
+from xml.sax.saxutils import escape, quoteattr
+
+testfile, results, junit, jsonout, baselinefile, tolerance = sys.argv[1:7]
+tolerance = float(tolerance)
+tests = yaml.safe_load(open(testfile))
+
+MiB = 1048576.0
+
+baseline = {}
+if baselinefile:
+    with open(baselinefile) as f:
+        baseline = {r["test"]: r for r in json.load(f)}
+
+def perfcheck(t, r):
+    problems = []
+    if "time_budget" in t and r["time"] > t["time_budget"]:
+        problems.append("took %.1f s, over its time budget of %s s" % (r["time"], t["time_budget"]))
+    if "memory_budget" in t and r["rss"] > t["memory_budget"] * MiB:
+        problems.append("peak RSS %.1f MiB, over its memory budget of %s MiB" % (r["rss"] / MiB, t["memory_budget"]))
+    base = baseline.get(r["test"])
+    if base and base.get("passed"):
+        # Allow a second of slack so that very short tests do not trip on noise.
+        if r["time"] > base["time"] * tolerance + 1.0:
+            problems.append("took %.1f s, regressed from baseline %.1f s" % (r["time"], base["time"]))
+        if base.get("rss") and r["rss"] > base["rss"] * tolerance:
+            problems.append("peak RSS %.1f MiB, regressed from baseline %.1f MiB" % (r["rss"] / MiB, base["rss"] / MiB))
+    return problems
+
+records = []
+for n in [int(a) for a in sys.argv[7:]]:
+    workdir = os.path.join(results, str(n))
+    try:
+        with open(os.path.join(workdir, "result")) as f:
+            rc, elapsed, rss = f.read().split()
+    except (IOError, OSError, ValueError):
+        rc, elapsed, rss = "-1", "0", "0"
+    try:
+        with open(os.path.join(workdir, "log")) as f:
+            log = f.read()
+    except (IOError, OSError):
+        log = ""
+    records.append({"test": n,
+                    "doc": tests[n-1].get("doc", "").strip(),
+                    "tool": tests[n-1].get("tool"),
+                    "returncode": int(rc),
+                    "passed": rc == "0",
+                    "time": float(elapsed),
+                    "rss": int(rss),
+                    "log": log})
+    records[-1]["perf"] = perfcheck(tests[n-1], records[-1])
+
+failed = [r for r in records if not r["passed"] or r["perf"]]
+for r in failed:
+    if not r["passed"]:
+        sys.stdout.write("--- Test [%i] %s failed ---\n%s\n" % (r["test"], r["doc"], r["log"]))
+    for p in r["perf"]:
+        sys.stdout.write("--- Test [%i] %s %s ---\n" % (r["test"], r["doc"], p))
+
+if jsonout:
+    with open(jsonout, "w") as f:
+        json.dump(records, f, indent=4, sort_keys=True)
+
+if junit:
+    with open(junit, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<testsuite name="conformance" tests="%i" failures="%i" time="%.3f">\n' % (
+            len(records), len(failed), sum(r["time"] for r in records)))
+        for r in records:
+            f.write('  <testcase classname=%s name=%s time="%.3f">' % (
+                quoteattr(r["tool"] or ""), quoteattr("[%i] %s" % (r["test"], r["doc"])), r["time"]))
+            if not r["passed"]:
+                f.write('<failure message="exit code %i">%s</failure>' % (r["returncode"], escape(r["log"])))
+            elif r["perf"]:
+                f.write('<failure message=%s></failure>' % quoteattr("; ".join(r["perf"])))
+            f.write('</testcase>\n')
+        f.write('</testsuite>\n')
+
+with open(os.path.join(results, "failed"), "w") as f:
+    f.write("%i\n" % len(failed))
+sys.exit(min(len(failed), 255))
+PYEOF
+}
+
+runparallel() {
+    echo "--- Running conformance test $DRAFT on $1 with $JOBS parallel jobs ---"
+
+    "$1" --version
+
+    if [[ -n "$TEST_N" ]]; then
+        tests=${TEST_N#-n}
+    else
+        ntests=$(python -c 'import sys, yaml; print(len(yaml.safe_load(open(sys.argv[1]))))' $DRAFT/conformance_test_$DRAFT.yaml)
+        tests=$(seq 1 $ntests)
+    fi
+
+    if [[ -n "$SHARD" ]]; then
+        shard_i=${SHARD%/*}
+        shard_n=${SHARD#*/}
+        if ! [[ "$shard_i" =~ ^[0-9]+$ && "$shard_n" =~ ^[0-9]+$ ]] || (( shard_i < 1 || shard_i > shard_n )); then
+            echo >&2 "Invalid shard '$SHARD', expected I/N with 1 <= I <= N"
+            exit 1
+        fi
+        sharded=""
+        for n in $tests; do
+            if (( (n - 1) % shard_n == shard_i - 1 )); then
+                sharded="$sharded $n"
+            fi
+        done
+        tests=$sharded
+    fi
+
+    RESULTS=$(mktemp -d "${TMPDIR:-/tmp}/conformance.XXXXXX")
+    TOOL="$1"
+    export DRAFT ONLY_TOOLS RESULTS TOOL
+    export -f runone timedrun
+
+    runs=$((runs+1))
+    printf '%s\n' $tests | xargs -P "$JOBS" -I{} bash -c 'runone {}'
+    report $tests
+    failures=$(cat "$RESULTS/failed" 2>/dev/null || echo 1)
+    rm -rf "$RESULTS"
+}
+
 if [[ $PLATFORM == "Linux" ]]; then
-    runtest "$(readlink -f $runner)"
+    runner="$(readlink -f $runner)"
+else
+    runner="$(greadlink -f $runner)"
+fi
+
+if [[ -z "$TEST_L" && ( -n "$JOBS_SET" || -n "$SHARD" || -n "$JUNIT_XML" || -n "$JSON_OUT" || -n "$BASELINE" ) ]]; then
+    runparallel "$runner"
 else
-    runtest "$(greadlink -f $runner)"
+    runtest "$runner"
 fi
 
 # Final reporting
@@ -90,4 +310,5 @@ else
     fi
 fi
 
-exit $failures
+# Exit statuses wrap at 256, so that many failures must not look like success.
+exit $(( failures > 255 ? 255 : failures ))